@@ -0,0 +1,423 @@
+import sys
+import os
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+from typing import Callable, Dict, List
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# offline component benchmarks - no Groq, no model download. the fake
+# chat model / hashing embeddings stand in (src/offline.py) and every
+# store lives in a temp dir over a synthetic AI4I-shaped corpus.
+#
+#   python evaluation/benchmark.py --scales 10000 100000
+#   python evaluation/benchmark.py --save-baseline      # record a baseline
+#   python evaluation/benchmark.py --fail-on-regression # CI guard
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(HERE, "benchmark_baseline.json")
+RESULTS_PATH = os.path.join(HERE, "benchmark_results.json")
+
+QUERIES = [
+    "Why is M001 showing bearing failure with high torque?",
+    "How to fix tool wear failure on type L machines?",
+    "Has heat dissipation failure happened before?",
+    "What is the status of M003?",
+    "Which machines are critical?",
+    "overstrain failure high torque low speed",
+]
+
+# materialising the corpus as a list only makes sense up to here
+LIST_LIMIT = 100_000
+
+
+def configure(workdir: str, llm_latency: float, vector_backend: str = "chroma"):
+    # paths + backends are read at import time, set them before any src import
+    os.environ.update({
+        "VECTOR_BACKEND": vector_backend,
+        "ANN_INDEX_PATH": os.path.join(workdir, "ann_index"),
+        "LLM_BACKEND": "fake",
+        "LLM_FAKE_LATENCY": str(llm_latency),
+        "EMBED_BACKEND": "fake",
+        "EMBED_WORKERS": "1",
+        "CHROMA_DB_PATH": os.path.join(workdir, "chroma_db"),
+        "BM25_INDEX_PATH": os.path.join(workdir, "bm25_index"),
+        "CACHE_DB_PATH": os.path.join(workdir, "cache.db"),
+        "FAILURE_STATS_PATH": os.path.join(workdir, "failure_stats.json"),
+        "SAP_DATA_PATH": os.path.join(workdir, "raw", "sap_maintenance.csv"),
+        "DEFECT_DATA_PATH": os.path.join(workdir, "raw", "defect_records.csv"),
+        # measure the real work, not the stage memo
+        "STAGE_CACHE": "0",
+    })
+    os.environ.setdefault("GROQ_API_KEY", "offline")
+
+
+def write_corpus(raw: str, n: int, seed: int = 42, chunk: int = 100_000):
+    """AI4I-shaped defect table, failures generated by the dataset's own rules."""
+    import numpy as np
+    import pandas as pd
+
+    os.makedirs(raw, exist_ok=True)
+    shutil.copy(os.path.join(HERE, "..", "data", "raw", "sap_maintenance.csv"),
+                os.path.join(raw, "sap_maintenance.csv"))
+
+    rng = np.random.default_rng(seed)
+    path = os.path.join(raw, "defect_records.csv")
+    for start in range(0, n, chunk):
+        size = min(chunk, n - start)
+        udi = np.arange(start + 1, start + size + 1)
+        types = rng.choice(np.array(["L", "M", "H"]), size=size, p=[0.6, 0.3, 0.1])
+        air = np.round(rng.normal(300, 2, size), 1)
+        process = np.round(air + 10 + rng.normal(0, 1, size), 1)
+        rpm = np.clip(rng.normal(1538, 179, size), 1168, 2886).round()
+        torque = np.clip(rng.normal(40, 10, size), 3.8, 76.6).round(1)
+        wear = rng.integers(0, 254, size)
+        power = torque * rpm * 2 * np.pi / 60
+        limits = np.select([types == "L", types == "M"], [11000, 12000], 13000)
+
+        twf = ((wear >= 200) & (wear <= 240) & (rng.random(size) < 0.1)).astype(int)
+        hdf = ((process - air < 8.6) & (rpm < 1380)).astype(int)
+        pwf = ((power < 3500) | (power > 9000)).astype(int)
+        osf = (wear * torque > limits).astype(int)
+        rnf = (rng.random(size) < 0.001).astype(int)
+        failure = (twf | hdf | pwf | osf | rnf).astype(int)
+
+        pd.DataFrame({
+            "UDI": udi,
+            "Product ID": [f"{t}{40000 + u}" for t, u in zip(types, udi)],
+            "Type": types,
+            "Air temperature [K]": air,
+            "Process temperature [K]": process,
+            "Rotational speed [rpm]": rpm.astype(int),
+            "Torque [Nm]": torque,
+            "Tool wear [min]": wear,
+            "Machine failure": failure,
+            "TWF": twf, "HDF": hdf, "PWF": pwf, "OSF": osf, "RNF": rnf,
+        }).to_csv(path, mode="w" if start == 0 else "a", header=start == 0, index=False)
+
+
+def timed(fn: Callable, repeat: int = 1) -> List[float]:
+    """Wall time of each call, ms."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def percentiles(prefix: str, samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        f"{prefix}_p50_ms": round(statistics.median(ordered), 4),
+        f"{prefix}_p95_ms": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 4),
+    }
+
+
+def _dir_mb(path: str) -> float:
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return round(total / 1e6, 2)
+
+
+def bench_ingestion(raw: str, n: int) -> dict:
+    from src.ingestion import iter_chunks, load_and_chunk_all
+
+    out = {}
+    start = time.perf_counter()
+    count = sum(1 for _ in iter_chunks(raw))
+    elapsed = time.perf_counter() - start
+    out["iter_chunks_s"] = round(elapsed, 3)
+    out["iter_chunks_rows_per_s"] = round(count / elapsed, 1)
+    if n <= LIST_LIMIT:
+        out["load_and_chunk_all_s"] = round(timed(lambda: load_and_chunk_all(raw))[0] / 1000, 3)
+    return out
+
+
+def bench_embedding(raw: str, real: bool) -> dict:
+    from itertools import islice
+    from src.ingestion import iter_chunks
+    from src.embedding_pool import EmbeddingPool
+
+    texts = [doc.page_content for doc in islice(iter_chunks(raw), 5000)]
+    out = {}
+    pool = EmbeddingPool("fake", workers=1)
+    pool.embed(texts)
+    out["fake_docs_per_s"] = round(pool.throughput, 1)
+    if real:
+        from src.vectorstore import EMBEDDING_MODEL
+        backend = os.environ.pop("EMBED_BACKEND")
+        try:
+            with EmbeddingPool(EMBEDDING_MODEL) as pool:
+                pool.embed(texts[:2000])
+                out["model_docs_per_s"] = round(pool.throughput, 1)
+        finally:
+            os.environ["EMBED_BACKEND"] = backend
+    return out
+
+
+def bench_bm25(raw: str, repeat: int) -> dict:
+    from src.ingestion import iter_chunks
+    from src.bm25_index import BM25_INDEX_PATH, build_bm25_index
+    from src.entities import build_filter
+
+    out = {}
+    start = time.perf_counter()
+    index = build_bm25_index(iter_chunks(raw))
+    out["build_s"] = round(time.perf_counter() - start, 3)
+    out["index_mb"] = _dir_mb(BM25_INDEX_PATH)
+
+    samples = []
+    filtered = []
+    for _ in range(repeat):
+        for query in QUERIES:
+            samples += timed(lambda: index.search_with_scores(query, k=20))
+            spec = build_filter(query)
+            if spec:
+                filtered += timed(lambda: index.search_with_scores(query, k=20, spec=spec))
+    out.update(percentiles("query", samples))
+    out.update(percentiles("filtered_query", filtered))
+    return out
+
+
+def bench_vectorstore(raw: str, repeat: int) -> dict:
+    from src.ingestion import iter_chunks
+    from src.vectorstore import STORE_PATH, build_vectorstore
+    from src.engine import get_engine
+
+    out = {}
+    shutil.rmtree(STORE_PATH, ignore_errors=True)
+    start = time.perf_counter()
+    build_vectorstore(iter_chunks(raw), workers=1)
+    out["build_s"] = round(time.perf_counter() - start, 3)
+    out["store_mb"] = _dir_mb(STORE_PATH)
+
+    engine = get_engine()
+    engine.reload()
+    samples = []
+    for _ in range(repeat):
+        for query in QUERIES:
+            samples += timed(lambda: engine.search(query))
+    out.update(percentiles("hybrid_search", samples))
+    out["search_batch_ms"] = round(timed(lambda: engine.search_batch(QUERIES))[0], 4)
+    return out
+
+
+def bench_sap(repeat: int) -> dict:
+    from src.agents.sap_agent import query_sap_maintenance, route_sap_query
+    from src.escalation_rules import plant_sweep
+
+    out = {}
+    out.update(percentiles("tool", [
+        t for _ in range(repeat) for t in timed(lambda: query_sap_maintenance.invoke({"machine_id": "M003"}))
+    ]))
+    out.update(percentiles("route", [
+        t for _ in range(repeat) for query in QUERIES for t in timed(lambda: route_sap_query(query))
+    ]))
+    out.update(percentiles("plant_sweep", timed(plant_sweep, repeat)))
+    return out
+
+
+def bench_cache(workdir: str, repeat: int, semantic: bool) -> dict:
+    import src.cache as cache
+
+    cache.CACHE_SEMANTIC = semantic
+    store = cache.QueryCache(os.path.join(workdir, "bench_cache.db"))
+    state = {"query": "", "intent": "root_cause", "retrieved_ids": [f"c{i}" for i in range(5)],
+             "reasoning": "analysis " * 200, "final_answer": {"summary": "x" * 300}}
+    keys = [f"why is machine M{i % 999:03d} failing with error {i}" for i in range(200)]
+
+    out = {}
+    out.update(percentiles("set", [t for key in keys for t in timed(lambda: store.set(key, state))]))
+    store._memory.clear()
+    out.update(percentiles("get_disk", [t for key in keys for t in timed(lambda: store.get(key))]))
+    out.update(percentiles("get_memory", [t for _ in range(repeat) for key in keys[:50]
+                                          for t in timed(lambda: store.get(key))]))
+    out.update(percentiles("miss", [t for i in range(100) for t in timed(lambda: store.get(f"unseen {i}"))]))
+    out["db_mb"] = round(os.path.getsize(os.path.join(workdir, "bench_cache.db")) / 1e6, 3)
+    return out
+
+
+def bench_pipeline(repeat: int) -> dict:
+    from graph import aria, initial_state
+
+    samples = []
+    for _ in range(repeat):
+        for query in QUERIES:
+            samples += timed(lambda: aria.invoke(initial_state(query)))
+    return percentiles("invoke", samples)
+
+
+def run_scale(workdir: str, n: int, args) -> dict:
+    raw = os.path.join(workdir, "raw")
+    shutil.rmtree(raw, ignore_errors=True)
+    start = time.perf_counter()
+    write_corpus(raw, n)
+    print(f"\n=== {n} rows (corpus written in {time.perf_counter() - start:.1f}s) ===")
+
+    results = {}
+    components = [
+        ("ingestion", lambda: bench_ingestion(raw, n)),
+        ("embedding", lambda: bench_embedding(raw, args.real_embeddings)),
+        ("bm25", lambda: bench_bm25(raw, args.repeat)),
+        ("vectorstore", lambda: bench_vectorstore(raw, args.repeat)),
+        ("sap", lambda: bench_sap(args.repeat)),
+        ("cache", lambda: bench_cache(workdir, args.repeat, semantic=_has(results, "vectorstore"))),
+        ("pipeline", lambda: bench_pipeline(args.repeat)),
+    ]
+    for name, bench in components:
+        if args.only and name not in args.only:
+            continue
+        if name == "pipeline" and not _has(results, "vectorstore") and not args.only:
+            results[name] = {"skipped": "needs the vectorstore"}
+            continue
+        try:
+            results[name] = bench()
+            print(f"{name}: {results[name]}")
+        except ImportError as e:
+            # e.g. chromadb not installed, the rest still runs
+            results[name] = {"skipped": str(e)}
+            print(f"{name}: skipped ({e})")
+    return results
+
+
+def _has(results: dict, name: str) -> bool:
+    return name in results and "skipped" not in results[name]
+
+
+def _flatten(results: dict) -> Dict[str, float]:
+    flat = {}
+    for scale, components in results.items():
+        for component, metrics in components.items():
+            for metric, value in metrics.items():
+                if isinstance(value, (int, float)):
+                    flat[f"{scale}.{component}.{metric}"] = value
+    return flat
+
+
+# run settings that change the numbers themselves, a baseline taken with
+# different ones isn't comparable (older baselines predate vector_backend)
+COMPARABLE_META = {"llm_latency": 0.0, "vector_backend": "chroma", "repeat": 5}
+
+
+def mismatched(current: dict, baseline: dict) -> List[str]:
+    """Run settings that differ between current and baseline."""
+    return [f"{key}={baseline['meta'].get(key, default)} vs {current['meta'].get(key, default)}"
+            for key, default in COMPARABLE_META.items()
+            if baseline["meta"].get(key, default) != current["meta"].get(key, default)]
+
+
+# which way is better for each kind of metric, 1 = higher, -1 = lower.
+# matched on the end of the metric name, longest first so _per_s wins
+# over _s. a metric that matches nothing is printed but never flagged,
+# give it a direction here when a bench grows one
+METRIC_DIRECTION = {
+    "_per_s": 1,
+    "recall": 1,
+    "hit_rate": 1,
+    "_ratio": 1,
+    "speedup": 1,
+    "vs_float32": 1,
+    "_ms": -1,
+    "_s": -1,
+    "_mb": -1,
+}
+
+
+def direction(metric: str) -> int:
+    for suffix in sorted(METRIC_DIRECTION, key=len, reverse=True):
+        if metric.endswith(suffix):
+            return METRIC_DIRECTION[suffix]
+    return 0
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Metrics that got worse than baseline by more than tolerance."""
+    now, base = _flatten(current["results"]), _flatten(baseline["results"])
+    regressions = []
+    for key in sorted(now.keys() & base.keys()):
+        old, new = base[key], now[key]
+        if not old:
+            continue
+        better = direction(key)
+        change = (new - old) / old
+        worse = -better * change > tolerance
+        marker = "REGRESSION" if worse else "" if better else "(no direction)"
+        print(f"  {key:60s} {old:>12.4f} -> {new:>12.4f} ({change:+.1%}) {marker}")
+        if worse:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="offline ARIA component benchmarks")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10_000],
+                        help="synthetic corpus sizes, e.g. 10000 100000 1000000")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions per measured call")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds per fake LLM call")
+    parser.add_argument("--only", nargs="+", help="run just these components")
+    parser.add_argument("--real-embeddings", action="store_true", help="also time the MiniLM model")
+    parser.add_argument("--vector-backend", choices=["chroma", "ann"], default="chroma")
+    parser.add_argument("--out", default=RESULTS_PATH)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown vs baseline")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--keep", action="store_true", help="keep the temp working dir")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="aria_bench_")
+    configure(workdir, args.llm_latency, args.vector_backend)
+    try:
+        results = {str(n): run_scale(workdir, n, args) for n in args.scales}
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "llm_latency": args.llm_latency,
+            "vector_backend": args.vector_backend,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nresults -> {args.out}")
+
+    if args.save_baseline:
+        shutil.copy(args.out, args.baseline)
+        print(f"baseline -> {args.baseline}")
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        differs = mismatched(report, baseline)
+        if differs:
+            print(f"\nnot comparing against baseline ({baseline['meta']['timestamp']}), "
+                  f"run settings differ: {', '.join(differs)}. rerun with the same settings "
+                  f"or --save-baseline")
+            # a gate that silently compared nothing would pass every time
+            if args.fail_on_regression:
+                sys.exit(2)
+            return
+        print(f"\nvs baseline ({baseline['meta']['timestamp']}, tolerance {args.tolerance:.0%}):")
+        regressions = compare(report, baseline, args.tolerance)
+        print(f"{len(regressions)} regressions")
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import sys
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from typing import Dict, List
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# A/B of the vector backends on the same vectors - chroma vs the quantized
+# ANN index (int8 / binary, rescoring on / off, a few nprobe settings).
+# recall@k is against exact float32 search, latency is per query.
+#
+#   python evaluation/vector_ab.py --scale 100000
+#   python evaluation/vector_ab.py --scale 1000000 --k 10 --nprobe 16 64 128
+#   python evaluation/vector_ab.py --real-data --real-embeddings
+
+from benchmark import configure, percentiles, write_corpus, _dir_mb, HERE
+
+RESULTS_PATH = os.path.join(HERE, "vector_ab_results.json")
+
+
+def _queries(bm25, n: int, seed: int = 7) -> List[str]:
+    # technician-style questions built from random rows, plus the fixed set
+    import numpy as np
+    from benchmark import QUERIES
+
+    rng = np.random.default_rng(seed)
+    queries = list(QUERIES)
+    for idx in rng.choice(len(bm25), size=min(n, len(bm25)), replace=False):
+        meta = bm25.get_document(int(idx)).metadata
+        if meta.get("doc_type") == "defect_record":
+            queries.append(f"type {meta.get('type')} machine torque {meta.get('torque_nm')} Nm "
+                           f"speed {meta.get('rotational_speed_rpm')} rpm tool wear {meta.get('tool_wear_min')} min")
+        else:
+            queries.append(f"maintenance status of {meta.get('machine_id', 'machine')}")
+    return queries[:n]
+
+
+def _recall(found: List[List[int]], truth: List[tuple], k: int) -> float:
+    # a hit is anything scoring at least the k-th exact score - synthetic
+    # rows tie a lot and which of the tied docs comes back doesn't matter
+    hits = sum(int((scores[f] >= kth - 1e-6).sum()) for f, (scores, kth) in zip(found, truth))
+    return round(hits / max(len(found) * k, 1), 4)
+
+
+def _run(name: str, search, vectors, truth: List[tuple], k: int) -> dict:
+    found, samples = [], []
+    for vector in vectors:
+        start = time.perf_counter()
+        found.append(search(vector))
+        samples.append((time.perf_counter() - start) * 1000)
+    out = {"recall": _recall(found, truth, k), **percentiles("query", samples)}
+    print(f"{name}: {out}")
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="chroma vs quantized ANN index, recall@k and latency")
+    parser.add_argument("--scale", type=int, default=100_000, help="synthetic corpus rows")
+    parser.add_argument("--real-data", action="store_true", help="use DEFECT_DATA_PATH / SAP_DATA_PATH instead")
+    parser.add_argument("--real-embeddings", action="store_true", help="MiniLM instead of hashing embeddings")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=20, help="recall@k, retrieval asks for CANDIDATE_K=20")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[16, 32, 64])
+    parser.add_argument("--out", default=RESULTS_PATH)
+    parser.add_argument("--keep", action="store_true", help="keep the temp working dir")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="aria_ab_")
+    real_paths = {key: os.getenv(key, default) for key, default in
+                  [("DEFECT_DATA_PATH", "./data/raw/defect_records.csv"),
+                   ("SAP_DATA_PATH", "./data/raw/sap_maintenance.csv")]}
+    configure(workdir, 0.0, "ann")
+    if args.real_embeddings:
+        os.environ["EMBED_BACKEND"] = "torch"
+    raw = os.path.join(workdir, "raw")
+    if args.real_data:
+        os.makedirs(raw)
+        shutil.copy(real_paths["DEFECT_DATA_PATH"], os.path.join(raw, "defect_records.csv"))
+        shutil.copy(real_paths["SAP_DATA_PATH"], os.path.join(raw, "sap_maintenance.csv"))
+    else:
+        write_corpus(raw, args.scale)
+
+    import numpy as np
+    from src.ingestion import iter_chunks
+    from src.vectorstore import build_vectorstore, get_embeddings
+    from src.ann_index import ANNIndexBuilder, ANN_INDEX_PATH, _normalize
+
+    results: Dict[str, dict] = {}
+    try:
+        start = time.perf_counter()
+        vs = build_vectorstore(iter_chunks(raw), workers=1)
+        build_s = time.perf_counter() - start
+        index, bm25 = vs.index, vs.bm25
+        n, dim = len(index), index.dim
+        exact = np.asarray(index.vectors)
+        print(f"{n} vectors x {dim}, built in {build_s:.1f}s")
+
+        embeddings = get_embeddings()
+        queries = _queries(bm25, args.queries)
+        vectors = _normalize(np.asarray(embeddings.embed_documents(queries), dtype=np.float32))
+        # exact float32 scores per query and the k-th best of them
+        truth = []
+        for v in vectors:
+            scores = exact @ v
+            truth.append((scores, np.partition(scores, -args.k)[-args.k]))
+        float32_mb = n * dim * 4 / 1e6
+        results["exact"] = {"float32_mb": round(float32_mb, 2)}
+
+        # binary codes from the same float32 vectors, no second embedding pass
+        binary_path = os.path.join(workdir, "ann_binary")
+        builder = ANNIndexBuilder(binary_path, "binary")
+        builder.add(list(range(n)), [""] * n, exact)
+        binary = builder.save(bm25.version)
+
+        for label, ann, path in [("int8", index, ANN_INDEX_PATH), ("binary", binary, binary_path)]:
+            resident_mb = ann.resident_bytes() / 1e6
+            for rescore in (True, False):
+                for nprobe in args.nprobe:
+                    name = f"ann_{label}_nprobe{nprobe}{'_rescore' if rescore else ''}"
+                    search = lambda v, ann=ann, nprobe=nprobe, rescore=rescore: \
+                        ann.search(v, args.k, nprobe=nprobe, rescore=rescore)[0].tolist()
+                    results[name] = _run(name, search, vectors, truth, args.k)
+                    results[name].update({
+                        "resident_mb": round(resident_mb, 2),
+                        "resident_mb_per_million": round(resident_mb / n * 1e6, 1),
+                        "vs_float32": round(float32_mb / resident_mb, 1),
+                        "disk_mb": _dir_mb(path),
+                    })
+
+        try:
+            import chromadb  # noqa: F401
+            from langchain_community.vectorstores import Chroma
+
+            # same vectors into chroma, ids are BM25 doc positions
+            chroma_path = os.path.join(workdir, "chroma_ab")
+            store = Chroma(persist_directory=chroma_path, embedding_function=embeddings, collection_name="ab")
+            start = time.perf_counter()
+            for i in range(0, n, 5000):
+                ids = range(i, min(i + 5000, n))
+                docs = [bm25.get_document(j) for j in ids]
+                store._collection.upsert(ids=[str(j) for j in ids], embeddings=exact[i:i + 5000].tolist(),
+                                         documents=[d.page_content for d in docs],
+                                         metadatas=[d.metadata for d in docs])
+            chroma_build = time.perf_counter() - start
+            search = lambda v: [int(j) for j in store._collection.query(
+                query_embeddings=[v.tolist()], n_results=args.k, include=[])["ids"][0]]
+            results["chroma"] = _run("chroma", search, vectors, truth, args.k)
+            results["chroma"].update({"disk_mb": _dir_mb(chroma_path), "load_s": round(chroma_build, 2)})
+        except ImportError as e:
+            results["chroma"] = {"skipped": str(e)}
+            print(f"chroma: skipped ({e})")
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "vectors": n, "dim": dim,
+                       "k": args.k, "queries": len(queries), "real_data": args.real_data,
+                       "real_embeddings": args.real_embeddings},
+              "results": results}
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nresults -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
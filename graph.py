@@ -1,32 +1,65 @@
 import os
-from typing import TypedDict, List, Optional
-from langgraph.graph import StateGraph, END
+from typing import Annotated, TypedDict, List, Optional
+from langgraph.graph import StateGraph, START, END
+from langchain_core.runnables import RunnableLambda
 from dotenv import load_dotenv
 
 load_dotenv()
 
 # importing all agents
-from src.agents.classifier import classify_intent
-from src.agents.retrieval import retrieve_documents
-from src.agents.sap_agent import sap_connector
-from src.agents.reasoning import reason_over_docs
-from src.agents.synthesis import synthesize_response
+from src.agents.classifier import classify_intent, aclassify_intent
+from src.agents.retrieval import retrieve_documents, aretrieve_documents
+from src.agents.sap_agent import sap_connector, asap_connector
+from src.agents.reasoning import reason_over_docs, areason_over_docs
+from src.agents.synthesis import synthesize_response, asynthesize_response
 from src.agents.escalation import escalation_agent
+from src.telemetry import traced
 
 
-# shared state - every agent reads and writes to this
+def _first_error(current: Optional[str], new: Optional[str]) -> Optional[str]:
+    # any node can report an error, keep the first one instead of clashing
+    return current or new
+
+
+# shared state - every agent reads it, but each agent only returns the
+# keys it owns. classifier, retrieval and sap run in the same step so
+# they must never write the same key (langgraph rejects that)
 class ARIAState(TypedDict):
     query: str
-    intent: str
-    intent_confidence: float
-    retrieved_docs: List[str]
-    retrieval_confidence: float
-    sap_context: dict
-    reasoning: str
-    final_answer: dict
-    escalation: dict
-    iterations: int
-    error: Optional[str]
+    intent: str                 # classifier
+    intent_confidence: float    # classifier
+    retrieved_docs: List[str]   # retrieval
+    retrieved_ids: List[str]    # retrieval, chunk ids of retrieved_docs
+    retrieval_confidence: float  # retrieval
+    retrieval_exhausted: bool   # retrieval, True when another pass can't help
+    sap_context: dict           # sap
+    reasoning: str              # reasoning
+    final_answer: dict          # synthesis
+    escalation: dict            # escalation
+    iterations: int             # retrieval
+    error: Annotated[Optional[str], _first_error]
+    prefetched: dict            # batch runs only, see main.arun_batch
+
+
+def initial_state(query: str, prefetched: Optional[dict] = None) -> ARIAState:
+    # starting state for a fresh query, main.py uses this too
+    # prefetched maps node -> update already computed for a whole batch
+    return {
+        "query": query,
+        "intent": "",
+        "intent_confidence": 0.0,
+        "retrieved_docs": [],
+        "retrieved_ids": [],
+        "retrieval_confidence": 0.0,
+        "retrieval_exhausted": False,
+        "sap_context": {},
+        "reasoning": "",
+        "final_answer": {},
+        "escalation": {},
+        "iterations": 0,
+        "error": None,
+        "prefetched": prefetched or {}
+    }
 
 
 def route_after_classifier(state: ARIAState) -> str:
@@ -39,41 +72,81 @@ def route_after_classifier(state: ARIAState) -> str:
 
 def should_retry(state: ARIAState) -> str:
     # retry retrieval if confidence too low, max 3 times
+    # no point retrying once the candidate pool can't get any wider or
+    # the last retry didn't improve on the pass before it
+    if state.get("retrieval_exhausted", False):
+        return "continue"
     if state.get("retrieval_confidence", 1) < 0.4 and state.get("iterations", 0) < 3:
         return "retry"
     return "continue"
 
 
-def build_graph():
-    graph = StateGraph(ARIAState)
+def join_stages(state: ARIAState) -> dict:
+    # barrier after the fan-out, nothing to compute
+    return {}
+
+
+def _node(node: str, func, afunc=None) -> RunnableLambda:
+    # every node is timed - wall time, errors, retrieval passes and docs
+    # go to /metrics and into the per-request breakdown
+    return RunnableLambda(traced(node, func), afunc=traced(node, afunc) if afunc else None)
+
 
-    # register all nodes
-    graph.add_node("classifier", classify_intent)
-    graph.add_node("retrieval", retrieve_documents)
-    graph.add_node("sap", sap_connector)
-    graph.add_node("reasoning", reason_over_docs)
-    graph.add_node("synthesis", synthesize_response)
-    graph.add_node("escalation", escalation_agent)
+def _prefetchable(node: str, func, afunc) -> RunnableLambda:
+    # first pass of a node answered from the batch prefetch if there is
+    # one, retrieval retries and everything else run the node as usual
+    def lookup(state: ARIAState) -> Optional[dict]:
+        if state.get("iterations", 0) == 0:
+            return state.get("prefetched", {}).get(node)
+        return None
 
-    # entry point
-    graph.set_entry_point("classifier")
+    def run(state: ARIAState) -> dict:
+        update = lookup(state)
+        return update if update is not None else func(state)
 
-    # classifier to retrieval always
-    graph.add_edge("classifier", "retrieval")
+    async def arun(state: ARIAState) -> dict:
+        update = lookup(state)
+        return update if update is not None else await afunc(state)
+
+    return _node(node, run, arun)
+
+
+def build_graph():
+    graph = StateGraph(ARIAState)
+
+    # register all nodes - sync version for aria.invoke, async one for
+    # aria.ainvoke / astream so LLM calls don't hold a thread each
+    graph.add_node("classifier", _node("classifier", classify_intent, aclassify_intent))
+    graph.add_node("retrieval", _prefetchable("retrieval", retrieve_documents, aretrieve_documents))
+    graph.add_node("retrieval_done", join_stages)
+    graph.add_node("sap", _prefetchable("sap", sap_connector, asap_connector))
+    graph.add_node("join", join_stages)
+    graph.add_node("reasoning", _node("reasoning", reason_over_docs, areason_over_docs))
+    graph.add_node("synthesis", _node("synthesis", synthesize_response, asynthesize_response))
+    graph.add_node("escalation", _node("escalation", escalation_agent))
+
+    # classifier, retrieval and sap don't need each other's output,
+    # fan out so latency is the slowest of the three, not the sum
+    graph.add_edge(START, "classifier")
+    graph.add_edge(START, "retrieval")
+    graph.add_edge(START, "sap")
 
     # retrieval to retry or continue based on confidence
     graph.add_conditional_edges(
         "retrieval",
         should_retry,
         {
-            "retry": "retrieval",   # loop back
-            "continue": "sap"       # move forward
+            "retry": "retrieval",         # loop back
+            "continue": "retrieval_done"  # move forward
         }
     )
 
-    # sap to classifier decides next (reasoning or synthesis)
+    # wait for all three branches (retries included) before routing
+    graph.add_edge(["classifier", "retrieval_done", "sap"], "join")
+
+    # classifier intent decides next (reasoning or synthesis)
     graph.add_conditional_edges(
-        "sap",
+        "join",
         route_after_classifier,
         {
             "reasoning": "reasoning",
@@ -98,19 +171,7 @@ aria = build_graph()
 if __name__ == "__main__":
     print("Testing ARIA pipeline...\n")
 
-    result = aria.invoke({
-        "query": "Why is machine M001 showing bearing failure with high torque?",
-        "intent": "",
-        "intent_confidence": 0.0,
-        "retrieved_docs": [],
-        "retrieval_confidence": 0.0,
-        "sap_context": {},
-        "reasoning": "",
-        "final_answer": {},
-        "escalation": {},
-        "iterations": 0,
-        "error": None
-    })
+    result = aria.invoke(initial_state("Why is machine M001 showing bearing failure with high torque?"))
 
     print("\n=== ARIA RESPONSE ===")
     print(f"Intent: {result['intent']}")
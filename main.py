@@ -1,40 +1,322 @@
 import sys
 import os
+import json
+import time
+import asyncio
+import argparse
+from typing import AsyncIterator, Dict, List, Tuple
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from graph import aria
-from src.cache import get_cached, set_cache
+from graph import aria, initial_state
+from src.cache import get_cached, set_cache, aget_cached, aset_cache
+from src.agents.synthesis import ARIAResponse
+from src.agents.retrieval import prefetch_retrieval
+from src.agents.sap_agent import prefetch_sap
+from src.telemetry import observe_request, request_trace, get_profiler
+from src.singleflight import COALESCE, acoalesced, coalesced, flight_key, get_flights
+
+# how many batch queries are in the LLM stages at once
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
 
 
 def run(query: str) -> dict:
+    start = time.perf_counter()
     # checking cache memory first
     cached = get_cached(query)
     if cached:
         print("cache hit")
+        observe_request(start, cached=True)
+        return cached
+
+    def execute() -> dict:
+        result = aria.invoke(initial_state(query))
+        set_cache(query, result)
+        return result
+
+    # same question already running in another thread - wait for it
+    # instead of paying for the LLM calls twice
+    result, shared = coalesced(query, execute)
+    if shared:
+        print("joined in-flight run")
+    observe_request(start, cached=False)
+    return dict(result) if shared else result
+
+
+async def arun(query: str) -> dict:
+    # same as run, but the whole path is async - used by the API
+    start = time.perf_counter()
+    cached = await aget_cached(query)
+    if cached:
+        print("cache hit")
+        observe_request(start, cached=True)
         return cached
 
-    result = aria.invoke({
-        "query": query,
-        "intent": "",
-        "intent_confidence": 0.0,
-        "retrieved_docs": [],
-        "retrieval_confidence": 0.0,
-        "sap_context": {},
-        "reasoning": "",
-        "final_answer": {},
-        "escalation": {},
-        "iterations": 0,
-        "error": None
-    })
+    async def execute() -> dict:
+        result = await aria.ainvoke(initial_state(query))
+        await aset_cache(query, result)
+        return result
+
+    result, shared = await acoalesced(query, execute)
+    if shared:
+        print("joined in-flight run")
+    observe_request(start, cached=False)
+    return dict(result) if shared else result
+
+
+async def arun_batch(queries: List[str], concurrency: int = BATCH_CONCURRENCY) -> List[dict]:
+    """
+    Runs many queries as one job, results in input order.
+    Duplicate queries run once, cached ones aren't run at all. The
+    stages that don't need an LLM are done up front for the whole
+    batch - one embedding call + one chroma query per filter for
+    retrieval, one SAP call per distinct tool call - then the graphs
+    run concurrently and pick those results up instead of redoing them.
+    """
+    unique = list(dict.fromkeys(queries))
+    results = {}
+    for query in unique:
+        start = time.perf_counter()
+        cached = await aget_cached(query)
+        if cached:
+            results[query] = cached
+            observe_request(start, cached=True)
+    pending = [query for query in unique if query not in results]
+    print(f"batch: {len(queries)} queries, {len(unique)} unique, {len(pending)} to run")
+
+    if pending:
+        retrieval, sap = await asyncio.gather(
+            asyncio.to_thread(prefetch_retrieval, pending),
+            asyncio.to_thread(prefetch_sap, pending)
+        )
+        limit = asyncio.Semaphore(concurrency)
+
+        async def one(query: str):
+            start = time.perf_counter()
+            prefetched = {"retrieval": retrieval[query]}
+            if query in sap:
+                prefetched["sap"] = sap[query]
+
+            async def execute() -> dict:
+                async with limit:
+                    result = await aria.ainvoke(initial_state(query, prefetched))
+                result.pop("prefetched", None)
+                await aset_cache(query, result)
+                return result
+
+            # API requests for the same question attach to this run too
+            result, shared = await acoalesced(query, execute)
+            results[query] = dict(result) if shared else result
+            observe_request(start, cached=False)
+
+        await asyncio.gather(*(one(query) for query in pending))
+
+    return [results[query] for query in queries]
+
+
+def _read_queries(path: str, field: str) -> List[str]:
+    # jsonl of {"query": ...} / {"question": ...} objects or bare strings
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                queries.append(item)
+            else:
+                queries.append(item.get(field) or item.get("query") or item["question"])
+    return queries
+
+
+def run_batch_file(in_path: str, out_path: str, field: str = "query", concurrency: int = BATCH_CONCURRENCY):
+    queries = _read_queries(in_path, field)
+    start = time.perf_counter()
+    results = asyncio.run(arun_batch(queries, concurrency))
+    elapsed = time.perf_counter() - start
+
+    with open(out_path, "w", encoding="utf-8") as f:
+        for query, result in zip(queries, results):
+            f.write(json.dumps({
+                "query": query,
+                "intent": result["intent"],
+                "answer": result["final_answer"],
+                "escalation": result["escalation"],
+                "sap_context": result["sap_context"]
+            }, default=str) + "\n")
+
+    rate = len(queries) / elapsed * 60 if elapsed else 0.0
+    print(f"batch done: {len(queries)} queries in {elapsed:.1f}s ({rate:.0f} queries/min) -> {out_path}")
 
-    set_cache(query, result)
-    return result
+
+def _stage_event(node: str, update: dict):
+    # node update -> (event name, payload) for the stream, None to skip
+    if node == "classifier":
+        return "intent", {"intent": update["intent"], "confidence": update["intent_confidence"]}
+    if node == "retrieval":
+        return "sources", {
+            "docs": update["retrieved_docs"],
+            "confidence": update["retrieval_confidence"],
+            "iteration": update["iterations"]
+        }
+    if node == "sap":
+        return "sap", update["sap_context"]
+    if node == "synthesis":
+        answer = update["final_answer"]
+        try:
+            answer = ARIAResponse(**answer).model_dump()
+        except Exception:
+            pass  # fallback / partial answers still go out as-is
+        return "answer", answer
+    if node == "escalation":
+        return "escalation", update["escalation"]
+    return None
+
+
+class _StreamLog:
+    # events of one streaming run, every stream for the same question
+    # reads them - from the start, then live as they are published
+    def __init__(self):
+        self.events: List[Tuple[str, dict]] = []
+        self.closed = False
+        self._changed = asyncio.Condition()
+
+    async def publish(self, event: Tuple[str, dict]):
+        async with self._changed:
+            self.events.append(event)
+            self._changed.notify_all()
+
+    async def close(self):
+        async with self._changed:
+            self.closed = True
+            self._changed.notify_all()
+
+    async def follow(self) -> AsyncIterator[Tuple[str, dict]]:
+        seen = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: len(self.events) > seen or self.closed)
+                events, closed = self.events[seen:], self.closed
+            seen += len(events)
+            for event in events:
+                yield event
+            if closed and seen == len(self.events):
+                return
+
+
+# flight key -> log of the streaming run for it, same event loop only
+_streams: Dict[str, _StreamLog] = {}
+
+
+async def _stream_pipeline(query: str, log: _StreamLog, key: str = "") -> dict:
+    # one pipeline run, stage events go to the log, the final state is
+    # the result /query callers coalescing onto this run get
+    state = initial_state(query)
+    try:
+        async for mode, chunk in aria.astream(state, stream_mode=["updates", "messages"]):
+            if mode == "messages":
+                message, metadata = chunk
+                if metadata.get("langgraph_node") == "reasoning" and message.content:
+                    await log.publish(("reasoning_token", {"text": message.content}))
+                continue
+
+            for node, update in chunk.items():
+                if not update:
+                    continue
+                state.update(update)
+                event = _stage_event(node, update)
+                if event:
+                    await log.publish(event)
+
+        await aset_cache(query, state)
+        return state
+    finally:
+        await log.close()
+        if _streams.get(key) is log:
+            del _streams[key]
+
+
+async def astream(query: str) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Yields (event, payload) as each stage finishes - intent, sources,
+    sap, reasoning tokens as the model produces them, answer, escalation
+    and finally done. Total time is the same as arun, the first event
+    shows up as soon as the fastest stage is through.
+    """
+    start = time.perf_counter()
+    cached = await aget_cached(query)
+    if cached:
+        print("cache hit")
+        observe_request(start, cached=True)
+        for node in ("classifier", "retrieval", "sap", "synthesis", "escalation"):
+            event = _stage_event(node, cached)
+            if event:
+                yield event
+        yield "done", {"cached": True}
+        return
+
+    log = _StreamLog()
+    if not COALESCE:
+        run = asyncio.ensure_future(_stream_pipeline(query, log))
+        leader = True
+    else:
+        # the streaming run is a coalesced run like any other - /query and
+        # /query/stream callers for the same question join it instead of
+        # starting their own pipeline
+        key = await asyncio.to_thread(flight_key, query)
+        run, leader = get_flights().start(key, lambda: _stream_pipeline(query, log, key))
+        if leader:
+            _streams[key] = log
+        else:
+            print("joined in-flight run")
+            # None when the run is a /query one, nothing streamed to follow
+            log = _streams.get(key)
+
+    if log is not None:
+        async for event in log.follow():
+            yield event
+    result = await asyncio.shield(run)
+    observe_request(start, cached=False)
+
+    if log is None:
+        # joined a /query run - replay its answer when it lands
+        for node in ("classifier", "retrieval", "sap", "synthesis", "escalation"):
+            event = _stage_event(node, result)
+            if event:
+                yield event
+    yield "done", {"cached": False} if leader else {"cached": False, "coalesced": True}
 
 
 if __name__ == "__main__":
-    query = sys.argv[1] if len(sys.argv) > 1 else "Why is M001 showing bearing failure?"
-    result = run(query)
-    print("\n ARIA ")
-    print(f"intent:    {result['intent']}")
-    print(f"answer:    {result['final_answer']}")
-    print(f"escalation: {result['escalation']}")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Ask ARIA one question, or a whole file of them")
+    parser.add_argument("query", nargs="?", default="Why is M001 showing bearing failure?")
+    parser.add_argument("--batch", help="jsonl file of queries to run as one batch")
+    parser.add_argument("--out", default="batch_results.jsonl", help="where batch results go")
+    parser.add_argument("--field", default="query", help="key holding the query in each batch line")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--timings", action="store_true", help="print the per-stage timing breakdown")
+    parser.add_argument("--profile", help="sample stacks while running, folded output to this file")
+    args = parser.parse_args()
+
+    if args.profile:
+        get_profiler().start()
+
+    if args.batch:
+        run_batch_file(args.batch, args.out, args.field, args.concurrency)
+    else:
+        with request_trace() as trace:
+            result = run(args.query)
+        print("\n ARIA ")
+        print(f"intent:    {result['intent']}")
+        print(f"answer:    {result['final_answer']}")
+        print(f"escalation: {result['escalation']}")
+        if args.timings:
+            print(f"timings:   {json.dumps(trace.breakdown(), indent=2)}")
+
+    if args.profile:
+        profiler = get_profiler()
+        profiler.stop()
+        profiler.save(args.profile)
+        print(f"profile: {profiler.samples} samples -> {args.profile}")
+        for entry in profiler.top(10):
+            print(f"  {entry['share']:6.1%}  {entry['frame']}")
\ No newline at end of file
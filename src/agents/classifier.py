@@ -1,25 +1,22 @@
 import os
 import json
-from langchain_groq import ChatGroq
 from langchain_core.prompts import ChatPromptTemplate
 from dotenv import load_dotenv
 
+from src.llm import get_llm
+from src.cache import normalize_query
+from src.stage_cache import stage_cache
+
 load_dotenv()
 
 # keeping temperature 0 here - we want consistent routing
 # flaky intent detection breaks the whole pipeline
-llm = ChatGroq(
-    model="llama-3.3-70b-versatile",
-    api_key=os.getenv("GROQ_API_KEY"),
-    temperature=0
-)
-
-
-def classify_intent(state: dict) -> dict:
-# function Classifies query intent to route to the correct agent.
+llm = get_llm(temperature=0)
+# intent only depends on the wording, keyed on the normalized query
+memo = stage_cache("classifier")
 
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", """You are a manufacturing query classifier.
+prompt = ChatPromptTemplate.from_messages([
+    ("system", """You are a manufacturing query classifier.
 Classify the query into exactly one of these:
 
 - root_cause: why did something fail
@@ -30,14 +27,14 @@ Classify the query into exactly one of these:
 Return valid JSON only:
 {{"intent": "one of above", "confidence": 0.0-1.0, "reasoning": "one line"}}
 """),
-        ("human", "{query}")
-    ])
+    ("human", "{query}")
+])
 
-    result = (prompt | llm).invoke({"query": state["query"]})
 
+def _parse(content: str) -> dict:
     try:
         # gemini output text cleaning 
-        text = result.content.strip().replace("```json", "").replace("```", "")
+        text = content.strip().replace("```json", "").replace("```", "")
         parsed = json.loads(text)
     except Exception:
         # adding fallback for syntax mixmatch
@@ -50,7 +47,25 @@ Return valid JSON only:
     print(f" intent: {parsed['intent']} ({parsed['confidence']})")
 
     return {
-        **state,
         "intent": parsed["intent"],
         "intent_confidence": parsed["confidence"]
-    }
\ No newline at end of file
+    }
+
+
+def classify_intent(state: dict) -> dict:
+# function Classifies query intent to route to the correct agent.
+    key = normalize_query(state["query"])
+    content = memo.get(key)
+    if content is None:
+        content = (prompt | llm).invoke({"query": state["query"]}).content
+        memo.set(key, content)
+    return _parse(content)
+
+
+async def aclassify_intent(state: dict) -> dict:
+    key = normalize_query(state["query"])
+    content = memo.get(key)
+    if content is None:
+        content = (await (prompt | llm).ainvoke({"query": state["query"]})).content
+        memo.set(key, content)
+    return _parse(content)
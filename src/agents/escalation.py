@@ -1,11 +1,10 @@
 import os
 from dotenv import load_dotenv
 
-load_dotenv()
+from src.sap_data import MaintenanceRecord
+from src.escalation_rules import get_rules
 
-# these thresholds came from looking at the dataset patterns
-LOW_STOCK_THRESHOLD = 3
-HIGH_WORKORDER_THRESHOLD = 3
+load_dotenv()
 
 
 def escalation_agent(state: dict) -> dict:
@@ -25,17 +24,13 @@ def escalation_agent(state: dict) -> dict:
         should_escalate = True
         reasons.append("critical failure pattern detected")
 
-    # check SAP stock - can't fix without parts
-    if sap.get("found") and "data" in sap:
-        sap_str = sap["data"]
-        # rough parse - good enough for MVP
-        if "Bearing stock: 1" in sap_str or "Bearing stock: 2" in sap_str:
-            should_escalate = True
-            reasons.append("low bearing stock")
-
-        if "Open work orders: 3" in sap_str or "Open work orders: 4" in sap_str:
+    # check SAP stock / work orders - can't fix without parts
+    rules = get_rules()
+    for row in sap.get("records", []):
+        record = MaintenanceRecord(**row)
+        for reason in rules.evaluate(record):
             should_escalate = True
-            reasons.append("high open work orders")
+            reasons.append(f"{reason} ({record.machine_id})")
 
     report = {
         "escalate": should_escalate,
@@ -46,4 +41,4 @@ def escalation_agent(state: dict) -> dict:
 
     print(f" priority: {report['priority']}")
 
-    return {**state, "escalation": report}
\ No newline at end of file
+    return {"escalation": report}
\ No newline at end of file
@@ -1,36 +1,66 @@
 import os
-from langchain_groq import ChatGroq
 from langchain_core.prompts import ChatPromptTemplate
 from dotenv import load_dotenv
 
+from src.llm import get_llm
+from src.stage_cache import prompt_key, stage_cache
+from src.failure_stats import get_failure_stats
+from src.context import stage_context
+
 load_dotenv()
 
-llm = ChatGroq(
-    model="llama-3.3-70b-versatile",
-    api_key=os.getenv("GROQ_API_KEY"),
-    temperature=0.2
-)
+llm = get_llm(temperature=0.2)
+# keyed on the rendered prompt - same query, docs and SAP data, same analysis
+memo = stage_cache("reasoning")
 
+prompt = ChatPromptTemplate.from_messages([
+    ("system", "You are a senior manufacturing engineer. "
+               "Analyze the machine data and identify failure patterns. "
+               "Think step by step and be specific."),
+    ("human", "Query: {query}\n\nMachine Data:\n{docs}\n\nSAP Context:\n{sap}{fleet}")
+])
 
-def reason_over_docs(state: dict) -> dict:
-    # only runs for root_cause and historical_pattern queries
-    # takes retrieved docs + SAP context and thinks through them
-    docs_text = "\n\n".join(state.get("retrieved_docs", []))
-    sap_text = str(state.get("sap_context", {}).get("data", "no SAP data"))
 
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are a senior manufacturing engineer. "
-                   "Analyze the machine data and identify failure patterns. "
-                   "Think step by step and be specific."),
-        ("human", "Query: {query}\n\nMachine Data:\n{docs}\n\nSAP Context:\n{sap}")
-    ])
+def _fleet(state: dict) -> str:
+    # a handful of retrieved rows can't say how often something happens,
+    # the precomputed counts over every record can
+    if state.get("intent") != "historical_pattern":
+        return ""
+    stats = get_failure_stats()
+    if stats is None:
+        return ""
+    return "\n\nFleet statistics (all records):\n" + stats.summary_for_query(state["query"])
+
 
-    result = (prompt | llm).invoke({
+def _inputs(state: dict) -> dict:
+    # only runs for root_cause and historical_pattern queries
+    # takes retrieved docs + SAP context and thinks through them
+    return {
         "query": state["query"],
-        "docs": docs_text,
-        "sap": sap_text
-    })
+        # ranked, deduplicated, rows as tables, cut to CONTEXT_BUDGET_REASONING
+        "docs": stage_context("reasoning", state).text,
+        "sap": str(state.get("sap_context", {}).get("data", "no SAP data")),
+        "fleet": _fleet(state)
+    }
+
 
+def reason_over_docs(state: dict) -> dict:
+    inputs = _inputs(state)
+    key = prompt_key(prompt, inputs)
+    content = memo.get(key)
+    if content is None:
+        content = (prompt | llm).invoke(inputs).content
+        memo.set(key, content)
     print(" reasoning complete")
+    return {"reasoning": content}
 
-    return {**state, "reasoning": result.content}
\ No newline at end of file
+
+async def areason_over_docs(state: dict) -> dict:
+    inputs = _inputs(state)
+    key = prompt_key(prompt, inputs)
+    content = memo.get(key)
+    if content is None:
+        content = (await (prompt | llm).ainvoke(inputs)).content
+        memo.set(key, content)
+    print(" reasoning complete")
+    return {"reasoning": content}
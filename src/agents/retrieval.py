@@ -1,56 +1,102 @@
 import os
-from typing import List
-from langchain_core.documents import Document
-from langchain_community.vectorstores import Chroma
-from langchain_community.retrievers import BM25Retriever
+import asyncio
+from typing import Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 
+from src.engine import get_engine
+from src.entities import build_filter
+from src.retriever import CANDIDATE_K
+from src.ingestion import chunk_id
+
 
 load_dotenv()
 
-TOP_K = 5
+
+def retrieval_params(query: str, iterations: int) -> Tuple[Optional[dict], bool, int]:
+    """(spec, filtered, candidate_k) for a given retrieval pass."""
+    # from the query alone - the intent shows up between passes, and a
+    # spec that changes with it would make the retries search something
+    # unrelated to pass 0 (and prefetch_retrieval never has it)
+    spec = build_filter(query)
+    filtered = spec is not None and iterations == 0
+    # a pass without the filter is the first retry, then the pool grows
+    widen = iterations - 1 if spec is not None else iterations
+    # every retry looks at a 4x wider candidate pool, same pool twice
+    # would just give the same answer back
+    return spec, filtered, CANDIDATE_K * 4 ** max(widen, 0)
+
+
+def _update(result, spec: Optional[dict], filtered: bool, iterations: int,
+            previous: Optional[dict] = None) -> dict:
+    # confidence is the mean fused score of the top results
+    confidence = result.confidence
+    docs = [doc.page_content for doc in result.docs]
+    ids = [chunk_id(doc) for doc in result.docs]
+
+    if filtered:
+        print(f"  → filter: {spec}")
+    print(f"  → retrieved {len(result.docs)} docs (confidence: {confidence})")
+
+    # a retry that neither raised the confidence nor changed the top
+    # results won't be helped by another one. on a full-size corpus the
+    # wider pool rarely moves an absolute-scale top 5, so this is what
+    # usually ends the loop
+    stalled = False
+    if previous is not None and iterations > 0:
+        prev_confidence = previous.get("retrieval_confidence", 0.0)
+        stalled = confidence <= prev_confidence or ids == previous.get("retrieved_ids", [])
+        if confidence < prev_confidence:
+            # keep the better pass instead of the one that came last
+            print(f"  → no improvement, keeping previous pass ({prev_confidence})")
+            confidence, docs, ids = prev_confidence, previous["retrieved_docs"], previous["retrieved_ids"]
+
+    return {
+        "retrieved_docs": docs,
+        "retrieved_ids": ids,
+        "retrieval_confidence": confidence,
+        # dropping the filter can still help even if the pool can't grow
+        "retrieval_exhausted": (result.exhausted and not filtered) or stalled,
+        "iterations": iterations + 1
+    }
 
 
 def retrieve_documents(state: dict) -> dict:
     """
     Hybrid search - semantic + BM25 combined.
-    Gets called after classifier sets the intent.
-    intent is acting as the identifier to identify what doc to call
+    Runs in parallel with the classifier, so the intent usually isn't
+    known yet - the machine ids / failure codes / history wording in the
+    query narrow the search to a filtered subset instead. A retry first
+    drops the filter and after that widens the candidate pool.
+    models, chunks and BM25 live in the shared engine so retries are cheap
     """
-    from src.vectorstore import load_vectorstore
-    from src.ingestion import load_and_chunk_all
-
     query = state["query"]
-    vs = load_vectorstore()
-    chunks = load_and_chunk_all()
-
-    # semantic search
-    semantic_results = vs.similarity_search(query, k=TOP_K)
+    iterations = state.get("iterations", 0)
 
-    # keyword search (for better searching output)
-    bm25 = BM25Retriever.from_documents(chunks)
-    bm25.k = TOP_K
-    bm25_results = bm25.invoke(query)
+    spec, filtered, candidate_k = retrieval_params(query, iterations)
+    result = get_engine().search(query, candidate_k=candidate_k, spec=spec if filtered else None)
+    return _update(result, spec, filtered, iterations, state)
 
-    # merge and deduplicate
-    seen = set()
-    combined = []
-    for doc in semantic_results + bm25_results:
-        key = doc.page_content[:100]
-        if key not in seen:
-            seen.add(key)
-            combined.append(doc)
 
-    final = combined[:TOP_K]
-    
-    # confidence based on how many results we got
-    confidence = len(final) / TOP_K
+async def aretrieve_documents(state: dict) -> dict:
+    # embedding + chroma + numpy are cpu bound, run them off the event loop
+    return await asyncio.to_thread(retrieve_documents, state)
 
-    print(f"  → retrieved {len(final)} docs (confidence: {confidence})")
 
+def prefetch_retrieval(queries: List[str]) -> Dict[str, dict]:
+    """
+    First retrieval pass for a whole batch - one batched embedding call
+    and one chroma query per distinct filter. Returns the state update
+    retrieve_documents would have produced, keyed by query. Only covers
+    the first pass, retries still go through retrieve_documents.
+    """
+    params = [retrieval_params(query, 0) for query in queries]
+    # the first pass always runs at CANDIDATE_K
+    results = get_engine().search_batch(
+        queries,
+        candidate_k=CANDIDATE_K,
+        specs=[spec if filtered else None for spec, filtered, _ in params]
+    )
     return {
-        **state,
-        "retrieved_docs": [doc.page_content for doc in final],
-        "retrieval_confidence": confidence,
-        "iterations": state.get("iterations", 0) + 1
-    }
\ No newline at end of file
+        query: _update(result, spec, filtered, 0)
+        for query, result, (spec, filtered, _) in zip(queries, results, params)
+    }
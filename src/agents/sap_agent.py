@@ -1,104 +1,227 @@
 import os
-import pandas as pd
+import re
+import asyncio
+import threading
+from dataclasses import asdict
+from typing import Dict, List, Optional, Tuple
 from langchain_core.tools import tool
-from langchain_groq import ChatGroq
 from langchain_core.prompts import ChatPromptTemplate
 from dotenv import load_dotenv
+from pydantic import ValidationError
+
+from src.sap_data import get_sap_client
+from src.entities import extract_entities
+from src.llm import get_llm
+from src.cache import normalize_query
+from src.stage_cache import stage_cache
 
 load_dotenv()
 
-# TODO: replace this with actual SAP RFC calls ( in production/ reallife)
-SAP_DATA_PATH = "./data/raw/sap_maintenance.csv"
+
+def _machine_lookup(machine_id: str) -> Tuple[str, List[dict]]:
+    # text for the prompts + the typed record for escalation rules
+    try:
+        # indexed lookup, the table is loaded once by the SAP client
+        row = get_sap_client().get_machine(machine_id)
+
+        if row is None:
+            return f"no data found for machine {machine_id}", []
+
+        return (f"Machine {row.machine_id} | "
+                f"Last maintenance: {row.last_maintenance} | "
+                f"Open work orders: {row.open_work_orders} | "
+                f"Bearing stock: {row.bearing_stock} | "
+                f"Hydraulic stock: {row.hydraulic_stock} | "
+                f"Status: {row.status}"), [asdict(row)]
+    except Exception as e:
+        return f"error querying SAP: {str(e)}", []
 
 
 @tool
 def query_sap_maintenance(machine_id: str) -> str:
     """Get SAP maintenance history for a specific machine."""
-    try:
-        df = pd.read_csv(SAP_DATA_PATH)
-        df.columns = df.columns.str.strip()
-        
-        # find the machine
-        machine_data = df[df['machine_id'] == machine_id]
-        
-        if machine_data.empty:
-            return f"no data found for machine {machine_id}"
-            
-        row = machine_data.iloc[0]
-        return (f"Machine {machine_id} | "
-                f"Last maintenance: {row['last_maintenance']} | "
-                f"Open work orders: {row['open_work_orders']} | "
-                f"Bearing stock: {row['bearing_stock']} | "
-                f"Hydraulic stock: {row['hydraulic_stock']} | "
-                f"Status: {row['status']}")
-    except Exception as e:
-        return f"error querying SAP: {str(e)}"
+    return _machine_lookup(machine_id)[0]
 
 
 @tool
 def get_all_critical_machines() -> str:
     """Get all machines currently in critical status."""
     try:
-        df = pd.read_csv(SAP_DATA_PATH)
-        df.columns = df.columns.str.strip()
-        
-        critical = df[df['status'] == 'critical']
-        
-        if critical.empty:
+        critical = get_sap_client().by_status("critical")
+
+        if not critical:
             return "no critical machines"
-            
-        machines = []
-        for _, row in critical.iterrows():
-            machines.append(f"{row['machine_id']} ({row['open_work_orders']} open orders)")
-            
+
+        machines = [f"{row.machine_id} ({row.open_work_orders} open orders)" for row in critical]
         return "critical machines: " + ", ".join(machines)
     except Exception as e:
         return f"error: {str(e)}"
 
 
 # setup LLM with tools
-llm = ChatGroq(
-    model="llama-3.3-70b-versatile",
-    api_key=os.getenv("GROQ_API_KEY"),
-    temperature=0
-)
+llm = get_llm(temperature=0)
 llm_with_tools = llm.bind_tools([query_sap_maintenance, get_all_critical_machines])
+# tool choice for the queries the router can't decide, the tools
+# themselves still run every time so SAP data is always current
+memo = stage_cache("sap_tools")
+
+
+# "which machines are critical", "list critical machines" ...
+CRITICAL_RE = re.compile(r"\bcritical\b", re.IGNORECASE)
+# words that mean SAP data might matter even without a machine id
+SAP_TOPIC_RE = re.compile(
+    r"\b(sap|stock|spare|parts?|work ?orders?|maintenance|status|inventory|machines)\b",
+    re.IGNORECASE
+)
+
+# how often the rule router answered without the LLM
+_router_lock = threading.Lock()
+ROUTER_STATS = {"fast_path": 0, "llm_fallback": 0}
+
+
+def _count(path: str):
+    with _router_lock:
+        ROUTER_STATS[path] += 1
+
+
+def router_stats() -> dict:
+    with _router_lock:
+        total = ROUTER_STATS["fast_path"] + ROUTER_STATS["llm_fallback"]
+        return {**ROUTER_STATS, "fast_path_rate": ROUTER_STATS["fast_path"] / total if total else 0.0}
+
+
+def route_sap_query(query: str) -> Optional[List[dict]]:
+    """
+    Rule based tool selection for the obvious cases.
+    machine id in the text -> query_sap_maintenance for each one,
+    "critical" -> get_all_critical_machines, nothing SAP related at all
+    -> no tools. Returns None when it's ambiguous and the LLM should pick.
+    """
+    calls = [{"name": "query_sap_maintenance", "args": {"machine_id": machine_id}}
+             for machine_id in extract_entities(query)["machine_id"]]
+    if CRITICAL_RE.search(query):
+        calls.append({"name": "get_all_critical_machines", "args": {}})
+
+    if calls:
+        return calls
+    if SAP_TOPIC_RE.search(query):
+        return None
+    return []
+
+
+def _call_tool(name: str, args: dict) -> Tuple[str, List[dict]]:
+    print(f"  → calling SAP tool: {name}")
+
+    # args come from the LLM too, check them against the tool's schema
+    # like invoke() would - a bad call is a miss, not a crashed query
+    try:
+        if name == "query_sap_maintenance":
+            # validated by hand, invoke() only hands back the text and
+            # escalation needs the typed record as well
+            checked = query_sap_maintenance.args_schema.model_validate(args)
+            return _machine_lookup(checked.machine_id)
+        if name == "get_all_critical_machines":
+            # a listing, not a diagnosis of these machines - no records
+            return get_all_critical_machines.invoke(args), []
+    except ValidationError:
+        return f"no records, bad arguments for {name}: {args}", []
+    return f"unknown tool: {name}", []
+
+
+def _run_tool_calls(tool_calls: List[dict], outputs: Optional[Dict[tuple, tuple]] = None) -> dict:
+    """
+    outputs memoizes tool results across calls, see prefetch_sap.
+    sap_context carries the text the LLM stages read plus the typed
+    records of the machines looked up, escalation works on those.
+    """
+    if not tool_calls:
+        print("  → no SAP tools called")
+        return {"found": False}
+
+    lines = []
+    records = []
+    for tool_call in tool_calls:
+        name = tool_call["name"]
+        args = tool_call["args"]
+
+        if outputs is None:
+            out, found = _call_tool(name, args)
+        else:
+            key = (name, tuple(sorted(args.items())))
+            if key not in outputs:
+                outputs[key] = _call_tool(name, args)
+            out, found = outputs[key]
+
+        lines.append(f"{name}: {out}")
+        records.extend(found)
+
+    return {"found": True, "data": "\n".join(lines), "records": records}
+
+
+def prefetch_sap(queries: List[str]) -> Dict[str, dict]:
+    """
+    SAP stage for a whole batch, for the queries the rule router can
+    answer. Each distinct tool call (e.g. M001 asked about by ten
+    queries) hits SAP once. Ambiguous queries are left out and go
+    through sap_connector / the LLM as usual.
+    """
+    outputs: Dict[tuple, tuple] = {}
+    prefetched = {}
+    for query in queries:
+        tool_calls = route_sap_query(query)
+        if tool_calls is None:
+            continue
+        _count("fast_path")
+        prefetched[query] = {"sap_context": _run_tool_calls(tool_calls, outputs)}
+    return prefetched
+
+
+prompt = ChatPromptTemplate.from_messages([
+    ("system", "You are a SAP connector. Use tools to fetch relevant maintenance data."),
+    ("human", "{query}")
+])
+
+
+def _selected_tools(result) -> List[dict]:
+    # just name + args, that's all _run_tool_calls needs and what gets memoized
+    tool_calls = result.tool_calls if hasattr(result, "tool_calls") else []
+    return [{"name": call["name"], "args": call["args"]} for call in tool_calls]
 
 
 def sap_connector(state: dict) -> dict:
     """Call SAP tools based on the query."""
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are a SAP connector. Use tools to fetch relevant maintenance data."),
-        ("human", "{query}")
-    ])
-
-    result = (prompt | llm_with_tools).invoke({"query": state["query"]})
-
-    sap_context = {"found": False}
-    
-    # check if LLM decided to use any tools
-    if hasattr(result, "tool_calls") and result.tool_calls:
-        outputs = []
-        for tool_call in result.tool_calls:
-            name = tool_call["name"]
-            args = tool_call["args"]
-            
-            print(f"  → calling SAP tool: {name}")
-            
-            if name == "query_sap_maintenance":
-                out = query_sap_maintenance.invoke(args)
-            elif name == "get_all_critical_machines":
-                out = get_all_critical_machines.invoke(args)
-            else:
-                out = f"unknown tool: {name}"
-                
-            outputs.append(f"{name}: {out}")
-            
-        sap_context = {"found": True, "data": "\n".join(outputs)}
+    # most queries name the machine, no need for an LLM round trip
+    tool_calls = route_sap_query(state["query"])
+    if tool_calls is not None:
+        _count("fast_path")
+        return {"sap_context": _run_tool_calls(tool_calls)}
+
+    _count("llm_fallback")
+    key = normalize_query(state["query"])
+    tool_calls = memo.get(key)
+    if tool_calls is None:
+        result = (prompt | llm_with_tools).invoke({"query": state["query"]})
+        # check if LLM decided to use any tools
+        tool_calls = _selected_tools(result)
+        memo.set(key, tool_calls)
+    return {"sap_context": _run_tool_calls(tool_calls)}
+
+
+async def asap_connector(state: dict) -> dict:
+    tool_calls = route_sap_query(state["query"])
+    if tool_calls is not None:
+        _count("fast_path")
     else:
-        print("  → no SAP tools called")
+        _count("llm_fallback")
+        key = normalize_query(state["query"])
+        tool_calls = memo.get(key)
+        if tool_calls is None:
+            result = await (prompt | llm_with_tools).ainvoke({"query": state["query"]})
+            tool_calls = _selected_tools(result)
+            memo.set(key, tool_calls)
 
-    return {**state, "sap_context": sap_context}
+    # a pooled live SAP client blocks on the network, keep it off the loop
+    return {"sap_context": await asyncio.to_thread(_run_tool_calls, tool_calls)}
 
 
 if __name__ == "__main__":
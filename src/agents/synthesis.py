@@ -1,17 +1,17 @@
 import os
 import json
-from langchain_groq import ChatGroq
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
+from src.llm import get_llm
+from src.stage_cache import prompt_key, stage_cache
+from src.context import stage_context, stage_references
+
 load_dotenv()
 
-llm = ChatGroq(
-    model="llama-3.3-70b-versatile",
-    api_key=os.getenv("GROQ_API_KEY"),
-    temperature=0.1
-)
+llm = get_llm(temperature=0.1)
+memo = stage_cache("synthesis")
 
 # final structured output - what the user actually sees
 class ARIAResponse(BaseModel):
@@ -23,13 +23,8 @@ class ARIAResponse(BaseModel):
     summary: str
 
 
-def synthesize_response(state: dict) -> dict:
-    # pull everything from state
-    docs_text = "\n\n".join(state.get("retrieved_docs", []))
-    reasoning = state.get("reasoning", "")
-
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", """You are ARIA, a manufacturing defect intelligence assistant.
+prompt = ChatPromptTemplate.from_messages([
+    ("system", """You are ARIA, a manufacturing defect intelligence assistant.
 Generate a structured response based on the analysis.
 Return valid JSON only:
 {{
@@ -41,23 +36,37 @@ Return valid JSON only:
     "summary": "2-3 line summary for the technician"
 }}
 """),
-        ("human", """Query: {query}
+    ("human", """Query: {query}
         
 Data: {docs}
 
 Analysis: {reasoning}
 
 Generate structured response.""")
-    ])
+])
 
-    result = (prompt | llm).invoke({
+
+def _docs(state: dict) -> str:
+    # reasoning already read the full text, synthesis only needs to know
+    # what to cite. lookups / repair questions skip reasoning, those get
+    # the data itself (within the synthesis budget)
+    if state.get("reasoning"):
+        return stage_references("synthesis", state).text
+    return stage_context("synthesis", state).text
+
+
+def _inputs(state: dict) -> dict:
+    # pull everything from state
+    return {
         "query": state["query"],
-        "docs": docs_text,
-        "reasoning": reasoning
-    })
+        "docs": _docs(state),
+        "reasoning": state.get("reasoning", "")
+    }
+
 
+def _parse(content: str) -> dict:
     try:
-        text = result.content.strip().replace("```json", "").replace("```", "")
+        text = content.strip().replace("```json", "").replace("```", "")
         parsed = json.loads(text)
     except Exception:
         # fallback response if parsing fails
@@ -73,6 +82,25 @@ Generate structured response.""")
     print(f"  → synthesis done (confidence: {parsed.get('confidence', 0)})")
 
     return {
-        **state,
         "final_answer": parsed
-    }
\ No newline at end of file
+    }
+
+
+def synthesize_response(state: dict) -> dict:
+    inputs = _inputs(state)
+    key = prompt_key(prompt, inputs)
+    content = memo.get(key)
+    if content is None:
+        content = (prompt | llm).invoke(inputs).content
+        memo.set(key, content)
+    return _parse(content)
+
+
+async def asynthesize_response(state: dict) -> dict:
+    inputs = _inputs(state)
+    key = prompt_key(prompt, inputs)
+    content = memo.get(key)
+    if content is None:
+        content = (await (prompt | llm).ainvoke(inputs)).content
+        memo.set(key, content)
+    return _parse(content)
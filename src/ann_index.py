@@ -0,0 +1,447 @@
+import os
+import json
+import math
+import shutil
+import uuid
+from array import array
+from typing import List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from dotenv import load_dotenv
+
+from src.bm25_index import BM25Index, DocFilter, swap_dir
+from src.ingestion import chunk_keys
+
+load_dotenv()
+
+# in-process alternative to chroma, VECTOR_BACKEND=ann (see vectorstore.py)
+ANN_INDEX_PATH = os.getenv("ANN_INDEX_PATH", "./data/ann_index")
+# int8 (4x smaller than float32) or binary (32x, ranking only - pair it with rescoring)
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "int8")
+# inverted lists scanned per query, more = better recall, slower
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "32"))
+# exact float32 re-scoring of the best k * ANN_RESCORE_FACTOR quantized hits,
+# binary codes rank too coarsely for that and get an 8x longer shortlist
+ANN_RESCORE = os.getenv("ANN_RESCORE", "1") == "1"
+ANN_RESCORE_FACTOR = int(os.getenv("ANN_RESCORE_FACTOR", "4"))
+BINARY_SHORTLIST = 8
+# below this many vectors (whole index, or rows a filter allows) a flat
+# scan is faster than probing lists and never misses anything
+ANN_FLAT_BELOW = int(os.getenv("ANN_FLAT_BELOW", "20000"))
+
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 200_000
+# rows per matmul when assigning / quantizing, bounds build memory
+BLOCK = 8192
+
+# layout slot of a doc id nothing has been placed at yet
+_MISSING = -(2 ** 63)
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _kmeans(sample: np.ndarray, nlist: int, rng: np.random.Generator) -> np.ndarray:
+    # spherical k-means - vectors are unit length, nearest = highest dot
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assign = np.concatenate([np.argmax(sample[i:i + BLOCK] @ centroids.T, axis=1)
+                                 for i in range(0, len(sample), BLOCK)])
+        counts = np.bincount(assign, minlength=nlist)
+        # per-list sums with one sort + reduceat, np.add.at is far slower
+        order = np.argsort(assign, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums = np.zeros_like(centroids)
+        used = counts > 0
+        sums[used] = np.add.reduceat(sample[order], starts[used], axis=0)
+        # empty lists get a random point so every list stays in use
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+        centroids = _normalize(sums).astype(np.float32)
+    return centroids
+
+
+def _by_key(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # keys sorted for searchsorted, plus the row each sorted key came from
+    order = np.argsort(keys, kind="stable")
+    return np.asarray(keys)[order], order
+
+
+def _row_of(sorted_keys: np.ndarray, rows: np.ndarray, key: np.uint64) -> Optional[int]:
+    pos = int(np.searchsorted(sorted_keys, key))
+    if pos < len(sorted_keys) and sorted_keys[pos] == key:
+        return int(rows[pos])
+    return None
+
+
+class ANNIndexBuilder:
+    """
+    Built in the same pass as the BM25 index, doc ids are BM25 doc ids -
+    so filters reuse the BM25 field index and text comes from its doc
+    store, this index only holds vectors. Vectors of chunks the previous
+    index already had are copied over instead of embedded again.
+
+    Newly embedded vectors are appended to <path>.tmp as they come, with
+    their chunk keys, and that survives an interrupted build - the next
+    run picks them up like the previous index's. keep() / add() only
+    record which vector goes to which doc id, the float32 file in doc
+    order, quantization and the inverted lists are all done in save().
+    """
+
+    def __init__(self, path: str = ANN_INDEX_PATH, quantization: str = VECTOR_QUANTIZATION):
+        if quantization not in ("int8", "binary"):
+            raise ValueError(f"VECTOR_QUANTIZATION must be int8 or binary, not {quantization}")
+        self.path = path
+        self.quantization = quantization
+        self.previous = load_ann_index(path)
+        # chunk keys (ingestion.chunk_keys) sorted, with the row each one
+        # is at - 8 + 8 bytes a vector instead of a dict of id strings
+        self._previous_keys, self._previous_rows = _by_key(
+            self.previous.chunk_keys() if self.previous is not None else np.empty(0, dtype=np.uint64))
+        self.dim = self.previous.dim if self.previous is not None else None
+        self._tmp_path = path + ".tmp"
+        self._resumed_keys, self._resumed_rows = self._resume()
+        # rows in the tmp store, resumed ones included
+        self._new_rows = len(self._resumed_keys)
+        os.makedirs(self._tmp_path, exist_ok=True)
+        self._vectors = open(os.path.join(self._tmp_path, "vectors.f32"), "ab")
+        self._keys_file = open(os.path.join(self._tmp_path, "chunk_keys.u64"), "ab")
+        # by doc id - previous index row (>= 0) or -(row in the tmp file) - 1,
+        # and the chunk key that goes with it
+        self._layout = array("q")
+        self._keys = array("Q")
+        # anything in the layout that isn't in the index on disk yet
+        self.changed = False
+
+    def _resume(self) -> Tuple[np.ndarray, np.ndarray]:
+        # keys of the vectors an interrupted build already paid for, by key
+        keys_path = os.path.join(self._tmp_path, "chunk_keys.u64")
+        meta_path = os.path.join(self._tmp_path, "meta.json")
+        if not (os.path.exists(keys_path) and os.path.exists(meta_path)):
+            shutil.rmtree(self._tmp_path, ignore_errors=True)
+            return _by_key(np.empty(0, dtype=np.uint64))
+        with open(meta_path) as f:
+            dim = json.load(f)["dim"]
+        if self.dim is not None and dim != self.dim:
+            # different embedding model since, nothing to reuse
+            shutil.rmtree(self._tmp_path)
+            return _by_key(np.empty(0, dtype=np.uint64))
+        self.dim = dim
+        vectors_path = os.path.join(self._tmp_path, "vectors.f32")
+        vector_rows = os.path.getsize(vectors_path) // (dim * 4) if os.path.exists(vectors_path) else 0
+        # keys are written after their vectors, a killed write leaves a
+        # partial row in either file - trim both to what's complete
+        rows = min(os.path.getsize(keys_path) // 8, vector_rows)
+        with open(vectors_path, "ab") as f:
+            f.truncate(rows * dim * 4)
+        with open(keys_path, "ab") as f:
+            f.truncate(rows * 8)
+        return _by_key(np.fromfile(keys_path, dtype=np.uint64))
+
+    def existing_keys(self) -> np.ndarray:
+        """Sorted keys of every chunk that already has a vector."""
+        return np.union1d(self._previous_keys, self._resumed_keys)
+
+    def _place(self, doc_id: int, row: int, key: int):
+        if doc_id >= len(self._layout):
+            grow = doc_id + 1 - len(self._layout)
+            self._layout.extend([_MISSING] * grow)
+            self._keys.extend([0] * grow)
+        self._layout[doc_id] = row
+        self._keys[doc_id] = key
+
+    def keep(self, doc_id: int, chunk_id: str) -> bool:
+        """Uses the vector already stored for chunk_id (previous index or resumed build) for doc_id."""
+        key = chunk_keys([chunk_id])[0]
+        row = _row_of(self._previous_keys, self._previous_rows, key)
+        if row is None:
+            row = _row_of(self._resumed_keys, self._resumed_rows, key)
+            if row is None:
+                return False
+            row = -row - 1
+            self.changed = True
+        self._place(doc_id, row, int(key))
+        return True
+
+    def add(self, doc_ids: List[int], chunk_ids: List[str], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        meta_path = os.path.join(self._tmp_path, "meta.json")
+        if not os.path.exists(meta_path):
+            with open(meta_path, "w") as f:
+                json.dump({"dim": self.dim}, f)
+        keys = chunk_keys(chunk_ids)
+        first = self._new_rows
+        self._vectors.write(np.ascontiguousarray(vectors).tobytes())
+        self._vectors.flush()
+        self._keys_file.write(keys.tobytes())
+        self._keys_file.flush()
+        self._new_rows += len(keys)
+        for i, (doc_id, key) in enumerate(zip(doc_ids, keys.tolist())):
+            self._place(doc_id, -(first + i) - 1, key)
+        self.changed = True
+
+    def _close(self):
+        self._vectors.close()
+        self._keys_file.close()
+
+    def discard(self):
+        # nothing changed - whatever the tmp store holds isn't needed
+        self._close()
+        shutil.rmtree(self._tmp_path, ignore_errors=True)
+
+    def save(self, bm25_version: str, seed: int = 0) -> "ANNIndex":
+        layout = np.frombuffer(self._layout, dtype=np.int64) if self._layout else np.empty(0, dtype=np.int64)
+        n = len(layout)
+        dim = self.dim or 0
+        if (layout == _MISSING).any():
+            raise RuntimeError("ANN index has gaps, every BM25 doc needs a vector")
+        self._close()
+        tmp = self.path + ".build"
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+
+        # float32 vectors in doc order, gathered from the previous index
+        # and the newly embedded ones
+        new_rows = self._new_rows
+        embedded = np.memmap(os.path.join(self._tmp_path, "vectors.f32"), dtype=np.float32, mode="r",
+                             shape=(new_rows, dim)) if new_rows else None
+        with open(os.path.join(tmp, "vectors.f32"), "wb") as f:
+            for i in range(0, n, BLOCK):
+                rows = layout[i:i + BLOCK]
+                block = np.empty((len(rows), dim), dtype=np.float32)
+                old = rows >= 0
+                if old.any():
+                    block[old] = self.previous.vectors[rows[old]]
+                if not old.all():
+                    block[~old] = embedded[-rows[~old] - 1]
+                f.write(block.tobytes())
+        del embedded
+        vectors = np.memmap(os.path.join(tmp, "vectors.f32"), dtype=np.float32, mode="r", shape=(n, dim)) \
+            if n else np.empty((0, dim), dtype=np.float32)
+        np.save(os.path.join(tmp, "chunk_keys.npy"),
+                np.frombuffer(self._keys, dtype=np.uint64) if n else np.empty(0, dtype=np.uint64))
+
+        # ~4 sqrt(n) lists of a few hundred vectors each, one list (flat)
+        # while a flat scan is still cheap
+        rng = np.random.default_rng(seed)
+        nlist = 1 if n < ANN_FLAT_BELOW else int(4 * math.sqrt(n))
+        if nlist > 1:
+            picks = np.sort(rng.choice(n, min(n, max(KMEANS_SAMPLE, 40 * nlist)), replace=False))
+            centroids = _kmeans(_normalize(np.asarray(vectors[picks])), nlist, rng)
+            assign = np.concatenate([np.argmax(_normalize(np.asarray(vectors[i:i + BLOCK])) @ centroids.T, axis=1)
+                                     for i in range(0, n, BLOCK)])
+        else:
+            centroids = _normalize(np.asarray(vectors).mean(axis=0, keepdims=True)) if n else \
+                np.zeros((1, dim), dtype=np.float32)
+            assign = np.zeros(n, dtype=np.int64)
+
+        # CSR like the BM25 postings - list l is positions [offsets[l], offsets[l+1])
+        list_docs = np.argsort(assign, kind="stable").astype(np.int32)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=nlist), out=offsets[1:])
+        doc_pos = np.empty(n, dtype=np.int32)
+        doc_pos[list_docs] = np.arange(n, dtype=np.int32)
+
+        # codes stored in list order so a probed list is one contiguous slice
+        width = dim if self.quantization == "int8" else (dim + 7) // 8
+        codes = np.lib.format.open_memmap(os.path.join(tmp, "codes.npy"), mode="w+",
+                                          dtype=np.int8 if self.quantization == "int8" else np.uint8,
+                                          shape=(n, width))
+        scales = np.empty(n, dtype=np.float32)
+        for i in range(0, n, BLOCK):
+            block = _normalize(np.asarray(vectors[list_docs[i:i + BLOCK]]))
+            if self.quantization == "int8":
+                # symmetric per-vector scale, the largest component maps to 127
+                scale = np.abs(block).max(axis=1) / 127
+                scale[scale == 0] = 1
+                codes[i:i + len(block)] = np.round(block / scale[:, None]).astype(np.int8)
+                scales[i:i + len(block)] = scale
+            else:
+                codes[i:i + len(block)] = np.packbits(block > 0, axis=1)
+                scales[i:i + len(block)] = 1
+        codes.flush()
+        del codes, vectors
+
+        np.save(os.path.join(tmp, "centroids.npy"), centroids.astype(np.float32))
+        np.save(os.path.join(tmp, "offsets.npy"), offsets)
+        np.save(os.path.join(tmp, "list_docs.npy"), list_docs)
+        np.save(os.path.join(tmp, "doc_pos.npy"), doc_pos)
+        np.save(os.path.join(tmp, "scales.npy"), scales)
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump({"n": n, "dim": dim, "nlist": nlist, "quantization": self.quantization,
+                       "bm25_version": bm25_version, "version": uuid.uuid4().hex}, f)
+
+        if self.previous is not None:
+            self.previous.close()
+        swap_dir(tmp, self.path)
+        # everything in the tmp store is in the index now
+        shutil.rmtree(self._tmp_path, ignore_errors=True)
+        print(f"ANN index: {n} vectors, {nlist} lists, {self.quantization} -> {self.path}")
+        return ANNIndex(self.path)
+
+
+class ANNIndex:
+    """
+    IVF index over quantized vectors, every array memory-mapped. A query
+    scores the centroids, scans the nprobe nearest lists on the int8 /
+    binary codes and, with rescoring on, re-ranks the best candidates
+    against the exact float32 vectors (read from disk, only those rows).
+    Resident cost is the codes - ~0.4 GB per million MiniLM vectors at
+    int8, ~50 MB binary - instead of float32 vectors plus a graph.
+    """
+
+    def __init__(self, path: str = ANN_INDEX_PATH):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.n, self.dim = self.meta["n"], self.meta["dim"]
+        self.quantization = self.meta["quantization"]
+
+        def _map(name):
+            return np.load(os.path.join(path, name), mmap_mode="r")
+
+        self.centroids = np.load(os.path.join(path, "centroids.npy"))
+        self.offsets = _map("offsets.npy")
+        self.list_docs = _map("list_docs.npy")
+        self.doc_pos = _map("doc_pos.npy")
+        self.codes = _map("codes.npy")
+        self.scales = _map("scales.npy")
+        self.vectors = np.memmap(os.path.join(path, "vectors.f32"), dtype=np.float32, mode="r",
+                                 shape=(self.n, self.dim)) if self.n else np.empty((0, self.dim), np.float32)
+
+    def __len__(self) -> int:
+        return self.n
+
+    @property
+    def bm25_version(self) -> str:
+        return self.meta["bm25_version"]
+
+    def close(self):
+        # drop the maps so the directory can be replaced (windows needs this)
+        self.codes = self.vectors = self.list_docs = self.doc_pos = self.scales = None
+
+    def resident_bytes(self) -> int:
+        """What a query path keeps hot - codes, scales, lists, centroids."""
+        return int(self.codes.nbytes + self.scales.nbytes + self.list_docs.nbytes
+                   + self.doc_pos.nbytes + self.centroids.nbytes + self.offsets.nbytes)
+
+    def chunk_keys(self) -> np.ndarray:
+        """Chunk key of every doc, in doc order (see ingestion.chunk_keys)."""
+        keys_path = os.path.join(self.path, "chunk_keys.npy")
+        if os.path.exists(keys_path):
+            return np.load(keys_path, mmap_mode="r")
+        # indexes from before chunk keys kept the ids as text
+        with open(os.path.join(self.path, "chunk_ids.txt")) as f:
+            return chunk_keys([line.rstrip("\n") for line in f])
+
+    def _approx(self, positions: np.ndarray, query: np.ndarray) -> np.ndarray:
+        codes = self.codes[positions]
+        if self.quantization == "int8":
+            return (codes @ query) * self.scales[positions]
+        # hamming distance -> angle estimate, cos(pi * h / dim)
+        bits = np.packbits(query > 0)
+        hamming = _POPCOUNT[np.bitwise_xor(codes, bits)].sum(axis=1, dtype=np.int32)
+        return np.cos(np.pi * hamming / self.dim).astype(np.float32)
+
+    def _probe(self, query: np.ndarray, want: int, nprobe: int, mask: Optional[np.ndarray]) -> np.ndarray:
+        nlist = len(self.centroids)
+        if nlist == 1:
+            positions = np.arange(self.n)
+            return positions[mask[self.list_docs]] if mask is not None else positions
+        order = np.argsort(-(self.centroids @ query))
+        probe = min(nprobe, nlist)
+        while True:
+            ranges = [(self.offsets[l], self.offsets[l + 1]) for l in order[:probe]]
+            positions = np.concatenate([np.arange(start, end) for start, end in ranges])
+            if mask is not None:
+                positions = positions[mask[self.list_docs[positions]]]
+            # a filter can leave the nearest lists nearly empty, widen
+            if len(positions) >= want or probe >= nlist:
+                return positions
+            probe = min(probe * 2, nlist)
+
+    def search(self, vector, k: int, allowed: Optional[DocFilter] = None, nprobe: int = ANN_NPROBE,
+               rescore: bool = ANN_RESCORE) -> Tuple[np.ndarray, np.ndarray]:
+        """(doc ids, cosine similarities) best first. allowed is a BM25 doc_filter."""
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if not self.n or k <= 0:
+            return empty
+        query = _normalize(np.asarray(vector, dtype=np.float32))
+        factor = ANN_RESCORE_FACTOR * (BINARY_SHORTLIST if self.quantization == "binary" else 1)
+        want = k * factor if rescore else k
+
+        if allowed is not None and allowed.count <= ANN_FLAT_BELOW:
+            # selective filter - scan exactly the rows it allows
+            positions = np.sort(self.doc_pos[allowed.docs])
+        else:
+            positions = self._probe(query, want, nprobe, allowed.mask if allowed is not None else None)
+        if len(positions) == 0:
+            return empty
+
+        scores = self._approx(positions, query)
+        top = np.argpartition(-scores, min(want, len(scores)) - 1)[:want]
+        docs = self.list_docs[positions[top]].astype(np.int64)
+        scores = scores[top]
+        if rescore:
+            # exact float32 for the shortlist, sorted reads are kinder to the page cache
+            order = np.argsort(docs)
+            docs = docs[order]
+            scores = _normalize(np.asarray(self.vectors[docs])) @ query
+        best = np.argsort(-scores, kind="stable")[:k]
+        return docs[best], scores[best].astype(np.float32)
+
+
+class ANNVectorStore:
+    """
+    The parts of the Chroma interface ARIA uses, over an ANNIndex. Doc
+    text and metadata come from the BM25 doc store, filters are BM25
+    doc filters - the two indexes are built together and checked to be
+    the same build. Scores are returned as chroma-style squared L2
+    distances (2 - 2cos on unit vectors) so fusion treats both alike.
+    """
+
+    def __init__(self, index: ANNIndex, embeddings, bm25: BM25Index):
+        if bm25 is None or index.bm25_version != bm25.version:
+            raise RuntimeError("ANN index and BM25 index are from different builds, "
+                               "rebuild with python src/vectorstore.py")
+        self.index = index
+        self.embeddings = embeddings
+        self.bm25 = bm25
+
+    def _results(self, docs: np.ndarray, scores: np.ndarray) -> List[Tuple[Document, float]]:
+        return [(self.bm25.get_document(int(d)), float(2.0 - 2.0 * s)) for d, s in zip(docs, scores)]
+
+    def search_by_vector(self, vector, k: int, spec: Optional[dict] = None) -> List[Tuple[Document, float]]:
+        return self._results(*self.index.search(vector, k, allowed=self.bm25.doc_filter(spec)))
+
+    def search_by_vectors(self, vectors, k: int,
+                          specs: Optional[List[Optional[dict]]] = None) -> List[List[Tuple[Document, float]]]:
+        specs = specs or [None] * len(vectors)
+        # queries sharing a filter share its mask, bm25 memoizes them
+        return [self._results(*self.index.search(vector, k, allowed=self.bm25.doc_filter(spec)))
+                for vector, spec in zip(vectors, specs)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     spec: Optional[dict] = None) -> List[Tuple[Document, float]]:
+        return self.search_by_vector(self.embeddings.embed_query(query), k, spec)
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+
+def load_ann_index(path: str = ANN_INDEX_PATH) -> Optional[ANNIndex]:
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    return ANNIndex(path)
+
+
+def ann_index_exists(path: str = ANN_INDEX_PATH) -> bool:
+    return os.path.exists(os.path.join(path, "meta.json"))
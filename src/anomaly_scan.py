@@ -0,0 +1,186 @@
+import sys
+import os
+import json
+import time
+import asyncio
+import argparse
+from typing import List, Optional
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from src.ingestion import DEFECT_DATA_PATH, DEFECT_SCHEMA, FAILURE_MODES, sniff_delimiter
+
+load_dotenv()
+
+# rows before the current one (same product type, UDI order) that make up
+# its baseline, and how far off the baseline counts as anomalous
+ANOMALY_WINDOW = int(os.getenv("ANOMALY_WINDOW", "500"))
+ANOMALY_Z = float(os.getenv("ANOMALY_Z", "3.0"))
+ANOMALY_TOP_N = int(os.getenv("ANOMALY_TOP_N", "5"))
+
+# AI4I failure conditions (Matzka 2020), each one is how the dataset
+# generates that failure mode - near them is where machines get risky
+HDF_TEMP_DIFF_K = 8.6
+HDF_MAX_RPM = 1380
+PWF_MIN_W = 3500
+PWF_MAX_W = 9000
+OSF_LIMITS = {"L": 11000, "M": 12000, "H": 13000}
+TWF_WEAR_MIN = (200, 240)
+
+# what each rule means, worded for the generated questions. no failure
+# mode names - build_filter would AND them with the product id and only
+# match rows that already failed, which the scan leaves out by default
+CONDITION_PHRASES = {
+    "hdf": "small air/process temperature gap at low speed",
+    "pwf": "power outside the normal band",
+    "osf": "wear x torque over the limit for its type",
+    "twf": "tool usage in the replacement window",
+}
+
+# sensor readings that get a rolling z-score
+Z_FEATURES = ["torque_nm", "rotational_speed_rpm", "tool_wear_min", "temp_diff_k", "power_w"]
+
+
+def load_sensor_frame(path: str = DEFECT_DATA_PATH) -> pd.DataFrame:
+    """AI4I csv -> frame with the same snake_case names ingestion uses."""
+    df = pd.read_csv(path, sep=sniff_delimiter(path), encoding="utf-8-sig")
+    df.columns = [c.strip() for c in df.columns]
+    return df.rename(columns={col: key for col, (key, _) in DEFECT_SCHEMA.items()})
+
+
+def score_fleet(df: pd.DataFrame, window: int = ANOMALY_WINDOW, z: float = ANOMALY_Z) -> pd.DataFrame:
+    """
+    Scores every row in one vectorized pass, riskiest first.
+    Rule flags are the AI4I failure conditions, z-scores compare each
+    reading with the preceding `window` rows of the same product type.
+    score = number of rules tripped + how far past `z` the readings are,
+    in multiples of `z` (z=6 with the default 3 weighs like one rule).
+    """
+    df = df.sort_values("udi").reset_index(drop=True)
+    df["temp_diff_k"] = df["process_temperature_k"] - df["air_temperature_k"]
+    df["power_w"] = df["torque_nm"] * df["rotational_speed_rpm"] * 2 * np.pi / 60
+    df["strain_minnm"] = df["tool_wear_min"] * df["torque_nm"]
+
+    rules = pd.DataFrame({
+        "hdf": (df["temp_diff_k"] < HDF_TEMP_DIFF_K) & (df["rotational_speed_rpm"] < HDF_MAX_RPM),
+        "pwf": (df["power_w"] < PWF_MIN_W) | (df["power_w"] > PWF_MAX_W),
+        "osf": df["strain_minnm"] > df["type"].map(OSF_LIMITS).fillna(min(OSF_LIMITS.values())),
+        "twf": df["tool_wear_min"].between(*TWF_WEAR_MIN),
+    })
+
+    # baseline excludes the row itself, shift before rolling
+    grouped = df.groupby("type")[Z_FEATURES]
+    mean = grouped.transform(lambda s: s.shift().rolling(window, min_periods=30).mean())
+    std = grouped.transform(lambda s: s.shift().rolling(window, min_periods=30).std())
+    zscores = ((df[Z_FEATURES] - mean) / std.replace(0, np.nan)).fillna(0.0)
+    excess = (zscores.abs() - z).clip(lower=0) / z
+
+    out = df[["udi", "product_id", "type", "machine_failure"] + Z_FEATURES + ["strain_minnm"]].copy()
+    out["rules"] = rules.sum(axis=1)
+    out["score"] = out["rules"] + excess.sum(axis=1)
+    for code in rules.columns:
+        out[f"rule_{code}"] = rules[code]
+    for feature in Z_FEATURES:
+        out[f"z_{feature}"] = zscores[feature]
+
+    out = out[out["score"] > 0]
+    return out.sort_values(["score", "udi"], ascending=[False, True]).reset_index(drop=True)
+
+
+def _reasons(row: pd.Series, z: float = ANOMALY_Z) -> List[str]:
+    reasons = [FAILURE_MODES[code] + " conditions"
+               for code in ("hdf", "pwf", "osf", "twf") if row[f"rule_{code}"]]
+    reasons += [f"{feature} z={row[f'z_{feature}']:+.1f}"
+                for feature in Z_FEATURES if abs(row[f"z_{feature}"]) > z]
+    return reasons
+
+
+def _entry(rank: int, row: pd.Series) -> dict:
+    return {
+        "rank": rank,
+        "product_id": row["product_id"],
+        "type": row["type"],
+        "udi": int(row["udi"]),
+        "score": round(float(row["score"]), 3),
+        "already_failed": bool(row["machine_failure"]),
+        "rules": [code for code in ("hdf", "pwf", "osf", "twf") if row[f"rule_{code}"]],
+        "reasons": _reasons(row),
+        "readings": {
+            "torque_nm": float(row["torque_nm"]),
+            "rotational_speed_rpm": float(row["rotational_speed_rpm"]),
+            "tool_wear_min": float(row["tool_wear_min"]),
+            "temp_diff_k": round(float(row["temp_diff_k"]), 2),
+            "power_w": round(float(row["power_w"]), 1),
+        },
+    }
+
+
+def _question(entry: dict) -> str:
+    # phrased like a technician question so it takes the root_cause path,
+    # the product id narrows retrieval to that machine's record. rules and
+    # readings avoid failure mode wording (see CONDITION_PHRASES)
+    readings = entry["readings"]
+    flags = [CONDITION_PHRASES[code] for code in entry["rules"]]
+    flags += [reason for reason in entry["reasons"] if " z=" in reason]
+    return (f"Why is machine {entry['product_id']} (type {entry['type']}) at risk of failure? "
+            f"Flags: {', '.join(flags)}. Torque {readings['torque_nm']} Nm, "
+            f"speed {readings['rotational_speed_rpm']:.0f} rpm, tool usage {readings['tool_wear_min']:.0f} min.")
+
+
+async def ascan(path: str = DEFECT_DATA_PATH, top_n: int = ANOMALY_TOP_N, explain: bool = True,
+                include_failed: bool = False, limit: Optional[int] = 50) -> dict:
+    """
+    Ranked fleet report. The whole table is scored with numpy/pandas,
+    only the top_n machines go through the LLM pipeline (as one batch).
+    include_failed keeps machines that already failed in the ranking.
+    """
+    start = time.perf_counter()
+    # full-table pandas pass, keep it off the event loop (the API awaits this)
+    scored = await asyncio.to_thread(lambda: score_fleet(load_sensor_frame(path)))
+    if not include_failed:
+        scored = scored[scored["machine_failure"] == 0].reset_index(drop=True)
+    ranked = [_entry(rank + 1, row) for rank, (_, row) in enumerate(scored.head(limit).iterrows())]
+    scan_ms = (time.perf_counter() - start) * 1000
+    print(f"scan: {len(scored)} flagged machines in {scan_ms:.0f}ms")
+
+    if explain and ranked[:top_n]:
+        from main import arun_batch
+
+        results = await arun_batch([_question(entry) for entry in ranked[:top_n]])
+        for entry, result in zip(ranked, results):
+            entry["diagnosis"] = result["final_answer"]
+            entry["escalation"] = result["escalation"]
+
+    return {"flagged": len(scored), "scan_ms": round(scan_ms, 1), "explained": min(top_n, len(ranked)) if explain else 0,
+            "machines": ranked}
+
+
+def scan(path: str = DEFECT_DATA_PATH, top_n: int = ANOMALY_TOP_N, explain: bool = True,
+         include_failed: bool = False, limit: Optional[int] = 50) -> dict:
+    return asyncio.run(ascan(path, top_n, explain, include_failed, limit))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rank the fleet by failure risk, explain the worst few")
+    parser.add_argument("--path", default=DEFECT_DATA_PATH)
+    parser.add_argument("--top", type=int, default=ANOMALY_TOP_N, help="machines sent through the LLM path")
+    parser.add_argument("--limit", type=int, default=50, help="machines listed in the report")
+    parser.add_argument("--no-llm", action="store_true", help="rank only, no diagnoses")
+    parser.add_argument("--include-failed", action="store_true")
+    parser.add_argument("--out", help="write the report as json")
+    args = parser.parse_args()
+
+    report = scan(args.path, args.top, not args.no_llm, args.include_failed, args.limit)
+
+    for entry in report["machines"]:
+        print(f"{entry['rank']:>3}. {entry['product_id']} ({entry['type']}) score {entry['score']:.2f}: "
+              f"{'; '.join(entry['reasons'])}")
+        if "diagnosis" in entry:
+            print(f"     → {entry['diagnosis'].get('root_cause', '')} [{entry['escalation']['priority']}]")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
@@ -1,24 +1,152 @@
 import sys
 import os
+import json
+import asyncio
+from contextlib import asynccontextmanager
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from typing import List
 from pydantic import BaseModel
 
-app = FastAPI(title="ARIA - SAP Manufacturing Defect Intelligence")
+from src.engine import get_engine
+from src.telemetry import PROFILE_SAMPLING, get_profiler, metrics, request_trace
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # load models + indexes once at startup, not on the first query
+    get_engine().warm_up()
+    if PROFILE_SAMPLING:
+        get_profiler().start()
+    yield
+    get_profiler().stop()
+
+
+app = FastAPI(title="ARIA - SAP Manufacturing Defect Intelligence", lifespan=lifespan)
 
 
 class QueryRequest(BaseModel):
     question: str
+    timings: bool = False  # adds the per-stage timing breakdown to the response
 
 
-@app.post("/query")
-def query(req: QueryRequest):
-    from main import run
-    result = run(req.question)
+class BatchQueryRequest(BaseModel):
+    questions: List[str]
+
+
+def _response(result: dict) -> dict:
     return {
         "intent": result["intent"],
         "answer": result["final_answer"],
         "escalation": result["escalation"],
         "sap_context": result["sap_context"]
-    }
\ No newline at end of file
+    }
+
+
+@app.post("/query")
+async def query(req: QueryRequest):
+    from main import arun
+    with request_trace() as trace:
+        result = await arun(req.question)
+    response = _response(result)
+    if req.timings:
+        response["timings"] = trace.breakdown()
+    return response
+
+
+@app.post("/query/batch")
+async def query_batch(req: BatchQueryRequest):
+    """Many questions in one call, answers come back in the same order."""
+    from main import arun_batch
+    results = await arun_batch(req.questions)
+    return [_response(result) for result in results]
+
+
+@app.post("/query/stream")
+async def query_stream(req: QueryRequest):
+    """Server-sent events, one per pipeline stage plus reasoning tokens."""
+    from main import astream
+
+    async def events():
+        async for event, payload in astream(req.question):
+            yield f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/reload")
+async def reload():
+    # call after rebuilding the vectorstore so new data gets picked up
+    await asyncio.to_thread(get_engine().reload)
+    return {"status": "reloaded"}
+
+
+@app.get("/escalations")
+async def escalations():
+    """Plant-wide escalation sweep over every SAP machine, rules only."""
+    from src.escalation_rules import plant_sweep
+    machines = await asyncio.to_thread(plant_sweep)
+    return {"escalate": machines}
+
+
+@app.get("/scan")
+async def fleet_scan(top_n: int = 5, explain: bool = True, include_failed: bool = False, limit: int = 50):
+    """Ranks every machine in the sensor table, diagnoses the top_n through the pipeline."""
+    from src.anomaly_scan import ascan
+    return await ascan(top_n=top_n, explain=explain, include_failed=include_failed, limit=limit)
+
+
+@app.get("/failure-stats")
+async def failure_stats(query: str = ""):
+    """Precomputed failure pattern counts, narrowed to the modes / types a query names."""
+    from src.failure_stats import get_failure_stats
+    stats = await asyncio.to_thread(get_failure_stats)
+    if stats is None:
+        return {"summary": None}
+    return {"summary": stats.summary_for_query(query), "stats": stats.stats}
+
+
+@app.get("/stats")
+async def stats():
+    from src.agents.sap_agent import router_stats
+    from src.cache import cache_stats
+    from src.stage_cache import stage_stats
+    from src.singleflight import coalesce_stats
+    return {
+        "sap_router": router_stats(),
+        "cache": await asyncio.to_thread(cache_stats),
+        "stages": stage_stats(),
+        "coalescing": coalesce_stats()
+    }
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus text format - node / LLM timings, tokens, cache hits."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/profile/start")
+async def profile_start(interval: float = 0.0):
+    """Starts the sampling profiler (PROFILE_SAMPLING=1 starts it with the app)."""
+    profiler = get_profiler()
+    if interval:
+        profiler.interval = interval
+    profiler.reset()
+    profiler.start()
+    return {"running": True, "interval": profiler.interval}
+
+
+@app.post("/profile/stop")
+async def profile_stop(top: int = 20):
+    profiler = get_profiler()
+    await asyncio.to_thread(profiler.stop)
+    return {"running": False, "samples": profiler.samples, "top": profiler.top(top)}
+
+
+@app.get("/profile")
+async def profile():
+    """Folded stacks so far, feed to flamegraph.pl or speedscope."""
+    return PlainTextResponse(get_profiler().folded())
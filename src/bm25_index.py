@@ -0,0 +1,463 @@
+import os
+import re
+import json
+import mmap
+import shutil
+import threading
+import uuid
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# lives next to the chroma store, built at ingest time not per query
+BM25_INDEX_PATH = os.getenv("BM25_INDEX_PATH", "./data/bm25_index")
+
+# standard okapi defaults, same as rank_bm25
+K1 = 1.5
+B = 0.75
+# terms in more than this share of docs are left out of the postings -
+# their idf is next to nothing and a query naming one would walk most of
+# the corpus. small corpora keep everything (see MIN_PRUNE_DF)
+BM25_MAX_DF = float(os.getenv("BM25_MAX_DF", "0.5"))
+MIN_PRUNE_DF = 100
+# longer tokens are hashes / urls from the PDFs, they would only widen
+# the fixed-width term array
+MAX_TERM_LEN = 32
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# metadata fields that get their own inverted index for pre-filtering,
+# failure flags are folded into one multi-valued failure_mode field
+FILTER_FIELDS = ["doc_type", "product_id", "type", "machine_id", "machine_failure", "status"]
+FAILURE_FLAGS = ["twf", "hdf", "pwf", "osf", "rnf"]
+# filter masks kept per index, one bool per doc each. queries name a
+# handful of machines / failure modes so the same few specs keep coming
+FILTER_CACHE_ENTRIES = int(os.getenv("FILTER_CACHE_ENTRIES", "32"))
+
+
+def tokenize(text: str) -> List[str]:
+    # lowercase so "HDF" in a query matches the hdf code on failed rows
+    return _TOKEN_RE.findall(text.lower())
+
+
+def index_text(doc: Document) -> str:
+    """
+    What BM25 indexes for a doc. CSV rows ("Column: value" lines) go in
+    by value only - every row has the same column names, indexing them
+    puts udi / torque / tool wear / failure in every posting list. The
+    code of each failure flag that is set is added, so "HDF" matches the
+    rows that had one instead of every row with an HDF column.
+    """
+    if "row" not in doc.metadata:
+        return doc.page_content
+    values = [line.split(": ", 1)[1] if ": " in line else line for line in doc.page_content.split("\n")]
+    values += [flag for flag in FAILURE_FLAGS if doc.metadata.get(flag) == 1]
+    return " ".join(values)
+
+
+def _save_keys(path: str, keys: List[str]):
+    # sorted fixed-width byte strings, np.searchsorted finds a key in the
+    # memory-mapped array without parsing anything at load time
+    np.save(path, np.array(sorted(key.encode() for key in keys), dtype=bytes) if keys else np.empty(0, dtype="S1"))
+
+
+def _find(keys: np.ndarray, wanted: List[str]) -> np.ndarray:
+    """Position of each wanted key in a _save_keys array, -1 if it isn't there."""
+    out = np.full(len(wanted), -1, dtype=np.int64)
+    if not len(keys):
+        return out
+    width = keys.dtype.itemsize
+    encoded = [w.encode() for w in wanted]
+    # a key longer than the array's width can't be in it, and numpy would
+    # truncate it into something that might be
+    fits = [i for i, e in enumerate(encoded) if len(e) <= width]
+    if not fits:
+        return out
+    probe = np.array([encoded[i] for i in fits], dtype=keys.dtype)
+    pos = np.searchsorted(keys, probe)
+    found = pos < len(keys)
+    found[found] = keys[pos[found]] == probe[found]
+    out[np.asarray(fits)[found]] = pos[found]
+    return out
+
+
+def swap_dir(new: str, path: str):
+    """
+    Replace the index dir at path with new. The old one is renamed aside
+    first and only deleted once new is in place, so there's always an
+    index at path - open memmaps of the old files stay valid either way.
+    """
+    old = path + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, old)
+    os.rename(new, path)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+class BM25IndexBuilder:
+    """
+    Builds the inverted index incrementally, documents go in one at a time
+    and only compact int arrays are kept in memory (no Document objects).
+    """
+
+    def __init__(self, path: str = BM25_INDEX_PATH):
+        self.path = path
+        self.vocab: Dict[str, int] = {}
+        self._term_ids = array("i")
+        self._doc_ids = array("i")
+        self._tfs = array("H")
+        self._doc_lens = array("i")
+        self._tmp_path = path + ".tmp"
+        if os.path.exists(self._tmp_path):
+            shutil.rmtree(self._tmp_path)
+        os.makedirs(self._tmp_path)
+        self._docs_file = open(os.path.join(self._tmp_path, "docs.jsonl"), "wb")
+        # doc order chunk ids, lets callers store ids and look text up later
+        self._ids_file = open(os.path.join(self._tmp_path, "chunk_ids.txt"), "w")
+        self._doc_offsets = array("q", [0])
+        # field -> value -> doc ids
+        self._fields: Dict[str, Dict[str, array]] = {}
+
+    def _index_fields(self, doc_id: int, metadata: dict):
+        for field in FILTER_FIELDS:
+            if field in metadata:
+                values = self._fields.setdefault(field, {})
+                values.setdefault(str(metadata[field]), array("i")).append(doc_id)
+        for flag in FAILURE_FLAGS:
+            if metadata.get(flag) == 1:
+                values = self._fields.setdefault("failure_mode", {})
+                values.setdefault(flag, array("i")).append(doc_id)
+
+    def add_documents(self, docs: Iterable[Document]):
+        for doc in docs:
+            doc_id = len(self._doc_lens)
+            counts: Dict[int, int] = {}
+            tokens = [t for t in tokenize(index_text(doc)) if len(t) <= MAX_TERM_LEN]
+            for token in tokens:
+                term_id = self.vocab.setdefault(token, len(self.vocab))
+                counts[term_id] = counts.get(term_id, 0) + 1
+
+            for term_id, tf in counts.items():
+                self._term_ids.append(term_id)
+                self._doc_ids.append(doc_id)
+                self._tfs.append(min(tf, 65535))
+            self._doc_lens.append(len(tokens))
+            self._index_fields(doc_id, doc.metadata)
+
+            # docs are stored once here so BM25 hits never need the chunk list
+            line = json.dumps({
+                "chunk_id": doc.metadata.get("chunk_id"),
+                "text": doc.page_content,
+                "metadata": doc.metadata
+            }).encode() + b"\n"
+            self._docs_file.write(line)
+            self._doc_offsets.append(self._doc_offsets[-1] + len(line))
+            self._ids_file.write(f"{doc.metadata.get('chunk_id') or ''}\n")
+
+    def discard(self):
+        """Drop the half built index, the one on disk stays as it is."""
+        self._docs_file.close()
+        self._ids_file.close()
+        shutil.rmtree(self._tmp_path, ignore_errors=True)
+
+    def save(self) -> "BM25Index":
+        self._docs_file.close()
+        self._ids_file.close()
+        n_docs = len(self._doc_lens)
+        term_ids = np.frombuffer(self._term_ids, dtype=np.int32)
+        doc_lens = np.frombuffer(self._doc_lens, dtype=np.int32).astype(np.float32)
+
+        # term ids are renumbered in sorted term order, so the id of a term
+        # is its position in terms.npy. terms above the df cap are dropped
+        df_all = np.bincount(term_ids, minlength=len(self.vocab))
+        limit = max(BM25_MAX_DF * n_docs, MIN_PRUNE_DF)
+        terms = sorted(t for t, i in self.vocab.items() if df_all[i] <= limit)
+        pruned = len(self.vocab) - len(terms)
+        renumber = np.full(len(self.vocab), -1, dtype=np.int64)
+        renumber[np.fromiter((self.vocab[t] for t in terms), dtype=np.int64, count=len(terms))] = \
+            np.arange(len(terms))
+        new_ids = renumber[term_ids]
+        kept = new_ids >= 0
+        new_ids = new_ids[kept]
+
+        # CSR layout - postings for term t are [offsets[t], offsets[t+1])
+        # stable sort keeps doc ids ascending inside each posting list
+        order = np.argsort(new_ids, kind="stable")
+        postings_doc = np.frombuffer(self._doc_ids, dtype=np.int32)[kept][order]
+        postings_tf = np.frombuffer(self._tfs, dtype=np.uint16)[kept][order]
+        df = np.bincount(new_ids, minlength=len(terms))
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(df, out=offsets[1:])
+
+        # lucene style idf, never negative unlike plain okapi
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avgdl = float(doc_lens.mean()) if n_docs else 0.0
+        # length normalisation precomputed per doc so queries only gather it
+        doc_norm = (K1 * (1 - B + B * doc_lens / max(avgdl, 1e-9))).astype(np.float32)
+
+        tmp = self._tmp_path
+        np.save(os.path.join(tmp, "offsets.npy"), offsets)
+        np.save(os.path.join(tmp, "postings_doc.npy"), postings_doc)
+        np.save(os.path.join(tmp, "postings_tf.npy"), postings_tf)
+        np.save(os.path.join(tmp, "idf.npy"), idf)
+        np.save(os.path.join(tmp, "doc_norm.npy"), doc_norm)
+        np.save(os.path.join(tmp, "doc_offsets.npy"), np.frombuffer(self._doc_offsets, dtype=np.int64))
+
+        # field index in the same CSR style, one flat array of doc ids.
+        # "field:value" keys sorted like the terms, ranges in key order
+        keys = sorted((f"{field}:{value}", doc_ids) for field, values in self._fields.items()
+                      for value, doc_ids in values.items())
+        field_ranges = np.zeros((len(keys), 2), dtype=np.int64)
+        position = 0
+        for i, (_, doc_ids) in enumerate(keys):
+            field_ranges[i] = position, position + len(doc_ids)
+            position += len(doc_ids)
+        field_postings = np.concatenate([np.frombuffer(doc_ids, dtype=np.int32) for _, doc_ids in keys]) \
+            if keys else np.empty(0, dtype=np.int32)
+        np.save(os.path.join(tmp, "field_postings.npy"), field_postings)
+        np.save(os.path.join(tmp, "field_ranges.npy"), field_ranges)
+        _save_keys(os.path.join(tmp, "field_keys.npy"), [key for key, _ in keys])
+        _save_keys(os.path.join(tmp, "terms.npy"), terms)
+
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            # version changes on every rebuild, caches key their entries on it
+            json.dump({"n_docs": n_docs, "avgdl": avgdl, "k1": K1, "b": B, "version": uuid.uuid4().hex}, f)
+
+        # swap in the finished index in one go, readers never see half of it
+        swap_dir(tmp, self.path)
+        print(f"BM25 index: {n_docs} docs, {len(terms)} terms ({pruned} over the df cap) -> {self.path}")
+        return BM25Index(self.path)
+
+
+class DocFilter:
+    """
+    Docs an entities.build_filter spec allows. mask is read-only, it's
+    shared by every query with the same spec. docs (the allowed ids,
+    sorted) is only worked out if someone asks for it.
+    """
+
+    def __init__(self, mask: np.ndarray):
+        mask.flags.writeable = False
+        self.mask = mask
+        self.count = int(mask.sum())
+        self._docs: Optional[np.ndarray] = None
+
+    @property
+    def docs(self) -> np.ndarray:
+        if self._docs is None:
+            self._docs = np.flatnonzero(self.mask)
+        return self._docs
+
+
+class BM25Index:
+    """
+    Memory-mapped BM25 index. Cold start maps the arrays instead of
+    re-tokenizing the corpus, scoring is numpy over the query's postings
+    only so latency follows posting length, not corpus size.
+    """
+
+    def __init__(self, path: str = BM25_INDEX_PATH):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+
+        def _map(name):
+            return np.load(os.path.join(path, name), mmap_mode="r")
+
+        # sorted term array, a term's id is its position. indexes from
+        # before that kept the vocabulary as json, those get parsed
+        self._vocab: Optional[Dict[str, int]] = None
+        if os.path.exists(os.path.join(path, "terms.npy")):
+            self.terms = _map("terms.npy")
+        else:
+            with open(os.path.join(path, "vocab.json")) as f:
+                self._vocab = json.load(f)
+
+        self.offsets = _map("offsets.npy")
+        self.postings_doc = _map("postings_doc.npy")
+        self.postings_tf = _map("postings_tf.npy")
+        self.idf = _map("idf.npy")
+        self.doc_norm = _map("doc_norm.npy")
+        self.doc_offsets = _map("doc_offsets.npy")
+
+        # indexes built before field filtering existed just can't filter
+        self.has_fields = False
+        self._fields: Optional[Dict[str, Dict[str, List[int]]]] = None
+        if os.path.exists(os.path.join(path, "field_keys.npy")):
+            self.field_keys = _map("field_keys.npy")
+            self.field_ranges = _map("field_ranges.npy")
+            self.field_postings = _map("field_postings.npy")
+            self.has_fields = len(self.field_keys) > 0
+        elif os.path.exists(os.path.join(path, "fields.json")):
+            with open(os.path.join(path, "fields.json")) as f:
+                self._fields = json.load(f)
+            self.field_postings = _map("field_postings.npy")
+            self.has_fields = bool(self._fields)
+
+        self._docs_fh = open(os.path.join(path, "docs.jsonl"), "rb")
+        size = os.path.getsize(os.path.join(path, "docs.jsonl"))
+        self._docs = mmap.mmap(self._docs_fh.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        # chunk id -> doc idx, only loaded if someone looks docs up by id
+        self._by_chunk_id: Optional[Dict[str, int]] = None
+        # spec -> DocFilter. an index never changes once built (a rebuild
+        # is a new instance), so these never go stale
+        self._filters: "OrderedDict[str, DocFilter]" = OrderedDict()
+        self._filters_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.meta["n_docs"]
+
+    @property
+    def version(self) -> str:
+        # indexes from before versioning fall back to the build time
+        if "version" in self.meta:
+            return self.meta["version"]
+        return str(os.stat(os.path.join(self.path, "meta.json")).st_mtime_ns)
+
+    def term_ids(self, query: str) -> List[int]:
+        """Ids of the distinct query terms the index knows."""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if self._vocab is not None:
+            return [self._vocab[t] for t in tokens if t in self._vocab]
+        return [int(i) for i in _find(self.terms, tokens) if i >= 0]
+
+    def max_score(self, query: str) -> float:
+        """Score of a doc matching every known query term once at average length."""
+        return float(sum(self.idf[t] for t in self.term_ids(query))) or 1.0
+
+    def field_docs(self, field: str, value) -> np.ndarray:
+        if self._fields is not None:
+            start, end = self._fields.get(field, {}).get(str(value), (0, 0))
+        else:
+            pos = _find(self.field_keys, [f"{field}:{value}"])[0] if self.has_fields else -1
+            start, end = self.field_ranges[pos] if pos >= 0 else (0, 0)
+        if end == start:
+            return np.empty(0, dtype=np.int32)
+        return self.field_postings[start:end]
+
+    def doc_filter(self, spec: Optional[Dict[str, Dict[str, list]]]) -> Optional[DocFilter]:
+        """
+        Docs allowed by an entities.build_filter spec. Only docs of the
+        doc_types named in the spec get narrowed, the rest pass. Returns
+        None when there's nothing to filter on. Memoized per spec, the
+        O(corpus) mask is built once, not on every filtered query.
+        """
+        if not spec or not self.has_fields:
+            return None
+        key = json.dumps(spec, sort_keys=True)
+        with self._filters_lock:
+            cached = self._filters.get(key)
+            if cached is not None:
+                self._filters.move_to_end(key)
+                return cached
+
+        mask = np.ones(len(self), dtype=bool)
+        for doc_type, conditions in spec.items():
+            in_table = self.field_docs("doc_type", doc_type)
+            keep = None
+            for field, values in conditions.items():
+                matches = np.unique(np.concatenate([self.field_docs(field, v) for v in values]))
+                keep = matches if keep is None else np.intersect1d(keep, matches, assume_unique=True)
+            mask[in_table] = False
+            if keep is not None:
+                mask[keep] = True
+        allowed = DocFilter(mask)
+
+        with self._filters_lock:
+            self._filters[key] = allowed
+            while len(self._filters) > FILTER_CACHE_ENTRIES:
+                self._filters.popitem(last=False)
+        return allowed
+
+    def filter_mask(self, spec: Optional[Dict[str, Dict[str, list]]]) -> Optional[np.ndarray]:
+        """Boolean mask of docs allowed by spec, see doc_filter."""
+        allowed = self.doc_filter(spec)
+        return allowed.mask if allowed is not None else None
+
+    def top_k(self, query: str, k: int, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns (doc indices, scores) best first. mask pre-filters the postings."""
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        term_ids = self.term_ids(query)
+        if not term_ids:
+            return empty
+
+        docs_parts, score_parts = [], []
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.postings_doc[start:end]
+            tf = self.postings_tf[start:end].astype(np.float32)
+            if mask is not None:
+                keep = mask[docs]
+                docs, tf = docs[keep], tf[keep]
+            docs_parts.append(docs)
+            score_parts.append(self.idf[term_id] * tf * (K1 + 1) / (tf + self.doc_norm[docs]))
+
+        docs = np.concatenate(docs_parts)
+        contrib = np.concatenate(score_parts)
+        if len(docs) == 0:
+            return empty
+        if len(docs_parts) > 1:
+            # sum per doc across terms without touching the rest of the corpus
+            docs, inverse = np.unique(docs, return_inverse=True)
+            scores = np.bincount(inverse, weights=contrib).astype(np.float32)
+        else:
+            scores = contrib
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return docs[top].astype(np.int64), scores[top]
+
+    def get_document(self, idx: int) -> Document:
+        start, end = self.doc_offsets[idx], self.doc_offsets[idx + 1]
+        record = json.loads(self._docs[start:end])
+        return Document(page_content=record["text"], metadata=record["metadata"])
+
+    def _chunk_id_map(self) -> Dict[str, int]:
+        if self._by_chunk_id is None:
+            ids_path = os.path.join(self.path, "chunk_ids.txt")
+            if os.path.exists(ids_path):
+                with open(ids_path) as f:
+                    ids = [line.rstrip("\n") for line in f]
+            else:
+                # older index, the ids are in the doc store too
+                ids = [json.loads(self._docs[self.doc_offsets[i]:self.doc_offsets[i + 1]]).get("chunk_id")
+                       for i in range(len(self))]
+            self._by_chunk_id = {cid: idx for idx, cid in enumerate(ids) if cid}
+        return self._by_chunk_id
+
+    def get_by_chunk_id(self, chunk_id: str) -> Optional[Document]:
+        """Stored chunk for a chunk id, None if it isn't in this index."""
+        idx = self._chunk_id_map().get(chunk_id)
+        return self.get_document(idx) if idx is not None else None
+
+    def search_with_scores(self, query: str, k: int,
+                           spec: Optional[Dict[str, Dict[str, list]]] = None) -> List[Tuple[Document, float]]:
+        idx, scores = self.top_k(query, k, mask=self.filter_mask(spec))
+        return [(self.get_document(int(i)), float(s)) for i, s in zip(idx, scores)]
+
+    def search(self, query: str, k: int) -> List[Document]:
+        return [doc for doc, _ in self.search_with_scores(query, k)]
+
+
+def build_bm25_index(chunks: Iterable[Document], path: str = BM25_INDEX_PATH) -> BM25Index:
+    builder = BM25IndexBuilder(path)
+    builder.add_documents(chunks)
+    return builder.save()
+
+
+def load_bm25_index(path: str = BM25_INDEX_PATH) -> Optional[BM25Index]:
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    return BM25Index(path)
+
+
+def bm25_index_exists(path: str = BM25_INDEX_PATH) -> bool:
+    return os.path.exists(os.path.join(path, "meta.json"))
@@ -1,37 +1,449 @@
 import sqlite3
+import asyncio
 import hashlib
 import json
 import os
+import queue
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from src.entities import extract_entities
+from src.telemetry import record_cache
+
+# optional, smaller + faster than json/zlib when installed
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 CACHE_PATH = os.getenv("CACHE_DB_PATH", "./data/cache.db")
+# answers older than this are recomputed even if the data didn't change
+CACHE_TTL = float(os.getenv("CACHE_TTL", str(24 * 3600)))
+# in-process LRU in front of sqlite, entries
+CACHE_MEMORY_ENTRIES = int(os.getenv("CACHE_MEMORY_ENTRIES", "256"))
+# sqlite tier is trimmed (least recently used first) above this many bytes
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_MB", "256")) * 1024 * 1024
+# cosine similarity above which a differently worded query counts as the same
+CACHE_SIMILARITY = float(os.getenv("CACHE_SIMILARITY", "0.92"))
+CACHE_SEMANTIC = os.getenv("CACHE_SEMANTIC", "1") == "1"
+CACHE_POOL_SIZE = int(os.getenv("CACHE_POOL_SIZE", "4"))
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+# words that don't change what is being asked
+_FILLER = {"a", "an", "the", "please", "machine", "can", "you", "me", "tell"}
+
+
+def normalize_query(query: str) -> str:
+    """'Why is machine M001 failing?' and 'why is M001 failing' -> same text."""
+    return " ".join(w for w in _WORD_RE.findall(query.lower()) if w not in _FILLER)
 
 
 def _key(query: str) -> str:
-    return hashlib.md5(query.encode()).hexdigest()
+    return hashlib.md5(normalize_query(query).encode()).hexdigest()
+
+
+def data_version() -> str:
+    """
+    SAP table version + served index version. A cached answer is only
+    valid for the data it was computed from, new stock levels or a
+    rebuilt index make every older entry a miss.
+    """
+    from src.engine import get_engine
+    from src.sap_data import get_sap_client
+
+    try:
+        return f"{get_sap_client().version()}|{get_engine().version()}"
+    except Exception:
+        # no version to compare against, TTL still applies
+        return ""
+
+
+@lru_cache(maxsize=1024)
+def _vector(text: str) -> np.ndarray:
+    # same model the retriever uses, normalized so dot product = cosine.
+    # raises on failure - lru_cache doesn't keep exceptions, so a failed
+    # call (engine not warmed up yet) is retried next time instead of
+    # turning semantic matching off for this query until a restart
+    from src.engine import get_engine
+
+    vector = np.asarray(get_engine().components().vs.embeddings.embed_query(text), dtype=np.float32)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+def _embed(text: str) -> Optional[np.ndarray]:
+    try:
+        return _vector(text)
+    except Exception as e:
+        print(f"cache embedding failed: {e}")
+        return None
+
+
+def _entity_key(query: str) -> str:
+    # semantic matches must be about the same machines / failure modes,
+    # "why is M001 failing" and "why is M002 failing" embed almost alike
+    return json.dumps(extract_entities(query), sort_keys=True)
+
+
+def compact_state(value: dict) -> dict:
+    """
+    What actually gets stored for a graph result - retrieved chunk text
+    is already in the chunk store, keep the ids and look text up on read.
+    """
+    compact = {k: v for k, v in value.items() if k not in ("prefetched", "retrieved_docs")}
+    ids = value.get("retrieved_ids") or []
+    docs = value.get("retrieved_docs") or []
+    if docs and len(ids) != len(docs):
+        # no ids to rehydrate from (e.g. results from an older graph)
+        compact["retrieved_docs"] = docs
+    return compact
+
+
+def _encode(value: dict) -> bytes:
+    # 2 byte header: serializer, compressor - so reads never guess
+    if msgpack is not None:
+        body, fmt = msgpack.packb(value, default=str), b"m"
+    else:
+        body, fmt = json.dumps(value, default=str).encode(), b"j"
+    if zstandard is not None:
+        return fmt + b"s" + zstandard.ZstdCompressor(level=3).compress(body)
+    return fmt + b"z" + zlib.compress(body, 6)
+
+
+def _decode(blob) -> dict:
+    if isinstance(blob, str):
+        return json.loads(blob)
+    fmt, codec, payload = blob[:1], blob[1:2], blob[2:]
+    if codec == b"s":
+        if zstandard is None:
+            raise ValueError("cache entry is zstd compressed, zstandard not installed")
+        body = zstandard.ZstdDecompressor().decompress(payload)
+    else:
+        body = zlib.decompress(payload)
+    if fmt == b"m":
+        if msgpack is None:
+            raise ValueError("cache entry is msgpack encoded, msgpack not installed")
+        return msgpack.unpackb(body)
+    return json.loads(body)
+
+
+def _rehydrate(ids: List[str]) -> List[str]:
+    from src.engine import get_engine
+
+    bm25 = get_engine().components().bm25
+    docs = [bm25.get_by_chunk_id(cid) for cid in ids]
+    return [doc.page_content for doc in docs if doc is not None]
+
+
+class CachedState(dict):
+    """Cached graph result, retrieved_docs is filled in from the chunk store on first access."""
+
+    def __missing__(self, key):
+        if key != "retrieved_docs" or "retrieved_ids" not in self:
+            raise KeyError(key)
+        docs = _rehydrate(self["retrieved_ids"])
+        self[key] = docs
+        return docs
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class _ConnectionPool:
+    """A few long-lived WAL connections instead of one connect() per call."""
 
+    def __init__(self, path: str, size: int = CACHE_POOL_SIZE):
+        self.path = path
+        self._pool: "queue.LifoQueue" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
 
-def _get_conn():
-    conn = sqlite3.connect(CACHE_PATH)
-    conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT)")
-    return conn
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        # readers don't block the writer and vice versa
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                with conn:
+                    yield conn
+            except Exception:
+                conn.close()
+                raise
+            self._pool.put(conn)
+        finally:
+            self._slots.release()
+
+
+class QueryCache:
+    """
+    Two tiers - an LRU dict in process, then sqlite on disk.
+    Lookup order: normalized exact match (memory, then sqlite), then
+    nearest cached query by embedding if it's above CACHE_SIMILARITY and
+    names the same entities. Entries expire after CACHE_TTL and whenever
+    data_version() moves on. The embedding index lives in memory and is
+    loaded from sqlite on first use, so with several API workers each
+    one only matches semantically against what it has seen plus startup.
+    """
+
+    def __init__(self, path: str = CACHE_PATH):
+        self._pool = _ConnectionPool(path)
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        # key -> (vector, entity key) for the semantic tier
+        self._vectors: Optional[Dict[str, tuple]] = None
+        self._matrix = None
+        self._matrix_keys: List[str] = []
+        self._stats = {"memory_hits": 0, "exact_hits": 0, "semantic_hits": 0, "misses": 0,
+                       "expired": 0, "invalidated": 0, "evicted": 0, "lookup_ms": 0.0}
+        with self._pool.connection() as conn:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(cache)")]
+            if columns and "version" not in columns:
+                # pre-versioning cache, none of it can be validated anyway
+                conn.execute("DROP TABLE cache")
+            conn.execute("""CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY, value BLOB, query TEXT, entities TEXT,
+                embedding BLOB, version TEXT, created REAL, accessed REAL, size INTEGER)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_created ON cache (created)")
+
+    def _count(self, stat: str, value: float = 1):
+        with self._lock:
+            self._stats[stat] += value
+
+    def _valid(self, version: str, created: float, current: str) -> Optional[str]:
+        # None if usable, else the reason it isn't
+        if time.time() - created > CACHE_TTL:
+            return "expired"
+        if version != current:
+            return "invalidated"
+        return None
+
+    def _remember(self, key: str, value: dict, version: str, created: float):
+        with self._lock:
+            self._memory[key] = (value, version, created)
+            self._memory.move_to_end(key)
+            while len(self._memory) > CACHE_MEMORY_ENTRIES:
+                self._memory.popitem(last=False)
+
+    def _drop(self, keys: List[str]):
+        with self._lock:
+            for key in keys:
+                self._memory.pop(key, None)
+                if self._vectors is not None and self._vectors.pop(key, None) is not None:
+                    self._matrix = None
+        with self._pool.connection() as conn:
+            conn.executemany("DELETE FROM cache WHERE key=?", [(key,) for key in keys])
+
+    def _load_vectors(self):
+        vectors = {}
+        with self._pool.connection() as conn:
+            rows = conn.execute("SELECT key, embedding, entities FROM cache WHERE embedding IS NOT NULL")
+            for key, blob, entities in rows:
+                vectors[key] = (np.frombuffer(blob, dtype=np.float32), entities)
+        self._vectors = vectors
+
+    def _nearest(self, vector: np.ndarray, entities: str) -> Optional[tuple]:
+        with self._lock:
+            if self._vectors is None:
+                self._load_vectors()
+            if self._matrix is None:
+                self._matrix_keys = list(self._vectors)
+                self._matrix = (np.stack([self._vectors[k][0] for k in self._matrix_keys])
+                                if self._matrix_keys else np.empty((0, len(vector)), dtype=np.float32))
+            keys, matrix = self._matrix_keys, self._matrix
+            same = np.array([self._vectors[k][1] == entities for k in keys], dtype=bool)
+
+        if not len(keys):
+            return None
+        scores = np.where(same, matrix @ vector, -1.0)
+        best = int(np.argmax(scores))
+        if scores[best] < CACHE_SIMILARITY:
+            return None
+        return keys[best], float(scores[best])
+
+    def _fetch(self, key: str) -> Optional[tuple]:
+        with self._pool.connection() as conn:
+            row = conn.execute("SELECT value, version, created FROM cache WHERE key=?", (key,)).fetchone()
+            if row:
+                conn.execute("UPDATE cache SET accessed=? WHERE key=?", (time.time(), key))
+        if not row:
+            return None
+        try:
+            value = _decode(row[0])
+        except (ValueError, zlib.error) as e:
+            print(f"cache entry unreadable: {e}")
+            return None
+        return value, row[1], row[2]
+
+    def _lookup(self, key: str, current: str, stat: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is not None:
+            if stat == "exact_hits":
+                stat = "memory_hits"
+        else:
+            entry = self._fetch(key)
+            if entry is None:
+                return None
+
+        value, version, created = entry
+        reason = self._valid(version, created, current)
+        if reason:
+            self._count(reason)
+            self._drop([key])
+            return None
+        if stat != "memory_hits":
+            self._remember(key, value, version, created)
+        self._count(stat)
+        return CachedState(value)
+
+    def get(self, query: str) -> Optional[dict]:
+        start = time.perf_counter()
+        try:
+            current = data_version()
+            key = _key(query)
+            value = self._lookup(key, current, "exact_hits")
+            result = "hit"
+
+            if value is None and CACHE_SEMANTIC:
+                normalized = normalize_query(query)
+                vector = _embed(normalized)
+                match = self._nearest(vector, _entity_key(query)) if vector is not None else None
+                if match:
+                    value = self._lookup(match[0], current, "semantic_hits")
+                    if value is not None:
+                        result = "semantic_hit"
+                        print(f"semantic cache match ({match[1]:.3f})")
+
+            if value is None:
+                result = "miss"
+                self._count("misses")
+            record_cache("answer", result)
+            return value
+        finally:
+            self._count("lookup_ms", (time.perf_counter() - start) * 1000)
+
+    def set(self, query: str, value: dict):
+        key = _key(query)
+        version = data_version()
+        now = time.time()
+        value = compact_state(value)
+        blob = _encode(value)
+        vector = _embed(normalize_query(query)) if CACHE_SEMANTIC else None
+        entities = _entity_key(query)
+
+        with self._pool.connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO cache VALUES (?,?,?,?,?,?,?,?,?)",
+                         (key, blob, query, entities,
+                          vector.tobytes() if vector is not None else None,
+                          version, now, now, len(blob)))
+        self._remember(key, value, version, now)
+        with self._lock:
+            if self._vectors is not None and vector is not None:
+                self._vectors[key] = (vector, entities)
+                self._matrix = None
+        self._evict()
+
+    def _evict(self):
+        # expired rows first, then least recently used until under budget
+        cutoff = time.time() - CACHE_TTL
+        with self._pool.connection() as conn:
+            stale = [row[0] for row in conn.execute("SELECT key FROM cache WHERE created < ?", (cutoff,))]
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+            excess = []
+            if total > CACHE_MAX_BYTES:
+                for key, size in conn.execute("SELECT key, size FROM cache ORDER BY accessed"):
+                    excess.append(key)
+                    total -= size
+                    if total <= CACHE_MAX_BYTES:
+                        break
+        if stale or excess:
+            self._drop(stale + excess)
+            self._count("expired", len(stale))
+            self._count("evicted", len(excess))
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._vectors = None
+            self._matrix = None
+        with self._pool.connection() as conn:
+            conn.execute("DELETE FROM cache")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["exact_hits"] + stats["semantic_hits"] + stats["misses"]
+        stats["hit_rate"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        stats["avg_lookup_ms"] = stats.pop("lookup_ms") / lookups if lookups else 0.0
+        with self._pool.connection() as conn:
+            stats["entries"], stats["bytes"] = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+        return stats
+
+
+_cache: Optional[QueryCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_query_cache() -> QueryCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = QueryCache()
+    return _cache
 
 
 def get_cached(query: str):
     try:
-        conn = _get_conn()
-        row = conn.execute("SELECT value FROM cache WHERE key=?", (_key(query),)).fetchone()
-        conn.close()
-        return json.loads(row[0]) if row else None
-    except:
+        return get_query_cache().get(query)
+    except Exception as e:
+        print(f"cache read failed: {e}")
         return None
 
 
 def set_cache(query: str, value: dict):
     try:
-        conn = _get_conn()
-        conn.execute("INSERT OR REPLACE INTO cache VALUES (?,?)",
-                     (_key(query), json.dumps(value)))
-        conn.commit()
-        conn.close()
+        get_query_cache().set(query, value)
     except Exception as e:
-        print(f"cache write failed: {e}")
\ No newline at end of file
+        print(f"cache write failed: {e}")
+
+
+def cache_stats() -> dict:
+    return get_query_cache().stats()
+
+
+async def aget_cached(query: str):
+    # sqlite is blocking file io, keep it off the event loop
+    return await asyncio.to_thread(get_cached, query)
+
+
+async def aset_cache(query: str, value: dict):
+    await asyncio.to_thread(set_cache, query, value)
@@ -0,0 +1,191 @@
+import os
+import re
+from typing import Dict, List, NamedTuple, Optional
+
+from dotenv import load_dotenv
+
+from src.telemetry import COUNT_BUCKETS, metrics, record
+
+load_dotenv()
+
+# token budget for the retrieved-data part of each prompt. the rest of the
+# prompt (instructions, SAP line, reasoning) is small and fixed by comparison
+CONTEXT_BUDGETS = {
+    "reasoning": int(os.getenv("CONTEXT_BUDGET_REASONING", "1200")),
+    "synthesis": int(os.getenv("CONTEXT_BUDGET_SYNTHESIS", "400")),
+}
+# no llama tokenizer in the image, ~4 chars a token is close enough for
+# english + numbers and errs on the long side for the CSV rows
+CHARS_PER_TOKEN = float(os.getenv("CONTEXT_CHARS_PER_TOKEN", "4"))
+# a partial chunk shorter than this isn't worth the tokens
+MIN_PARTIAL_TOKENS = 40
+TOKEN_BUCKETS = (100, 200, 400, 800, 1200, 1600, 2400, 3200, 4800)
+
+_FIELD_RE = re.compile(r"^([^:\n]{1,40}): (.*)$")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def count_tokens(text: str) -> int:
+    return int(len(text) / CHARS_PER_TOKEN + 0.999)
+
+
+def _row(text: str) -> Optional[Dict[str, str]]:
+    # "Column: value" per line is how ingestion writes a CSV row
+    lines = text.split("\n")
+    if len(lines) < 3:
+        return None
+    fields = {}
+    for line in lines:
+        match = _FIELD_RE.match(line)
+        if not match:
+            return None
+        fields[match.group(1)] = match.group(2)
+    return fields
+
+
+def _table(rows: List[Dict[str, str]]) -> str:
+    # one header, one line per row. columns that hold the same value in
+    # every row go in a single "all rows" line instead of on each row
+    columns = list(dict.fromkeys(column for row in rows for column in row))
+    constant = [c for c in columns if len(rows) > 1 and len({row.get(c, "") for row in rows}) == 1]
+    varying = [c for c in columns if c not in constant]
+    lines = []
+    if constant:
+        lines.append("all rows: " + ", ".join(f"{c}={rows[0][c]}" for c in constant if rows[0][c]))
+    lines.append(" | ".join(varying))
+    lines += [" | ".join(row.get(c, "") for c in varying) for row in rows]
+    return "\n".join(lines)
+
+
+def _render(parts: List[tuple]) -> str:
+    # one table per source table (rows starting with the same column -
+    # UDI, machine_id - rows with a "Failure modes" line just get one more
+    # column), free text chunks as they are, in rank order of first chunk
+    tables: Dict[str, List[Dict[str, str]]] = {}
+    order: List[tuple] = []
+    for kind, value in parts:
+        if kind == "row":
+            table = next(iter(value))
+            if table not in tables:
+                tables[table] = []
+                order.append(("table", table))
+            tables[table].append(value)
+        else:
+            order.append(("text", value))
+    return "\n\n".join(_table(tables[value]) if kind == "table" else value for kind, value in order)
+
+
+def _truncate(text: str, tokens: int) -> str:
+    limit = int(tokens * CHARS_PER_TOKEN)
+    cut = text[:limit].rsplit(" ", 1)[0]
+    return cut + " ..."
+
+
+class Context(NamedTuple):
+    text: str
+    tokens: int
+    budget: int
+    docs_in: int
+    docs_used: int
+    duplicates: int
+    truncated: bool
+
+    def usage(self) -> dict:
+        return {"tokens": self.tokens, "budget": self.budget, "docs_in": self.docs_in,
+                "docs_used": self.docs_used, "duplicates": self.duplicates, "truncated": self.truncated}
+
+
+def assemble(docs: List[str], budget: int) -> Context:
+    """
+    Retrieved chunks -> prompt text within `budget` tokens. docs come
+    ranked from retrieval, best first, and are taken in that order until
+    the budget runs out - the first one that doesn't fit is cut down if
+    enough room is left, the rest are dropped. CSV rows are collapsed into
+    tables, repeated rows / chunks only go in once.
+    """
+    parts: List[tuple] = []
+    seen = set()
+    duplicates = 0
+    truncated = False
+    text = ""
+
+    for doc in docs:
+        row = _row(doc)
+        signature = tuple(row.items()) if row else _SPACE_RE.sub(" ", doc).strip().lower()
+        if signature in seen:
+            duplicates += 1
+            continue
+        seen.add(signature)
+
+        candidate = parts + [("row", row) if row else ("text", doc)]
+        rendered = _render(candidate)
+        if count_tokens(rendered) <= budget:
+            parts, text = candidate, rendered
+            continue
+
+        # rows are small, a row that doesn't fit is dropped whole
+        left = budget - count_tokens(text) - 1
+        if row is None and left >= MIN_PARTIAL_TOKENS:
+            parts = parts + [("text", _truncate(doc, left))]
+            text = _render(parts)
+        truncated = True
+        break
+
+    return Context(text, count_tokens(text), budget, len(docs), len(parts), duplicates, truncated)
+
+
+def references(docs: List[str], ids: List[str]) -> str:
+    """
+    One line per retrieved chunk - the identifying fields of a row or the
+    start of a text chunk, plus its chunk id. What synthesis needs to cite
+    sources once reasoning has already read the full text.
+    """
+    lines, seen = [], set()
+    for i, doc in enumerate(docs):
+        row = _row(doc)
+        if row:
+            label = ", ".join(f"{k}={v}" for k, v in list(row.items())[:2])
+            if "Failure modes" in row:
+                label += f", {row['Failure modes']}"
+        else:
+            label = _truncate(_SPACE_RE.sub(" ", doc).strip(), 20)
+        if label in seen:
+            continue
+        seen.add(label)
+        ref = f" ({ids[i][:12]})" if i < len(ids) and ids[i] else ""
+        lines.append(f"[{len(lines) + 1}] {label}{ref}")
+    return "\n".join(lines)
+
+
+def stage_references(stage: str, state: dict) -> Context:
+    """references() for the retrieved docs, as many lines as the budget takes."""
+    docs = state.get("retrieved_docs", [])
+    budget = CONTEXT_BUDGETS[stage]
+    lines = ["sources (full text was read in the analysis):"]
+    for line in references(docs, state.get("retrieved_ids", [])).split("\n") if docs else []:
+        if count_tokens("\n".join(lines + [line])) > budget:
+            break
+        lines.append(line)
+    text = "\n".join(lines) if docs else ""
+    used = max(len(lines) - 1, 0)
+    refs = len(references(docs, state.get("retrieved_ids", [])).split("\n")) if docs else 0
+    context = Context(text, count_tokens(text), budget, len(docs), used, len(docs) - refs, used < refs)
+    report(stage, context)
+    return context
+
+
+def stage_context(stage: str, state: dict) -> Context:
+    """Assembles the retrieved docs for one stage and reports the budget use."""
+    context = assemble(state.get("retrieved_docs", []), CONTEXT_BUDGETS[stage])
+    report(stage, context)
+    return context
+
+
+def report(stage: str, context: Context):
+    metrics.observe("aria_context_tokens", context.tokens, {"stage": stage}, buckets=TOKEN_BUCKETS)
+    metrics.observe("aria_context_docs", context.docs_used, {"stage": stage}, buckets=COUNT_BUCKETS)
+    if context.truncated:
+        metrics.inc("aria_context_truncated_total", {"stage": stage})
+    record("context", stage, **context.usage())
+    print(f"  → {stage} context: {context.tokens}/{context.budget} tokens, "
+          f"{context.docs_used}/{context.docs_in} docs")
@@ -0,0 +1,90 @@
+import os
+import time
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# chunks handed to the model per forward pass
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+# cpu processes, 1 means embed in this process
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+
+
+def sentence_transformer_kwargs() -> dict:
+    """
+    Model kwargs shared by ingestion and query time so both sides produce
+    the same vectors. EMBED_BACKEND=onnx runs MiniLM through onnxruntime,
+    EMBED_ONNX_FILE picks a quantized export, e.g. onnx/model_qint8_avx512.onnx
+    """
+    kwargs = {"device": "cpu"}
+    backend = os.getenv("EMBED_BACKEND", "torch")
+    if backend != "torch":
+        kwargs["backend"] = backend
+        onnx_file = os.getenv("EMBED_ONNX_FILE")
+        if onnx_file:
+            kwargs["model_kwargs"] = {"file_name": onnx_file}
+    return kwargs
+
+
+class EmbeddingPool:
+    """
+    Batched embedding over a pool of cpu worker processes.
+    Use as a context manager so the worker processes get shut down.
+    """
+
+    def __init__(self, model_name: str, workers: int = EMBED_WORKERS,
+                 batch_size: int = EMBED_BATCH_SIZE):
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self._pool: Optional[dict] = None
+        self.embedded = 0
+        self.seconds = 0.0
+
+        if os.getenv("EMBED_BACKEND") == "fake":
+            # offline hashing stand-in, same as vectorstore.get_embeddings
+            from src.offline import HashEmbeddings
+            self.model = HashEmbeddings()
+            return
+
+        from sentence_transformers import SentenceTransformer
+
+        print(f"Loading embedding model ({self.workers} workers, batch {batch_size})...")
+        self.model = SentenceTransformer(model_name, **sentence_transformer_kwargs())
+        if self.workers > 1:
+            self._pool = self.model.start_multi_process_pool(["cpu"] * self.workers)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        start = time.perf_counter()
+        if isinstance(self.model, Embeddings):
+            vectors = np.asarray(self.model.embed_documents(texts), dtype=np.float32)
+        elif self._pool is not None:
+            vectors = self.model.encode_multi_process(
+                texts, self._pool, batch_size=self.batch_size, normalize_embeddings=True
+            )
+        else:
+            vectors = self.model.encode(
+                texts, batch_size=self.batch_size, normalize_embeddings=True
+            )
+        self.seconds += time.perf_counter() - start
+        self.embedded += len(texts)
+        return vectors
+
+    @property
+    def throughput(self) -> float:
+        """chunks/sec over everything embedded so far."""
+        return self.embedded / self.seconds if self.seconds else 0.0
+
+    def close(self):
+        if self._pool is not None:
+            self.model.stop_multi_process_pool(self._pool)
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
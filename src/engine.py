@@ -0,0 +1,115 @@
+import json
+import threading
+from typing import Dict, List, NamedTuple, Optional
+
+from langchain_community.vectorstores import Chroma
+
+from src.bm25_index import BM25Index, build_bm25_index, load_bm25_index
+from src.retriever import CANDIDATE_K, HybridResult, hybrid_search, hybrid_search_batch
+from src.stage_cache import stage_cache
+
+
+class _Components(NamedTuple):
+    vs: Chroma  # or ann_index.ANNVectorStore with VECTOR_BACKEND=ann
+    bm25: BM25Index
+
+
+class RetrievalEngine:
+    """
+    Long-lived retrieval state shared by the API and main.run.
+    Embedding model and chroma collection are loaded once, the BM25
+    index is memory-mapped from disk, every query after that is served
+    from memory.
+
+    Readers grab the current snapshot (a single attribute read) so they
+    never block each other. reload() builds a full new snapshot off to
+    the side and swaps it in, queries in flight keep the old one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._components: Optional[_Components] = None
+        self._memo = stage_cache("retrieval")
+
+    def _load(self) -> _Components:
+        from src.vectorstore import load_vectorstore
+        from src.ingestion import iter_chunks
+
+        bm25 = load_bm25_index()
+        if bm25 is None:
+            # vectorstore built before the keyword index existed, build it once
+            print("BM25 index missing, building it from the raw data...")
+            bm25 = build_bm25_index(iter_chunks())
+        # the ANN backend shares the BM25 doc store, chroma ignores it
+        vs = load_vectorstore(bm25)
+        return _Components(vs, bm25)
+
+    def components(self) -> _Components:
+        snapshot = self._components
+        if snapshot is None:
+            with self._lock:
+                # another thread may have loaded while we waited
+                if self._components is None:
+                    self._components = self._load()
+                snapshot = self._components
+        return snapshot
+
+    def version(self) -> str:
+        """Identifies the indexes being served, changes after a rebuild + reload."""
+        return self.components().bm25.version
+
+    def warm_up(self):
+        self.components()
+
+    def reload(self):
+        """Rebuild everything from disk, call this when the data changes."""
+        with self._lock:
+            fresh = self._load()
+            self._components = fresh
+        print("retrieval engine reloaded")
+
+    @staticmethod
+    def _memo_key(snapshot: _Components, query: str, candidate_k: int, spec: Optional[dict]) -> str:
+        # results are only reused against the index they came from
+        return json.dumps([snapshot.bm25.version, query, candidate_k, spec], sort_keys=True)
+
+    def search(self, query: str, candidate_k: int = CANDIDATE_K,
+               spec: Optional[Dict[str, Dict[str, list]]] = None) -> HybridResult:
+        snapshot = self.components()
+        key = self._memo_key(snapshot, query, candidate_k, spec)
+        result = self._memo.get(key)
+        if result is None:
+            result = hybrid_search(query, snapshot.vs, snapshot.bm25, candidate_k=candidate_k, spec=spec)
+            self._memo.set(key, result)
+        return result
+
+    def search_batch(self, queries: List[str], candidate_k: int = CANDIDATE_K,
+                     specs: Optional[List[Optional[dict]]] = None) -> List[HybridResult]:
+        snapshot = self.components()
+        specs = specs or [None] * len(queries)
+        keys = [self._memo_key(snapshot, q, candidate_k, spec) for q, spec in zip(queries, specs)]
+        results = [self._memo.get(key) for key in keys]
+
+        # only the ones not seen recently go to the embedding model / chroma
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            fresh = hybrid_search_batch([queries[i] for i in missing], snapshot.vs, snapshot.bm25,
+                                        candidate_k=candidate_k, specs=[specs[i] for i in missing])
+            for i, result in zip(missing, fresh):
+                results[i] = result
+                self._memo.set(keys[i], result)
+        return results
+
+
+_engine: Optional[RetrievalEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> RetrievalEngine:
+    """Process-wide engine, api.py and main.run both go through this."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = RetrievalEngine()
+    return _engine
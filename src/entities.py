@@ -0,0 +1,94 @@
+import re
+from typing import Dict, List, Optional
+
+# SAP machine ids look like M001, AI4I product ids like M14860 / L47181
+MACHINE_ID_RE = re.compile(r"\bM\d{3}\b", re.IGNORECASE)
+PRODUCT_ID_RE = re.compile(r"\b[LMH]\d{5}\b", re.IGNORECASE)
+TYPE_RE = re.compile(r"\btype\s*[-:]?\s*([LMH])\b", re.IGNORECASE)
+QUALITY_RE = re.compile(r"\b(low|medium|high)[- ]quality\b", re.IGNORECASE)
+HISTORY_RE = re.compile(r"\b(happened before|history|historical|in the past|previous(ly)?|how often)\b",
+                        re.IGNORECASE)
+
+# failure code -> phrases technicians actually type
+FAILURE_PHRASES = {
+    "twf": ["twf", "tool wear"],
+    "hdf": ["hdf", "heat dissipation", "overheat"],
+    "pwf": ["pwf", "power failure"],
+    "osf": ["osf", "overstrain"],
+    "rnf": ["rnf", "random failure"],
+}
+
+QUALITY_TYPES = {"low": "L", "medium": "M", "high": "H"}
+
+
+def extract_entities(query: str) -> Dict[str, List[str]]:
+    """Pull machine ids, product ids, product types and failure codes out of a query."""
+    text = query.lower()
+    types = {m.upper() for m in TYPE_RE.findall(query)}
+    types |= {QUALITY_TYPES[m.lower()] for m in QUALITY_RE.findall(query)}
+
+    return {
+        "machine_id": sorted({m.upper() for m in MACHINE_ID_RE.findall(query)}),
+        "product_id": sorted({m.upper() for m in PRODUCT_ID_RE.findall(query)}),
+        "type": sorted(types),
+        "failure_mode": sorted(code for code, phrases in FAILURE_PHRASES.items()
+                               if any(p in text for p in phrases)),
+    }
+
+
+def build_filter(query: str, intent: str = "") -> Optional[Dict[str, Dict[str, list]]]:
+    """
+    Turns query entities into a retrieval filter, keyed by doc_type:
+        {"defect_record": {"failure_mode": ["hdf"]}, "sap_record": {"machine_id": ["M001"]}}
+    Fields AND together, values inside a field OR together. A filter only
+    narrows its own table, so naming M001 drops other machines' SAP rows
+    but still lets sensor rows through. None means search everything.
+    """
+    entities = extract_entities(query)
+    spec: Dict[str, Dict[str, list]] = {}
+
+    defect = {}
+    if entities["product_id"]:
+        defect["product_id"] = entities["product_id"]
+    if entities["type"]:
+        defect["type"] = entities["type"]
+    if entities["failure_mode"]:
+        defect["failure_mode"] = entities["failure_mode"]
+    # history questions only care about rows where something actually failed
+    if intent == "historical_pattern" or HISTORY_RE.search(query):
+        defect["machine_failure"] = [1]
+    if defect:
+        spec["defect_record"] = defect
+
+    if entities["machine_id"]:
+        spec["sap_record"] = {"machine_id": entities["machine_id"]}
+
+    return spec or None
+
+
+def _field_clause(field: str, values: list) -> dict:
+    if field == "failure_mode":
+        # failure modes are separate 0/1 flag columns in metadata
+        clauses = [{code: 1} for code in values]
+        return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+    if len(values) == 1:
+        return {field: values[0]}
+    return {field: {"$in": values}}
+
+
+def _and(clauses: List[dict]) -> dict:
+    # chroma wants at least two operands for $and / $or
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def to_chroma_where(spec: Optional[Dict[str, Dict[str, list]]]) -> Optional[dict]:
+    """Same filter as a chroma where clause."""
+    if not spec:
+        return None
+    branches = []
+    for doc_type, fields in spec.items():
+        clauses = [{"doc_type": doc_type}] + [_field_clause(f, v) for f, v in fields.items()]
+        branches.append(_and(clauses))
+    # every other table passes untouched
+    branches.append({"doc_type": {"$nin": list(spec)}})
+    return {"$or": branches}
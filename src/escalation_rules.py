@@ -0,0 +1,122 @@
+import os
+import operator
+import threading
+from dataclasses import dataclass, fields
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from src.sap_data import MaintenanceRecord, get_sap_client
+
+load_dotenv()
+
+# these thresholds came from looking at the dataset patterns
+LOW_STOCK_THRESHOLD = int(os.getenv("LOW_STOCK_THRESHOLD", "3"))
+HIGH_WORKORDER_THRESHOLD = int(os.getenv("HIGH_WORKORDER_THRESHOLD", "3"))
+
+# same operator works on a single int and on a numpy column
+_OPS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+_NUMERIC = {f.name for f in fields(MaintenanceRecord) if f.type in (int, "int")}
+
+
+@dataclass(frozen=True)
+class Rule:
+    reason: str
+    field: str
+    op: str
+    threshold: float
+
+    def compile(self) -> Tuple[str, str, object, float]:
+        if self.field not in _NUMERIC:
+            raise ValueError(f"rule '{self.reason}': {self.field} is not a numeric SAP field")
+        return self.reason, self.field, _OPS[self.op], self.threshold
+
+
+# one record escalates if any of these hold
+RULES = [
+    Rule("low bearing stock", "bearing_stock", "<", LOW_STOCK_THRESHOLD),
+    Rule("low hydraulic stock", "hydraulic_stock", "<", LOW_STOCK_THRESHOLD),
+    Rule("high open work orders", "open_work_orders", ">=", HIGH_WORKORDER_THRESHOLD),
+]
+
+
+class RuleSet:
+    """
+    Threshold rules checked straight on MaintenanceRecord numbers.
+    evaluate() does one machine for the pipeline, sweep() does the whole
+    plant in one pass - one numpy comparison per rule over every machine.
+    """
+
+    def __init__(self, rules: List[Rule] = RULES):
+        self.rules = rules
+        self._compiled = [rule.compile() for rule in rules]
+
+    def evaluate(self, record: MaintenanceRecord) -> List[str]:
+        return [reason for reason, field, op, threshold in self._compiled
+                if op(getattr(record, field), threshold)]
+
+    def sweep(self, records: List[MaintenanceRecord],
+              columns: Optional[Dict[str, np.ndarray]] = None) -> List[dict]:
+        """Every machine that trips at least one rule, most reasons first."""
+        if not records:
+            return []
+        columns = columns if columns is not None else _columns(records)
+        hits = np.stack([op(columns[field], threshold) for _, field, op, threshold in self._compiled])
+
+        # which rules fired, as a bitmask per machine - machines sharing a
+        # mask share the reasons list, so that's built once per mask
+        bits = (hits.astype(np.int64) << np.arange(len(self._compiled), dtype=np.int64)[:, None]).sum(axis=0)
+        flagged = np.flatnonzero(bits)
+        counts = hits[:, flagged].sum(axis=0)
+        flagged = flagged[np.argsort(-counts, kind="stable")]
+        reasons = {int(mask): [self._compiled[r][0] for r in range(len(self._compiled)) if mask >> r & 1]
+                   for mask in np.unique(bits[flagged])}
+
+        return [{"machine_id": records[idx].machine_id,
+                 "status": records[idx].status,
+                 "reasons": reasons[int(bits[idx])]}
+                for idx in flagged]
+
+
+def _columns(records: List[MaintenanceRecord]) -> Dict[str, np.ndarray]:
+    return {field: np.fromiter((getattr(r, field) for r in records), dtype=np.int64, count=len(records))
+            for field in _NUMERIC}
+
+
+_rules: Optional[RuleSet] = None
+_rules_lock = threading.Lock()
+# (version, records, columns) of the last sweep, SAP data changes rarely
+_plant: Optional[tuple] = None
+
+
+def get_rules() -> RuleSet:
+    global _rules
+    if _rules is None:
+        with _rules_lock:
+            if _rules is None:
+                _rules = RuleSet()
+    return _rules
+
+
+def plant_sweep() -> List[dict]:
+    """Escalation check across every machine SAP knows about, no LLM involved."""
+    global _plant
+    client = get_sap_client()
+    version = client.version()
+    snapshot = _plant
+    if not version or snapshot is None or snapshot[0] != version:
+        # unversioned (live) clients are read fresh every sweep
+        records = client.all_records()
+        snapshot = (version, records, _columns(records))
+        _plant = snapshot
+    _, records, columns = snapshot
+    return get_rules().sweep(records, columns)
@@ -0,0 +1,281 @@
+import os
+import json
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from dotenv import load_dotenv
+
+from src.ingestion import FAILURE_MODES
+from src.entities import extract_entities
+
+load_dotenv()
+
+FAILURE_STATS_PATH = os.getenv("FAILURE_STATS_PATH", "./data/failure_stats.json")
+
+MODES = ["twf", "hdf", "pwf", "osf", "rnf"]
+# fixed bin edges so the histograms can be filled while streaming
+HISTOGRAMS = {
+    "torque_nm": np.arange(0, 85, 5),
+    "rotational_speed_rpm": np.arange(1100, 3000, 100),
+    "tool_wear_min": np.arange(0, 280, 20),
+    "air_temperature_k": np.arange(295, 306, 1),
+    "process_temperature_k": np.arange(305, 315, 1),
+}
+# failure rate over time, in buckets of this many rows (UDI order)
+TREND_BUCKET = 1000
+
+
+class _Sequence:
+    """
+    Where a failure mode shows up in UDI order - count, first / last UDI
+    and the gaps between occurrences, kept as running values instead of
+    a list of every UDI. The CSV comes in UDI order; if it ever doesn't,
+    min / max gap can't be known from running values and are left out,
+    the mean gap only needs first, last and count so it stays exact.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.first: Optional[int] = None
+        self.last: Optional[int] = None
+        self.prev: Optional[int] = None
+        self.min_gap: Optional[int] = None
+        self.max_gap: Optional[int] = None
+        self.ordered = True
+
+    def add(self, udi: int):
+        if self.prev is not None:
+            gap = udi - self.prev
+            if gap < 0:
+                self.ordered = False
+            elif self.ordered:
+                self.min_gap = gap if self.min_gap is None else min(self.min_gap, gap)
+                self.max_gap = gap if self.max_gap is None else max(self.max_gap, gap)
+        self.count += 1
+        self.first = udi if self.first is None else min(self.first, udi)
+        self.last = udi if self.last is None else max(self.last, udi)
+        self.prev = udi
+
+    def to_dict(self) -> dict:
+        if not self.count:
+            return {"count": 0}
+        many = self.count > 1
+        return {
+            "count": self.count,
+            "first_udi": self.first,
+            "last_udi": self.last,
+            "mean_gap": round((self.last - self.first) / (self.count - 1), 1) if many else None,
+            "min_gap": self.min_gap if many and self.ordered else None,
+            "max_gap": self.max_gap if many and self.ordered else None,
+        }
+
+
+class FailureStatsBuilder:
+    """
+    Aggregates over every defect record, filled in the same pass as the
+    BM25 index. Only counters are kept, the saved file is a few KB no
+    matter how many rows went in.
+    """
+
+    def __init__(self):
+        self.rows: Dict[str, int] = {}
+        self.failures: Dict[str, int] = {}
+        # type -> mode -> count, and mode x mode co-occurrence
+        self.by_type: Dict[str, Dict[str, int]] = {}
+        self.cooccurrence = np.zeros((len(MODES), len(MODES)), dtype=np.int64)
+        # "all" + every mode -> field -> bin counts
+        self.histograms = {key: {field: np.zeros(len(edges) + 1, dtype=np.int64)
+                                 for field, edges in HISTOGRAMS.items()}
+                           for key in ["all"] + MODES}
+        self.sequences = {mode: _Sequence() for mode in MODES + ["any"]}
+        self.trend: Dict[int, List[int]] = {}
+
+    def add_documents(self, docs: Iterable[Document]):
+        for doc in docs:
+            metadata = doc.metadata
+            if metadata.get("doc_type") != "defect_record":
+                continue
+            self._add(metadata)
+
+    def _add(self, metadata: dict):
+        product_type = str(metadata.get("type", "?"))
+        udi = int(metadata.get("udi", 0))
+        flags = [mode for mode in MODES if metadata.get(mode) == 1]
+        failed = metadata.get("machine_failure") == 1
+
+        self.rows[product_type] = self.rows.get(product_type, 0) + 1
+        if failed:
+            self.failures[product_type] = self.failures.get(product_type, 0) + 1
+            self.sequences["any"].add(udi)
+        counts = self.by_type.setdefault(product_type, {})
+        for mode in flags:
+            counts[mode] = counts.get(mode, 0) + 1
+            self.sequences[mode].add(udi)
+        for a in flags:
+            for b in flags:
+                self.cooccurrence[MODES.index(a), MODES.index(b)] += 1
+
+        bucket = self.trend.setdefault(max(udi - 1, 0) // TREND_BUCKET, [0, 0])
+        bucket[0] += 1
+        bucket[1] += int(failed)
+
+        for field, edges in HISTOGRAMS.items():
+            if field not in metadata:
+                continue
+            # bin 0 is below the first edge, bin len(edges) above the last
+            idx = int(np.searchsorted(edges, float(metadata[field]), side="right"))
+            for key in ["all"] + flags:
+                self.histograms[key][field][idx] += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "rows": self.rows,
+            "failures": self.failures,
+            "by_type": self.by_type,
+            "modes": MODES,
+            "cooccurrence": self.cooccurrence.tolist(),
+            "bin_edges": {field: edges.tolist() for field, edges in HISTOGRAMS.items()},
+            "histograms": {key: {field: counts.tolist() for field, counts in fields.items()}
+                           for key, fields in self.histograms.items()},
+            "sequence": {mode: sequence.to_dict() for mode, sequence in self.sequences.items()},
+            "trend_bucket": TREND_BUCKET,
+            "trend": {str(bucket): counts for bucket, counts in sorted(self.trend.items())},
+        }
+
+    def save(self, path: str = FAILURE_STATS_PATH) -> "FailureStats":
+        stats = self.to_dict()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(stats, f, separators=(",", ":"))
+        os.replace(tmp, path)
+        print(f"failure stats: {sum(self.rows.values())} defect records -> {path}")
+        return FailureStats(stats)
+
+
+def _range(edges: List[float], counts: List[int], share: float = 0.8) -> Optional[tuple]:
+    # narrowest run of bins holding `share` of the mass, as (low, high)
+    counts = np.asarray(counts)
+    total = counts.sum()
+    if not total:
+        return None
+    bounds = [-np.inf] + list(edges) + [np.inf]
+    best = None
+    for start in range(len(counts)):
+        mass = np.cumsum(counts[start:])
+        end = start + int(np.searchsorted(mass, share * total))
+        if end >= len(counts):
+            break
+        if best is None or end - start < best[1] - best[0]:
+            best = (start, end)
+    low, high = bounds[best[0]], bounds[best[1] + 1]
+    return low, high
+
+
+class FailureStats:
+    """Read side - every answer is a lookup in a few KB of counters."""
+
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    @property
+    def total_rows(self) -> int:
+        return sum(self.stats["rows"].values())
+
+    def mode_counts(self, mode: str, types: Optional[List[str]] = None) -> tuple:
+        types = types or list(self.stats["rows"])
+        count = sum(self.stats["by_type"].get(t, {}).get(mode, 0) for t in types)
+        rows = sum(self.stats["rows"].get(t, 0) for t in types)
+        return count, rows
+
+    def typical_range(self, mode: str, field: str) -> Optional[tuple]:
+        return _range(self.stats["bin_edges"][field], self.stats["histograms"][mode][field])
+
+    def summary(self, modes: Optional[List[str]] = None, types: Optional[List[str]] = None) -> str:
+        """Plain text facts for the prompt, for the failure modes / types asked about."""
+        modes = modes or MODES
+        types = types or []
+        lines = []
+        total_failures = sum(self.stats["failures"].values())
+        lines.append(f"{total_failures} machine failures in {self.total_rows} records "
+                     f"({100 * total_failures / max(self.total_rows, 1):.2f}%).")
+        rates = [100 * failed / rows for rows, failed in self.stats["trend"].values() if rows]
+        if len(rates) > 1:
+            lines.append(f"failure rate per {self.stats['trend_bucket']} records (UDI order) "
+                         f"ranges {min(rates):.1f}-{max(rates):.1f}%, latest {rates[-1]:.1f}%.")
+
+        for mode in modes:
+            count, rows = self.mode_counts(mode, types)
+            scope = f"type {'/'.join(types)}" if types else "all types"
+            line = (f"{FAILURE_MODES[mode]} ({mode.upper()}): {count} of {rows} records in {scope} "
+                    f"({100 * count / max(rows, 1):.2f}%)")
+            per_type = ", ".join(f"{t} {100 * self.stats['by_type'].get(t, {}).get(mode, 0) / n:.2f}%"
+                                 for t, n in sorted(self.stats["rows"].items()))
+            line += f"; by type: {per_type}."
+            lines.append(line)
+            if not count:
+                continue
+
+            i = self.stats["modes"].index(mode)
+            together = [f"{other.upper()} x{self.stats['cooccurrence'][i][j]}"
+                        for j, other in enumerate(self.stats["modes"])
+                        if j != i and self.stats["cooccurrence"][i][j]]
+            if together:
+                lines.append(f"  occurs together with: {', '.join(together)}.")
+
+            ranges = []
+            for field in HISTOGRAMS:
+                failing, overall = self.typical_range(mode, field), self.typical_range("all", field)
+                if failing and overall:
+                    ranges.append(f"{field} {failing[0]:g}-{failing[1]:g} (fleet {overall[0]:g}-{overall[1]:g})")
+            if ranges:
+                lines.append(f"  typical readings when it happens: {'; '.join(ranges)}.")
+
+            seq = self.stats["sequence"][mode]
+            if seq["count"] > 1:
+                gap = f" (gap {seq['min_gap']}-{seq['max_gap']})" if seq.get("min_gap") is not None else ""
+                lines.append(f"  sequence: first at UDI {seq['first_udi']}, last at UDI {seq['last_udi']}, "
+                             f"on average every {seq['mean_gap']} records{gap}.")
+        return "\n".join(lines)
+
+    def summary_for_query(self, query: str) -> str:
+        entities = extract_entities(query)
+        return self.summary(entities["failure_mode"] or None, entities["type"] or None)
+
+
+def build_failure_stats(chunks: Iterable[Document], path: str = FAILURE_STATS_PATH) -> FailureStats:
+    builder = FailureStatsBuilder()
+    builder.add_documents(chunks)
+    return builder.save(path)
+
+
+_stats: Optional[tuple] = None
+_stats_lock = threading.Lock()
+
+
+def get_failure_stats(path: str = FAILURE_STATS_PATH) -> Optional[FailureStats]:
+    """
+    Loaded once, reloaded when a rebuild replaces the file. Built from the
+    raw data the first time if ingestion ran before this index existed.
+    """
+    global _stats
+    if not os.path.exists(path):
+        with _stats_lock:
+            if not os.path.exists(path):
+                from src.ingestion import DEFECT_DATA_PATH, DEFECT_SCHEMA, iter_csv
+                if not os.path.exists(DEFECT_DATA_PATH):
+                    return None
+                print("failure stats missing, building them from the raw data...")
+                build_failure_stats(iter_csv(DEFECT_DATA_PATH, DEFECT_SCHEMA, doc_type="defect_record"), path)
+
+    mtime = os.stat(path).st_mtime_ns
+    current = _stats
+    if current is None or current[0] != (path, mtime):
+        with _stats_lock:
+            if _stats is None or _stats[0] != (path, mtime):
+                with open(path) as f:
+                    _stats = ((path, mtime), FailureStats(json.load(f)))
+            current = _stats
+    return current[1]
@@ -1,10 +1,17 @@
 import os
+import csv
+import hashlib
+from itertools import islice
 from pathlib import Path
-from typing import List
+from typing import Iterable, Iterator, List, Optional
 
+import numpy as np
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader, CSVLoader
+from langchain_community.document_loaders import PyPDFLoader
+from dotenv import load_dotenv
+
+load_dotenv()
 
 # 500 worked better than 1000, less noise in results
 # 50 overlap so we don't lose context at boundaries
@@ -12,31 +19,172 @@ CHUNK_SIZE = 500
 CHUNK_OVERLAP = 50
 
 
-def load_csv(file_path: str, metadata_columns: list = []) -> List[Document]:
-    """Load CSV as documents. metadata_columns are kept as filters later."""
+# the AI4I sensor table on its own - fleet scan and failure stats read it
+# directly, ingestion picks it up with everything else in data/raw
+DEFECT_DATA_PATH = os.getenv("DEFECT_DATA_PATH", "./data/raw/defect_records.csv")
+
+# typed metadata per table, column -> (metadata key, type)
+# unknown columns still end up in the text, just not in metadata
+DEFECT_SCHEMA = {
+    "UDI": ("udi", int),
+    "Product ID": ("product_id", str),
+    "Type": ("type", str),
+    "Air temperature [K]": ("air_temperature_k", float),
+    "Process temperature [K]": ("process_temperature_k", float),
+    "Rotational speed [rpm]": ("rotational_speed_rpm", float),
+    "Torque [Nm]": ("torque_nm", float),
+    "Tool wear [min]": ("tool_wear_min", float),
+    "Machine failure": ("machine_failure", int),
+    "TWF": ("twf", int),
+    "HDF": ("hdf", int),
+    "PWF": ("pwf", int),
+    "OSF": ("osf", int),
+    "RNF": ("rnf", int),
+}
+
+SAP_SCHEMA = {
+    "machine_id": ("machine_id", str),
+    "last_maintenance": ("last_maintenance", str),
+    "open_work_orders": ("open_work_orders", int),
+    "bearing_stock": ("bearing_stock", int),
+    "hydraulic_stock": ("hydraulic_stock", int),
+    "status": ("status", str),
+}
+
+FAILURE_MODES = {
+    "twf": "tool wear failure",
+    "hdf": "heat dissipation failure",
+    "pwf": "power failure",
+    "osf": "overstrain failure",
+    "rnf": "random failure",
+}
+
+
+def sniff_delimiter(file_path: str) -> str:
+    # sap export is tab separated, AI4I is comma separated
+    with open(file_path, encoding="utf-8-sig", newline="") as f:
+        header = f.readline()
+    try:
+        return csv.Sniffer().sniff(header, delimiters=",\t;").delimiter
+    except csv.Error:
+        return ","
+
+
+def _convert(value: str, kind):
+    try:
+        return kind(float(value)) if kind is int else kind(value)
+    except ValueError:
+        return None
+
+
+def iter_csv(file_path: str, schema: Optional[dict] = None, doc_type: str = "table_row") -> Iterator[Document]:
+    """
+    One document per CSV row, no text splitting - a sensor row is
+    already a self contained record. schema gives typed metadata so
+    rows can be filtered on Type, failure flags, machine id etc.
+    """
     print(f"Loading: {file_path}")
-    loader = CSVLoader(
-        file_path=file_path,
-        metadata_columns=metadata_columns
-    )
-    return loader.load()
+    schema = schema or {}
+    with open(file_path, encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f, delimiter=sniff_delimiter(file_path))
+        for row_num, row in enumerate(reader):
+            metadata = {"source": file_path, "row": row_num, "doc_type": doc_type}
+            lines = []
+            for column, value in row.items():
+                column, value = column.strip(), (value or "").strip()
+                lines.append(f"{column}: {value}")
+                if column in schema and value != "":
+                    key, kind = schema[column]
+                    typed = _convert(value, kind)
+                    # chroma rejects None metadata, just leave it out
+                    if typed is not None:
+                        metadata[key] = typed
 
+            # spell the failure modes out so semantic search can match them
+            modes = [name for flag, name in FAILURE_MODES.items() if metadata.get(flag) == 1]
+            if modes:
+                lines.append(f"Failure modes: {', '.join(modes)}")
 
-def load_pdfs(folder_path: str) -> List[Document]:
-    """Load all PDFs from a folder, page by page."""
-    docs = []
+            doc = Document(page_content="\n".join(lines), metadata=metadata)
+            doc.metadata["chunk_id"] = chunk_id(doc)
+            yield doc
+
+
+def iter_pdfs(folder_path: str) -> Iterator[Document]:
+    """Yield PDF pages from a folder, one page at a time."""
     pdfs = list(Path(folder_path).glob("*.pdf"))
 
     if not pdfs:
         print(f"No PDFs in {folder_path}, skipping")
-        return []
+        return
 
     for pdf in pdfs:
         print(f"  → {pdf.name}")
         loader = PyPDFLoader(str(pdf))
-        docs.extend(loader.load())
+        yield from loader.lazy_load()
+
+
+def load_csv(file_path: str, schema: Optional[dict] = None) -> List[Document]:
+    """Load CSV as one document per row, schema columns are kept as filters later."""
+    return list(iter_csv(file_path, schema))
+
+
+def load_pdfs(folder_path: str) -> List[Document]:
+    """Load all PDFs from a folder, page by page."""
+    return list(iter_pdfs(folder_path))
+
+
+def chunk_id(doc: Document) -> str:
+    """Stable id for a chunk - hash of where it came from plus its content."""
+    if "chunk_id" in doc.metadata:
+        return doc.metadata["chunk_id"]
+    source = str(doc.metadata.get("source", ""))
+    return hashlib.md5(f"{source}|{doc.page_content}".encode()).hexdigest()
+
+
+def chunk_keys(chunk_ids: List[str]) -> np.ndarray:
+    """
+    64-bit keys for chunk ids, for diffing a build against what's stored
+    without a python set of strings. Chunk ids are md5 hex already, the
+    first 16 digits are the key; anything else gets hashed.
+    """
+    keys = np.empty(len(chunk_ids), dtype=np.uint64)
+    for i, cid in enumerate(chunk_ids):
+        try:
+            keys[i] = int(cid[:16], 16) if len(cid) == 32 else _hashed_key(cid)
+        except ValueError:
+            keys[i] = _hashed_key(cid)
+    return keys
+
+
+def _hashed_key(cid: str) -> int:
+    return int(hashlib.md5(cid.encode()).hexdigest()[:16], 16)
+
+
+def in_sorted(sorted_keys: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    """Which of keys are in sorted_keys (ascending), as a bool mask."""
+    if not len(sorted_keys):
+        return np.zeros(len(keys), dtype=bool)
+    pos = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return sorted_keys[pos] == keys
+
 
-    return docs
+def _splitter() -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        separators=["\n\n", "\n", ".", " "]
+    )
+
+
+def iter_chunk_documents(documents: Iterable[Document]) -> Iterator[Document]:
+    """Split docs lazily, one source doc in memory at a time."""
+    splitter = _splitter()
+    for doc in documents:
+        for chunk in splitter.split_documents([doc]):
+            chunk.metadata.setdefault("doc_type", "manual")
+            chunk.metadata["chunk_id"] = chunk_id(chunk)
+            yield chunk
 
 
 def chunk_documents(documents: List[Document]) -> List[Document]:
@@ -46,54 +194,67 @@ def chunk_documents(documents: List[Document]) -> List[Document]:
     natural boundaries (paragraphs → sentences → words)
     before making a hard cut. Much better than basic splitter.
     """
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        separators=["\n\n", "\n", ".", " "]
-    )
-    chunks = splitter.split_documents(documents)
+    chunks = list(iter_chunk_documents(documents))
     print(f"Got {len(chunks)} chunks from {len(documents)} docs")
     return chunks
 
 
-def load_and_chunk_all(data_folder: str = "./data/raw") -> List[Document]:
+def iter_chunks(data_folder: str = "./data/raw") -> Iterator[Document]:
     """
-    Entry point for the ingestion pipeline.
-    Loads defect records, SAP data, and any PDFs then chunks everything.
-    vectorstore.py calls this to build the knowledge base.
+    Streaming entry point for the ingestion pipeline.
+    Loaders yield rows/pages one at a time so peak memory doesn't depend
+    on how big the defect history is. vectorstore.py consumes this in
+    bounded batches.
+    CSV rows go through as-is (one doc per row), only PDF pages get split.
     """
-    all_docs = []
+    found = False
 
     # defect records from Kaggle AI4I dataset
     defect_path = os.path.join(data_folder, "defect_records.csv")
     if os.path.exists(defect_path):
-        defect_docs = load_csv(defect_path, metadata_columns=["Type"])
-        all_docs.extend(defect_docs)
-        print(f"Defect records: {len(defect_docs)} rows loaded")
+        found = True
+        yield from iter_csv(defect_path, DEFECT_SCHEMA, doc_type="defect_record")
 
     # SAP maintenance history mocked for now
     # TODO: replace with live SAP RFC call in production
     sap_path = os.path.join(data_folder, "sap_maintenance.csv")
     if os.path.exists(sap_path):
-        sap_docs = load_csv(sap_path)
-        all_docs.extend(sap_docs)
-        print(f"SAP records: {len(sap_docs)} rows loaded")
+        found = True
+        yield from iter_csv(sap_path, SAP_SCHEMA, doc_type="sap_record")
 
     # PDFs maintenance manuals if present
     manuals_path = os.path.join(data_folder, "maintenance_manuals")
     if os.path.exists(manuals_path):
-        pdf_docs = load_pdfs(manuals_path)
-        all_docs.extend(pdf_docs)
+        found = True
+        yield from iter_chunk_documents(iter_pdfs(manuals_path))
 
-    if not all_docs:
+    if not found:
         print("WARNING: nothing to ingest, check data folder")
-        return []
 
-    return chunk_documents(all_docs)
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    """Group any iterable into lists of at most size items."""
+    it = iter(items)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def load_and_chunk_all(data_folder: str = "./data/raw") -> List[Document]:
+    """
+    Loads defect records, SAP data, and any PDFs then chunks everything.
+    Materialises the whole corpus - fine for small data and ad-hoc use,
+    ingestion of big histories should stream through iter_chunks.
+    """
+    chunks = list(iter_chunks(data_folder))
+    print(f"Got {len(chunks)} chunks")
+    return chunks
 
 
 if __name__ == "__main__":
     chunks = load_and_chunk_all()
     print(f"\nTotal chunks: {len(chunks)}")
     print(f"\nSample:\n{chunks[0].page_content[:200]}")
-    print(f"Metadata: {chunks[0].metadata}")
\ No newline at end of file
+    print(f"Metadata: {chunks[0].metadata}")
@@ -0,0 +1,79 @@
+import os
+import asyncio
+import threading
+from typing import Dict
+
+import httpx
+from langchain_groq import ChatGroq
+from dotenv import load_dotenv
+
+from src.telemetry import llm_metrics
+
+load_dotenv()
+
+LLM_MODEL = os.getenv("LLM_MODEL", "llama-3.3-70b-versatile")
+# one keep-alive pool for every agent instead of one per ChatGroq instance
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+# groq, or fake for the offline stand-in (benchmarks, no API key needed)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "groq")
+LLM_FAKE_LATENCY = float(os.getenv("LLM_FAKE_LATENCY", "0"))
+
+_limits = httpx.Limits(
+    max_connections=LLM_MAX_CONNECTIONS,
+    max_keepalive_connections=LLM_MAX_CONNECTIONS
+)
+_http_client = httpx.Client(limits=_limits, timeout=LLM_TIMEOUT)
+
+
+class _PerLoopAsyncClient(httpx.AsyncClient):
+    """
+    The async client ChatGroq gets. An httpx pool belongs to the event
+    loop that opened its connections, and the CLI / batch / benchmark
+    code calls asyncio.run more than once per process - so every request
+    goes through a pool of the loop it's sent from, created on first use.
+    Pools of closed loops are dropped (their connections died with them).
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._kwargs = kwargs
+        self._clients: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+        self._lock = threading.Lock()
+
+    def _for_loop(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._clients.get(loop)
+            if client is None:
+                for closed in [other for other in self._clients if other.is_closed()]:
+                    del self._clients[closed]
+                client = self._clients[loop] = httpx.AsyncClient(**self._kwargs)
+        return client
+
+    async def send(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        return await self._for_loop().send(request, **kwargs)
+
+    async def aclose(self):
+        with self._lock:
+            client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+_http_async_client = _PerLoopAsyncClient(limits=_limits, timeout=LLM_TIMEOUT)
+
+
+def get_llm(temperature: float = 0):
+    """ChatGroq on the shared connection pools, sync and async, timed and token-counted."""
+    if LLM_BACKEND == "fake":
+        from src.offline import FakeChatModel
+        return FakeChatModel(temperature=temperature, latency=LLM_FAKE_LATENCY, callbacks=[llm_metrics])
+    return ChatGroq(
+        model=LLM_MODEL,
+        api_key=os.getenv("GROQ_API_KEY"),
+        temperature=temperature,
+        http_client=_http_client,
+        http_async_client=_http_async_client,
+        callbacks=[llm_metrics]
+    )
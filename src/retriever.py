@@ -1,58 +1,148 @@
 import os
-from typing import List
+import json
+from typing import Dict, List, NamedTuple, Optional, Tuple
 from langchain_core.documents import Document
 from langchain_community.vectorstores import Chroma
-from langchain_community.retrievers import BM25Retriever
+
+from src.bm25_index import BM25Index
+from src.ingestion import chunk_id
+from src.entities import to_chroma_where
+from src.ann_index import ANNVectorStore
 
 SEMANTIC_WEIGHT = 0.6
 BM25_WEIGHT = 0.4
 TOP_K = 5
 
+# each retriever hands this many scored candidates to fusion,
+# a retry widens the pool 4x until MAX_CANDIDATE_K
+CANDIDATE_K = 20
+MAX_CANDIDATE_K = 320
+
+
+class HybridResult(NamedTuple):
+    docs: List[Document]
+    scores: List[float]
+    confidence: float
+    # True when a wider candidate pool can't change the result
+    exhausted: bool
 
-def hybrid_search(query: str, vs: Chroma, chunks: List[Document]) -> List[Document]:
+
+def hybrid_search(query: str, vs: Chroma, bm25: BM25Index,
+                  candidate_k: int = CANDIDATE_K,
+                  spec: Optional[Dict[str, Dict[str, list]]] = None) -> HybridResult:
     """
     Manual hybrid search - combines semantic + BM25 scores.
     Semantic alone misses exact terms like TWF, HDF.
     BM25 alone misses meaning. Together they catch everything.
+    bm25 is the prebuilt on-disk index, never rebuild it per query.
+
+    Both sides are scaled to 0-1 on an absolute scale (not per query
+    min-max) so the fused score doubles as retrieval confidence.
+    spec (from entities.build_filter) narrows both sides to the matching
+    subset - chroma where clause + BM25 field index pre-filter.
+    """
+    if isinstance(vs, ANNVectorStore):
+        # filters go through the BM25 field index, no where clause
+        semantic_results = vs.similarity_search_with_score(query, k=candidate_k, spec=spec)
+    else:
+        semantic_results = vs.similarity_search_with_score(query, k=candidate_k, filter=to_chroma_where(spec))
+    return _fuse(query, semantic_results, bm25, candidate_k, spec)
+
+
+def hybrid_search_batch(queries: List[str], vs: Chroma, bm25: BM25Index,
+                        candidate_k: int = CANDIDATE_K,
+                        specs: Optional[List[Optional[dict]]] = None) -> List[HybridResult]:
+    """
+    hybrid_search for a whole batch - every query goes through the
+    embedding model in one batched call, and chroma gets one multi-vector
+    query per distinct filter instead of one round trip per query.
     """
-    # semantic search
-    semantic_results = vs.similarity_search(query, k=TOP_K)
-    
-    # keyword search
-    bm25 = BM25Retriever.from_documents(chunks)
-    bm25.k = TOP_K
-    bm25_results = bm25.invoke(query)
-
-    # combine - deduplicate by content
-    seen = set()
-    combined = []
-    
-    for doc in semantic_results + bm25_results:
-        key = doc.page_content[:100]
-        if key not in seen:
-            seen.add(key)
-            combined.append(doc)
-
-    return combined[:TOP_K]
+    specs = specs or [None] * len(queries)
+    vectors = vs.embeddings.embed_documents(queries)
+
+    if isinstance(vs, ANNVectorStore):
+        semantic = vs.search_by_vectors(vectors, candidate_k, specs)
+        return [_fuse(query, semantic[i], bm25, candidate_k, specs[i]) for i, query in enumerate(queries)]
+
+    # queries sharing a filter share a chroma call
+    groups: Dict[str, List[int]] = {}
+    for i, spec in enumerate(specs):
+        groups.setdefault(json.dumps(spec, sort_keys=True), []).append(i)
+
+    semantic: List[List[Tuple[Document, float]]] = [[] for _ in queries]
+    for members in groups.values():
+        results = vs._collection.query(
+            query_embeddings=[vectors[i] for i in members],
+            n_results=candidate_k,
+            where=to_chroma_where(specs[members[0]]),
+            include=["documents", "metadatas", "distances"]
+        )
+        for pos, i in enumerate(members):
+            semantic[i] = [
+                (Document(page_content=text, metadata=metadata or {}), distance)
+                for text, metadata, distance in zip(
+                    results["documents"][pos], results["metadatas"][pos], results["distances"][pos]
+                )
+            ]
+
+    return [_fuse(query, semantic[i], bm25, candidate_k, specs[i]) for i, query in enumerate(queries)]
+
+
+def _fuse(query: str, semantic_results: List[Tuple[Document, float]], bm25: BM25Index,
+          candidate_k: int, spec: Optional[dict]) -> HybridResult:
+    fused = {}
+    docs = {}
+
+    # semantic search - chroma default l2 space on normalized embeddings
+    # gives squared distance d = 2 - 2cos, so cos = 1 - d/2
+    for doc, distance in semantic_results:
+        key = chunk_id(doc)
+        similarity = min(max(1.0 - distance / 2.0, 0.0), 1.0)
+        docs.setdefault(key, doc)
+        fused[key] = fused.get(key, 0.0) + SEMANTIC_WEIGHT * similarity
+
+    # keyword search - normalised against matching every query term once
+    # in an average length doc, anything above that is capped at 1
+    bm25_results = bm25.search_with_scores(query, k=candidate_k, spec=spec)
+    max_bm25 = bm25.max_score(query)
+    for doc, score in bm25_results:
+        key = chunk_id(doc)
+        docs.setdefault(key, doc)
+        fused[key] = fused.get(key, 0.0) + BM25_WEIGHT * min(score / max_bm25, 1.0)
+
+    # combine - deduplicated by chunk id, ranked by fused score
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:TOP_K]
+
+    # missing results count as zero so a thin result set is low confidence
+    confidence = sum(score for _, score in ranked) / TOP_K
+
+    # if neither side filled its pool we've already seen everything
+    exhausted = (candidate_k >= MAX_CANDIDATE_K or
+                 (len(semantic_results) < candidate_k and len(bm25_results) < candidate_k))
+
+    return HybridResult(
+        docs=[docs[key] for key, _ in ranked],
+        scores=[round(score, 4) for _, score in ranked],
+        confidence=round(confidence, 4),
+        exhausted=exhausted
+    )
 
 
 def get_retriever_components():
-    """Returns vs and chunks needed for hybrid search."""
-    from src.vectorstore import load_vectorstore
-    from src.ingestion import load_and_chunk_all
-    
-    vs = load_vectorstore()
-    chunks = load_and_chunk_all()
-    return vs, chunks
+    """Returns vs and bm25 needed for hybrid search, from the shared engine."""
+    from src.engine import get_engine
+
+    components = get_engine().components()
+    return components.vs, components.bm25
 
 
 if __name__ == "__main__":
-    vs, chunks = get_retriever_components()
-    
+    vs, bm25 = get_retriever_components()
+
     query = "bearing failure high torque"
-    results = hybrid_search(query, vs, chunks)
-    
+    result = hybrid_search(query, vs, bm25)
+
     print(f"Query: {query}")
-    print(f"Results: {len(results)}")
-    for i, doc in enumerate(results):
-        print(f"\n[{i+1}] {doc.page_content[:150]}")
\ No newline at end of file
+    print(f"Results: {len(result.docs)} (confidence: {result.confidence})")
+    for i, (doc, score) in enumerate(zip(result.docs, result.scores)):
+        print(f"\n[{i+1}] ({score}) {doc.page_content[:150]}")
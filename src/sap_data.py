@@ -0,0 +1,223 @@
+import os
+import csv
+import queue
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from dotenv import load_dotenv
+
+from src.ingestion import sniff_delimiter
+
+load_dotenv()
+
+# TODO: replace this with actual SAP RFC calls ( in production/ reallife)
+SAP_DATA_PATH = os.getenv("SAP_DATA_PATH", "./data/raw/sap_maintenance.csv")
+SAP_POOL_SIZE = int(os.getenv("SAP_POOL_SIZE", "4"))
+
+
+@dataclass(frozen=True)
+class MaintenanceRecord:
+    machine_id: str
+    last_maintenance: str
+    open_work_orders: int
+    bearing_stock: int
+    hydraulic_stock: int
+    status: str
+
+    @classmethod
+    def from_row(cls, row: dict) -> "MaintenanceRecord":
+        row = {k.strip(): (v.strip() if isinstance(v, str) else v) for k, v in row.items()}
+        return cls(
+            machine_id=str(row["machine_id"]),
+            last_maintenance=str(row["last_maintenance"]),
+            open_work_orders=int(row["open_work_orders"]),
+            bearing_stock=int(row["bearing_stock"]),
+            hydraulic_stock=int(row["hydraulic_stock"]),
+            status=str(row["status"]),
+        )
+
+
+class SAPClient(ABC):
+    """
+    What the agents need from SAP PM. The CSV stand-in and a live
+    RFC/OData client both implement this, agents never know which.
+    A client missing one of the lookups fails when it's created, not
+    halfway through a query.
+    """
+
+    @abstractmethod
+    def get_machine(self, machine_id: str) -> Optional[MaintenanceRecord]:
+        ...
+
+    @abstractmethod
+    def by_status(self, status: str) -> List[MaintenanceRecord]:
+        ...
+
+    @abstractmethod
+    def all_records(self) -> List[MaintenanceRecord]:
+        ...
+
+    def version(self) -> str:
+        """Changes whenever the underlying data does, empty if unknown."""
+        return ""
+
+
+class _Snapshot(NamedTuple):
+    version: str
+    records: List[MaintenanceRecord]
+    by_id: Dict[str, MaintenanceRecord]
+    by_status: Dict[str, List[MaintenanceRecord]]
+
+
+class LocalSAPClient(SAPClient):
+    """
+    CSV backed stand-in for SAP, also what tests run against.
+    Table is parsed once with hash indexes on machine_id and status,
+    every call is a dict lookup. A stat() per call picks up a new export
+    (mtime/size change) and reloads it.
+    """
+
+    def __init__(self, path: str = SAP_DATA_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._snapshot: Optional[_Snapshot] = None
+
+    def _file_version(self) -> str:
+        stat = os.stat(self.path)
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    def _load(self, version: str) -> _Snapshot:
+        with open(self.path, encoding="utf-8-sig", newline="") as f:
+            reader = csv.DictReader(f, delimiter=sniff_delimiter(self.path))
+            records = [MaintenanceRecord.from_row(row) for row in reader]
+
+        by_status: Dict[str, List[MaintenanceRecord]] = {}
+        for record in records:
+            by_status.setdefault(record.status, []).append(record)
+        print(f"  → SAP table loaded ({len(records)} machines)")
+        return _Snapshot(version, records, {r.machine_id: r for r in records}, by_status)
+
+    def _current(self) -> _Snapshot:
+        version = self._file_version()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.version != version:
+            with self._lock:
+                if self._snapshot is None or self._snapshot.version != version:
+                    self._snapshot = self._load(version)
+                snapshot = self._snapshot
+        return snapshot
+
+    def get_machine(self, machine_id: str) -> Optional[MaintenanceRecord]:
+        return self._current().by_id.get(machine_id.strip().upper())
+
+    def by_status(self, status: str) -> List[MaintenanceRecord]:
+        return list(self._current().by_status.get(status, []))
+
+    def all_records(self) -> List[MaintenanceRecord]:
+        return list(self._current().records)
+
+    def version(self) -> str:
+        return self._current().version
+
+
+class LocalSAPConnection:
+    """
+    Connection stand-in for PooledSAPClient, answers fetch() from the CSV.
+    A real adapter wraps pyrfc / an OData session behind the same fetch().
+    """
+
+    def __init__(self, path: str = SAP_DATA_PATH):
+        self._table = LocalSAPClient(path)
+
+    def fetch(self, machine_id: Optional[str] = None, status: Optional[str] = None) -> List[dict]:
+        if machine_id is not None:
+            record = self._table.get_machine(machine_id)
+            records = [record] if record else []
+        elif status is not None:
+            records = self._table.by_status(status)
+        else:
+            records = self._table.all_records()
+        return [asdict(record) for record in records]
+
+    def close(self):
+        pass
+
+
+class PooledSAPClient(SAPClient):
+    """
+    Live SAP access over a bounded connection pool.
+    connect() returns a connection with fetch(machine_id=, status=) -> rows
+    and close(). Connections are opened lazily up to pool_size and reused,
+    callers block (up to timeout) when all of them are busy.
+    """
+
+    def __init__(self, connect: Callable[[], object], pool_size: int = SAP_POOL_SIZE, timeout: float = 10.0):
+        self._connect = connect
+        self._pool: "queue.LifoQueue" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._timeout = timeout
+
+    @contextmanager
+    def _connection(self):
+        if not self._slots.acquire(timeout=self._timeout):
+            raise TimeoutError("no SAP connection available")
+        try:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+            except Exception:
+                # don't hand a possibly broken connection to the next caller
+                conn.close()
+                raise
+            self._pool.put(conn)
+        finally:
+            self._slots.release()
+
+    def _query(self, **filters) -> List[MaintenanceRecord]:
+        with self._connection() as conn:
+            rows = conn.fetch(**filters)
+        return [MaintenanceRecord.from_row(row) for row in rows]
+
+    def get_machine(self, machine_id: str) -> Optional[MaintenanceRecord]:
+        records = self._query(machine_id=machine_id.strip().upper())
+        return records[0] if records else None
+
+    def by_status(self, status: str) -> List[MaintenanceRecord]:
+        return self._query(status=status)
+
+    def all_records(self) -> List[MaintenanceRecord]:
+        return self._query()
+
+
+_client: Optional[SAPClient] = None
+_client_lock = threading.Lock()
+
+
+def set_sap_client(client: SAPClient):
+    """Plug in a different backend, e.g. PooledSAPClient around a live RFC connection."""
+    global _client
+    _client = client
+
+
+def get_sap_client() -> SAPClient:
+    """
+    Process-wide SAP client. SAP_BACKEND=local (default) reads the CSV,
+    SAP_BACKEND=pooled runs the pooled client against the CSV connection
+    stand-in, handy to exercise the pool without a live system.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                backend = os.getenv("SAP_BACKEND", "local")
+                if backend == "pooled":
+                    _client = PooledSAPClient(LocalSAPConnection)
+                else:
+                    _client = LocalSAPClient()
+    return _client
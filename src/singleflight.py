@@ -0,0 +1,146 @@
+import os
+import asyncio
+import threading
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from dotenv import load_dotenv
+
+from src.cache import data_version, normalize_query
+from src.telemetry import record_cache
+
+load_dotenv()
+
+# identical questions asked while one is already running wait for that
+# run instead of starting their own. COALESCE_BY_VERSION also keys on the
+# SAP / index version so an answer computed on old data isn't shared
+COALESCE = os.getenv("COALESCE", "1") == "1"
+COALESCE_BY_VERSION = os.getenv("COALESCE_BY_VERSION", "1") == "1"
+
+T = TypeVar("T")
+
+
+def flight_key(query: str) -> str:
+    key = normalize_query(query)
+    if COALESCE_BY_VERSION:
+        key += "|" + data_version()
+    return key
+
+
+class _Call:
+    # one in-flight sync execution, followers block on done
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Request coalescing in front of the pipeline. The first caller for a
+    key runs the work, everyone arriving while it runs gets the same
+    result (or the same exception). Nothing is kept after the run ends,
+    the answer cache takes over from there. Sync callers coalesce with
+    sync callers and async with async - the API is all async, the CLI
+    all sync. Per process, each API worker coalesces on its own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._stats = {"leaders": 0, "followers": 0}
+
+    def _count(self, role: str):
+        with self._lock:
+            self._stats[role] += 1
+        # shows up next to the answer cache - joining a run is a hit
+        record_cache("in_flight", "hit" if role == "followers" else "miss")
+
+    def do(self, key: str, func: Callable[[], T]) -> Tuple[T, bool]:
+        """(result, shared) - shared is True when another caller did the work."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        self._count("leaders" if leader else "followers")
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def start(self, key: str, func: Callable[[], Awaitable[T]]) -> Tuple[asyncio.Task, bool]:
+        """
+        (task, leader) - registers func as the run for key, or returns the
+        one already running. No await in between, so callers on the same
+        loop can set up around the run before anyone else joins it.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            task = self._tasks.get(key)
+            # a task from another event loop can't be awaited here
+            leader = task is None or task.get_loop() is not loop
+            if leader:
+                task = self._tasks[key] = loop.create_task(func())
+                task.add_done_callback(lambda done, key=key: self._forget(key, done))
+        self._count("leaders" if leader else "followers")
+        return task, leader
+
+    async def ado(self, key: str, func: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        task, leader = self.start(key, func)
+        # shielded - one caller disconnecting doesn't cancel the run the
+        # others are waiting on
+        return await asyncio.shield(task), not leader
+
+    def _forget(self, key: str, task: asyncio.Task):
+        with self._lock:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._calls) + len(self._tasks)}
+
+
+_flights: Optional[SingleFlight] = None
+_flights_lock = threading.Lock()
+
+
+def get_flights() -> SingleFlight:
+    global _flights
+    if _flights is None:
+        with _flights_lock:
+            if _flights is None:
+                _flights = SingleFlight()
+    return _flights
+
+
+def coalesced(query: str, func: Callable[[], T]) -> Tuple[T, bool]:
+    if not COALESCE:
+        return func(), False
+    return get_flights().do(flight_key(query), func)
+
+
+async def acoalesced(query: str, func: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+    if not COALESCE:
+        return await func(), False
+    # data_version can touch the engine on first use, not on the loop
+    key = await asyncio.to_thread(flight_key, query)
+    return await get_flights().ado(key, func)
+
+
+def coalesce_stats() -> dict:
+    return get_flights().stats()
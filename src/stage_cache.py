@@ -0,0 +1,103 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from src.llm import LLM_MODEL
+from src.telemetry import record_cache
+
+# seconds each stage's results stay valid, STAGE_CACHE_TTL_<STAGE> overrides.
+# intent and tool choice only depend on the wording, retrieval and the
+# LLM stages are keyed on their full inputs so a longer TTL is safe too
+STAGE_TTLS = {
+    "classifier": 7 * 24 * 3600,
+    "sap_tools": 7 * 24 * 3600,
+    "retrieval": 24 * 3600,
+    "reasoning": 6 * 3600,
+    "synthesis": 6 * 3600,
+}
+STAGE_CACHE_ENTRIES = int(os.getenv("STAGE_CACHE_ENTRIES", "2048"))
+STAGE_CACHE = os.getenv("STAGE_CACHE", "1") == "1"
+
+
+class StageCache:
+    """
+    In-process TTL + LRU memo for one pipeline stage. A query that misses
+    the answer cache usually overlaps an earlier one somewhere - same
+    intent wording, same retrieval, same rendered prompt - and those
+    stages come back from here instead of another Groq call.
+    """
+
+    def __init__(self, name: str, ttl: float, max_entries: int = STAGE_CACHE_ENTRIES):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+
+    def get(self, key: str) -> Optional[Any]:
+        if not STAGE_CACHE:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            value = None
+            if entry is None:
+                self._stats["misses"] += 1
+            elif time.time() - entry[1] > self.ttl:
+                del self._entries[key]
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+            else:
+                value = entry[0]
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+        record_cache(self.name, "miss" if value is None else "hit")
+        return value
+
+    def set(self, key: str, value: Any):
+        if not STAGE_CACHE:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evicted"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {**self._stats, "entries": len(self._entries), "ttl": self.ttl,
+                    "hit_rate": self._stats["hits"] / lookups if lookups else 0.0}
+
+
+_caches: Dict[str, StageCache] = {}
+_caches_lock = threading.Lock()
+
+
+def stage_cache(name: str) -> StageCache:
+    """Shared memo for a stage, created on first use."""
+    with _caches_lock:
+        if name not in _caches:
+            ttl = float(os.getenv(f"STAGE_CACHE_TTL_{name.upper()}", STAGE_TTLS.get(name, 3600)))
+            _caches[name] = StageCache(name, ttl)
+        return _caches[name]
+
+
+def prompt_key(prompt, inputs: dict) -> str:
+    """Hash of the fully rendered prompt, plus the model that answers it."""
+    text = prompt.format(**inputs)
+    return hashlib.sha256(f"{LLM_MODEL}\n{text}".encode()).hexdigest()
+
+
+def stage_stats() -> dict:
+    with _caches_lock:
+        caches = list(_caches.values())
+    return {cache.name: cache.stats() for cache in caches}
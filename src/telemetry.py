@@ -0,0 +1,402 @@
+import os
+import sys
+import time
+import asyncio
+import functools
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# histogram buckets - seconds for timings, plain counts for docs
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50)
+# sampling profiler, off unless asked for (see SamplingProfiler)
+PROFILE_SAMPLING = os.getenv("PROFILE_SAMPLING", "0") == "1"
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+
+_HELP = {
+    "aria_requests_total": ("counter", "Queries answered, by whether the answer cache had them"),
+    "aria_request_seconds": ("histogram", "End to end query time"),
+    "aria_node_seconds": ("histogram", "Wall time per LangGraph node run"),
+    "aria_node_errors_total": ("counter", "LangGraph node runs that raised"),
+    "aria_retrieval_retries_total": ("counter", "Retrieval passes after the first one"),
+    "aria_retrieved_docs": ("histogram", "Documents returned per retrieval pass"),
+    "aria_llm_seconds": ("histogram", "Wall time per LLM call"),
+    "aria_llm_calls_total": ("counter", "LLM calls, by node and outcome"),
+    "aria_llm_tokens_total": ("counter", "LLM tokens, by node and prompt/completion"),
+    "aria_cache_lookups_total": ("counter", "Answer cache and stage memo lookups, by result"),
+    "aria_context_tokens": ("histogram", "Estimated tokens of retrieved context per prompt, by stage"),
+    "aria_context_docs": ("histogram", "Retrieved chunks that made it into the prompt, by stage"),
+    "aria_context_truncated_total": ("counter", "Prompts where the context budget cut chunks"),
+}
+
+
+def _labels(labels: Optional[dict]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v).lower() if isinstance(v, bool) else str(v))
+                        for k, v in (labels or {}).items()))
+
+
+def _format(labels: Tuple[Tuple[str, str], ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+class Metrics:
+    """
+    Process wide counters and histograms, rendered in the Prometheus text
+    format for /metrics. Kept dependency free - a handful of dicts behind
+    a lock is all the pipeline needs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[tuple, float] = {}
+        # (name, labels) -> (buckets, per-bucket counts, sum, count)
+        self._histograms: Dict[tuple, list] = {}
+
+    def inc(self, name: str, labels: Optional[dict] = None, value: float = 1):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: Optional[dict] = None,
+                buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        key = (name, _labels(labels))
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                entry = self._histograms[key] = [buckets, [0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(entry[0]):
+                if value <= bound:
+                    entry[1][i] += 1
+                    break
+            entry[2] += value
+            entry[3] += 1
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self) -> str:
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, [entry[0], list(entry[1]), entry[2], entry[3]])
+                                for key, entry in self._histograms.items())
+
+        lines, described = [], set()
+
+        def describe(name: str):
+            if name in described:
+                return
+            described.add(name)
+            kind, text = _HELP.get(name, ("untyped", name))
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            describe(name)
+            lines.append(f"{name}{_format(labels)} {value:g}")
+        for (name, labels), (buckets, counts, total, count) in histograms:
+            describe(name)
+            # prometheus buckets are cumulative
+            running = 0
+            for bound, n in zip(buckets, counts):
+                running += n
+                lines.append(f"{name}_bucket{_format(labels, ('le', f'{bound:g}'))} {running}")
+            lines.append(f"{name}_bucket{_format(labels, ('le', '+Inf'))} {count}")
+            lines.append(f"{name}_sum{_format(labels)} {total:g}")
+            lines.append(f"{name}_count{_format(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class Trace:
+    """Everything one request did, in order - the per-query timing breakdown."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.spans: List[dict] = []
+
+    def add(self, kind: str, name: str, **fields):
+        span = {"kind": kind, "name": name,
+                "at_ms": round((time.perf_counter() - self.start) * 1000, 1), **fields}
+        with self._lock:
+            self.spans.append(span)
+
+    def breakdown(self) -> dict:
+        with self._lock:
+            spans = list(self.spans)
+        nodes = [s for s in spans if s["kind"] == "node"]
+        llm = [s for s in spans if s["kind"] == "llm"]
+        by_node: Dict[str, float] = {}
+        for span in nodes:
+            by_node[span["name"]] = round(by_node.get(span["name"], 0.0) + span["ms"], 1)
+        return {
+            "total_ms": round((time.perf_counter() - self.start) * 1000, 1),
+            "nodes": by_node,
+            "stages": [{k: v for k, v in s.items() if k != "kind"} for s in nodes],
+            "llm": {
+                "calls": len(llm),
+                "ms": round(sum(s["ms"] for s in llm), 1),
+                "prompt_tokens": sum(s.get("prompt_tokens", 0) for s in llm),
+                "completion_tokens": sum(s.get("completion_tokens", 0) for s in llm),
+                "by_node": [{k: v for k, v in s.items() if k != "kind"} for s in llm],
+            },
+            "cache": [{k: v for k, v in s.items() if k not in ("kind", "at_ms")}
+                      for s in spans if s["kind"] == "cache"],
+            "context": {s["name"]: {k: v for k, v in s.items() if k not in ("kind", "name", "at_ms")}
+                        for s in spans if s["kind"] == "context"},
+        }
+
+
+# current request's trace - langgraph copies the context into the threads
+# and tasks it runs nodes on, so every node of a query sees the same one
+_trace: contextvars.ContextVar = contextvars.ContextVar("aria_trace", default=None)
+
+
+@contextmanager
+def request_trace() -> Iterator[Trace]:
+    trace = Trace()
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+def record(kind: str, name: str, **fields):
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(kind, name, **fields)
+
+
+def record_cache(cache: str, result: str):
+    """One lookup in the answer cache or a stage memo, result hit/miss (or which tier hit)."""
+    metrics.inc("aria_cache_lookups_total", {"cache": cache, "result": result})
+    record("cache", cache, result=result)
+
+
+def observe_request(start: float, cached: bool):
+    seconds = time.perf_counter() - start
+    metrics.inc("aria_requests_total", {"cached": cached})
+    metrics.observe("aria_request_seconds", seconds, {"cached": cached})
+
+
+def _node_done(node: str, state: dict, update: Optional[dict], seconds: float):
+    metrics.observe("aria_node_seconds", seconds, {"node": node})
+    fields: Dict[str, Any] = {"ms": round(seconds * 1000, 1)}
+    if node == "retrieval" and update:
+        iteration = state.get("iterations", 0)
+        if iteration:
+            metrics.inc("aria_retrieval_retries_total")
+        docs = len(update.get("retrieved_docs", []))
+        metrics.observe("aria_retrieved_docs", docs, buckets=COUNT_BUCKETS)
+        fields.update(iteration=iteration, docs=docs, confidence=update.get("retrieval_confidence"))
+    record("node", node, **fields)
+
+
+def traced(node: str, func: Callable) -> Callable:
+    """Wraps a graph node (sync or async) so every run is timed and counted."""
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def arun(state: dict) -> dict:
+            start = time.perf_counter()
+            try:
+                update = await func(state)
+            except Exception:
+                metrics.inc("aria_node_errors_total", {"node": node})
+                raise
+            _node_done(node, state, update, time.perf_counter() - start)
+            return update
+        return arun
+
+    @functools.wraps(func)
+    def run(state: dict) -> dict:
+        start = time.perf_counter()
+        try:
+            update = func(state)
+        except Exception:
+            metrics.inc("aria_node_errors_total", {"node": node})
+            raise
+        _node_done(node, state, update, time.perf_counter() - start)
+        return update
+    return run
+
+
+def _usage(response) -> Tuple[int, int]:
+    # (prompt, completion) tokens - usage_metadata on the message, or the
+    # provider's token_usage block for models that only report it there
+    try:
+        usage = response.generations[0][0].message.usage_metadata
+        if usage:
+            return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    except (AttributeError, IndexError):
+        pass
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+
+class LLMMetrics(BaseCallbackHandler):
+    """
+    Callback attached to every model get_llm hands out. The node making
+    the call comes from the langgraph metadata, calls made outside the
+    graph (scripts, benchmarks) show up as node="other".
+    """
+
+    # called in the caller's thread / task so the request trace is visible
+    run_inline = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running: Dict[Any, tuple] = {}
+
+    def _start(self, run_id, metadata: Optional[dict], params: Optional[dict]):
+        metadata, params = metadata or {}, params or {}
+        model = (metadata.get("ls_model_name") or params.get("model")
+                 or params.get("model_name") or params.get("_type", ""))
+        with self._lock:
+            self._running[run_id] = (time.perf_counter(), metadata.get("langgraph_node", "other"), model)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, metadata, kwargs.get("invocation_params"))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, metadata, kwargs.get("invocation_params"))
+
+    def _finish(self, run_id) -> Optional[tuple]:
+        with self._lock:
+            started = self._running.pop(run_id, None)
+        if started is None:
+            return None
+        start, node, model = started
+        seconds = time.perf_counter() - start
+        metrics.observe("aria_llm_seconds", seconds, {"node": node, "model": model})
+        return node, model, seconds
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        finished = self._finish(run_id)
+        if finished is None:
+            return
+        node, model, seconds = finished
+        prompt_tokens, completion_tokens = _usage(response)
+        metrics.inc("aria_llm_calls_total", {"node": node, "status": "ok"})
+        metrics.inc("aria_llm_tokens_total", {"node": node, "kind": "prompt"}, prompt_tokens)
+        metrics.inc("aria_llm_tokens_total", {"node": node, "kind": "completion"}, completion_tokens)
+        record("llm", node, model=model, ms=round(seconds * 1000, 1),
+               prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        finished = self._finish(run_id)
+        if finished is None:
+            return
+        node, model, seconds = finished
+        metrics.inc("aria_llm_calls_total", {"node": node, "status": "error"})
+        record("llm", node, model=model, ms=round(seconds * 1000, 1), error=type(error).__name__)
+
+
+llm_metrics = LLMMetrics()
+
+
+# top frames in these files mean the thread is parked, not working
+# (thread.py is the executor worker waiting on its queue)
+_IDLE_FILES = {"threading.py", "selectors.py", "queue.py", "base_events.py", "thread.py"}
+
+
+class SamplingProfiler:
+    """
+    Opt-in statistical profiler for finding the hot path under real load.
+    A daemon thread snapshots every thread's stack each `interval`
+    seconds (sys._current_frames), idle threads are skipped. Costs one
+    stack walk per thread per sample, nothing while stopped. Output is
+    folded stacks (flamegraph.pl / speedscope) and a top-N by self time.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+        self._stacks: Counter = Counter()
+        self._self: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="aria-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self._self.clear()
+            self.samples = 0
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            sampled = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or os.path.basename(frame.f_code.co_filename) in _IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                sampled.append(stack)
+            with self._lock:
+                self.samples += 1
+                for stack in sampled:
+                    self._stacks[";".join(reversed(stack))] += 1
+                    self._self[stack[0]] += 1
+
+    def folded(self) -> str:
+        with self._lock:
+            return "\n".join(f"{stack} {count}" for stack, count in self._stacks.most_common())
+
+    def top(self, n: int = 20) -> List[dict]:
+        with self._lock:
+            total = sum(self._self.values())
+            return [{"frame": frame, "samples": count, "share": round(count / total, 4)}
+                    for frame, count in self._self.most_common(n)]
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            f.write(self.folded() + "\n")
+
+
+_profiler: Optional[SamplingProfiler] = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler() -> SamplingProfiler:
+    global _profiler
+    if _profiler is None:
+        with _profiler_lock:
+            if _profiler is None:
+                _profiler = SamplingProfiler()
+    return _profiler
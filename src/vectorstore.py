@@ -1,51 +1,300 @@
 import os
-from typing import List
+import sys
+import json
+import time
+from typing import Iterable, Iterator, List
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from langchain_core.documents import Document
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from dotenv import load_dotenv
 
+import numpy as np
+from src.ingestion import batched, chunk_keys, in_sorted
+from src.embedding_pool import EMBED_BATCH_SIZE, EMBED_WORKERS, EmbeddingPool, sentence_transformer_kwargs
+
 load_dotenv()
 
 EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH", "./data/chroma_db")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME", "aria_manufacturing")
+# chroma, or ann for the in-process quantized index (src/ann_index.py)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+
+# chroma persists every batch, so a killed build loses at most one batch
+# big enough that every embedding worker gets a full share of it
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "1024"))
+
+if VECTOR_BACKEND == "ann":
+    from src.ann_index import ANN_INDEX_PATH, ANNIndexBuilder, ANNVectorStore, ann_index_exists, load_ann_index
+    STORE_PATH = ANN_INDEX_PATH
+    CHECKPOINT_PATH = ANN_INDEX_PATH + ".checkpoint.json"
+elif VECTOR_BACKEND == "chroma":
+    STORE_PATH = CHROMA_DB_PATH
+    CHECKPOINT_PATH = os.path.join(CHROMA_DB_PATH, "ingest_checkpoint.json")
+else:
+    raise ValueError(f"VECTOR_BACKEND must be chroma or ann, not {VECTOR_BACKEND}")
 
 
 def get_embeddings():
     # free, open source runs locally on my pc no costing 
     # MiniLM is fast and good enough for technical docs
+    if os.getenv("EMBED_BACKEND") == "fake":
+        # offline stand-in, benchmarks / no model download
+        from src.offline import HashEmbeddings
+        return HashEmbeddings()
     print("Loading embedding model...")
     return HuggingFaceEmbeddings(
         model_name=EMBEDDING_MODEL,
-        model_kwargs={"device": "cpu"},
+        model_kwargs=sentence_transformer_kwargs(),
         encode_kwargs={"normalize_embeddings": True}
     )
 
 
-def build_vectorstore(chunks: List[Document]) -> Chroma:
-    # Embed all chunks and store in ChromaDB.
+def _id_pages(vs: Chroma, page_size: int = 10000) -> Iterator[List[str]]:
+    # paged so a million-row collection doesn't come back in one response
+    offset = 0
+    while True:
+        page = vs.get(include=[], limit=page_size, offset=offset)["ids"]
+        yield page
+        if len(page) < page_size:
+            return
+        offset += page_size
 
-    print(f"Embedding {len(chunks)} chunks, this takes a few minutes...")
-    embeddings = get_embeddings()
 
-    vs = Chroma.from_documents(
-        documents=chunks,
-        embedding=embeddings,
-        persist_directory=CHROMA_DB_PATH,
-        collection_name=COLLECTION_NAME
-    )
+class _KeySet:
+    """
+    Chunk keys (ingestion.chunk_keys) seen so far, as a few sorted uint64
+    runs - 8 bytes a chunk instead of a str in a python set. A new run
+    gets merged into the one before it once that's no more than twice its
+    size, so there are only ever ~log(n) runs to check.
+    """
+
+    def __init__(self):
+        self.runs: List[np.ndarray] = []
+
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        found = np.zeros(len(keys), dtype=bool)
+        for run in self.runs:
+            found |= in_sorted(run, keys)
+        return found
+
+    def add(self, keys: np.ndarray):
+        """keys must be unique and not in the set yet."""
+        if not len(keys):
+            return
+        self.runs.append(np.sort(keys))
+        while len(self.runs) > 1 and len(self.runs[-2]) <= 2 * len(self.runs[-1]):
+            last = self.runs.pop()
+            self.runs[-1] = np.sort(np.concatenate([self.runs[-1], last]), kind="stable")
+
+
+class _ChromaSink:
+    # new vectors go straight into the collection, stale ids get deleted
+    def __init__(self):
+        self.vs = load_vectorstore()
+
+    def existing_keys(self) -> np.ndarray:
+        return np.unique(np.concatenate([chunk_keys(page) for page in _id_pages(self.vs)]))
+
+    def stale(self, seen: _KeySet) -> List[str]:
+        # ids are only needed for the few that get deleted, page them again
+        return [cid for page in _id_pages(self.vs)
+                for cid, gone in zip(page, ~seen.contains(chunk_keys(page))) if gone]
+
+    def ready(self) -> bool:
+        # batches are persisted as they go, an empty or missing collection
+        # means the store was wiped since the BM25 index was built
+        return os.path.isdir(CHROMA_DB_PATH) and self.vs._collection.count() > 0
+
+    def keep(self, doc_id: int, cid: str):
+        pass
+
+    def add(self, doc_ids: List[int], docs: List[Document], vectors):
+        # straight to the collection, vs.add_documents would embed again
+        self.vs._collection.upsert(
+            ids=[doc.metadata["chunk_id"] for doc in docs],
+            embeddings=vectors.tolist(),
+            documents=[doc.page_content for doc in docs],
+            metadatas=[doc.metadata for doc in docs]
+        )
+
+    def finish(self, stale: List[str], bm25):
+        for i in range(0, len(stale), INGEST_BATCH_SIZE):
+            self.vs.delete(ids=stale[i:i + INGEST_BATCH_SIZE])
+        return self.vs
+
+
+class _ANNSink:
+    # vectors are laid out in BM25 doc order, unchanged chunks are copied
+    # from the previous index. the new index replaces the old one in
+    # finish(), an interrupted build leaves the old one in place and its
+    # new vectors in the builder's tmp store for the next run to reuse
+    def __init__(self):
+        self.builder = ANNIndexBuilder()
+
+    def existing_keys(self) -> np.ndarray:
+        return self.builder.existing_keys()
 
-    print(f"Done. Saved to {CHROMA_DB_PATH}")
+    def stale(self, seen: _KeySet) -> List[int]:
+        # nothing to delete, the new index just doesn't lay them out
+        existing = self.builder.existing_keys()
+        return existing[~seen.contains(existing)].tolist()
+
+    def ready(self) -> bool:
+        # vectors picked up from an interrupted build still need a save
+        return ann_index_exists() and not self.builder.changed
+
+    def keep(self, doc_id: int, cid: str):
+        self.builder.keep(doc_id, cid)
+
+    def add(self, doc_ids: List[int], docs: List[Document], vectors):
+        self.builder.add(doc_ids, [doc.metadata["chunk_id"] for doc in docs], vectors)
+
+    def finish(self, stale: List[str], bm25):
+        if bm25 is None:
+            # nothing changed, the index on disk is still current
+            self.builder.discard()
+            return load_vectorstore()
+        self.builder.save(bm25.version)
+        return load_vectorstore(bm25)
+
+
+def _write_checkpoint(state: dict):
+    os.makedirs(os.path.dirname(CHECKPOINT_PATH) or ".", exist_ok=True)
+    tmp = CHECKPOINT_PATH + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, CHECKPOINT_PATH)
+
+
+def build_vectorstore(chunks: Iterable[Document], workers: int = EMBED_WORKERS,
+                      batch_size: int = EMBED_BATCH_SIZE):
+    """
+    Incremental build - only embeds chunks the collection doesn't have yet.
+    Chunk ids are content hashes, so a changed row is a new id plus a
+    stale one, and rows gone from the source get deleted.
+    Resumable: the collection itself is the checkpoint, after a crash the
+    next run diffs against what was already committed and carries on.
+    New chunks are embedded on a pool of worker processes and written to
+    chroma in bulk with precomputed vectors.
+
+    chunks is consumed as a stream (pass ingestion.iter_chunks()), only
+    one batch of documents plus 8 byte keys of the ids is held in memory.
+    VECTOR_BACKEND=ann writes the quantized index instead of chroma, from
+    the same pass (it shares the BM25 doc ids, see ann_index.py).
+    """
+    from src.ingestion import chunk_id
+    from src.bm25_index import BM25IndexBuilder, bm25_index_exists
+    from src.failure_stats import FAILURE_STATS_PATH, FailureStatsBuilder
+
+    sink = _ANNSink() if VECTOR_BACKEND == "ann" else _ChromaSink()
+    existing = sink.existing_keys()
+
+    # a killed build may have stored vectors without the BM25 index / stats
+    # that go with them, those get saved this time whatever the diff says
+    interrupted = False
+    if os.path.exists(CHECKPOINT_PATH):
+        with open(CHECKPOINT_PATH) as f:
+            last = json.load(f)
+        if last.get("status") == "in_progress":
+            interrupted = True
+            print(f"Resuming interrupted build ({last['done']} chunks were done)")
+
+    # keyword index is built in the same pass so queries only ever memory-map it
+    bm25_builder = BM25IndexBuilder()
+    # same for the failure pattern aggregates, historical queries read those
+    stats_builder = FailureStatsBuilder()
+    checkpoint = {"status": "in_progress", "done": 0, "started": time.time()}
+    seen = _KeySet()
+    n_docs = 0
+    pending: List[Document] = []
+    pending_ids: List[int] = []
+    pool = None
+
+    def flush():
+        nonlocal pool
+        if pool is None:
+            # model only gets loaded if there's actually something new
+            pool = EmbeddingPool(EMBEDDING_MODEL, workers=workers, batch_size=batch_size)
+        vectors = pool.embed([doc.page_content for doc in pending])
+        sink.add(pending_ids, pending, vectors)
+        checkpoint["done"] += len(pending)
+        _write_checkpoint(checkpoint)
+        print(f"  → embedded {checkpoint['done']} ({pool.throughput:.1f} chunks/sec)")
+        pending.clear()
+        pending_ids.clear()
+
+    try:
+        for batch in batched(chunks, INGEST_BATCH_SIZE):
+            cids = [chunk_id(chunk) for chunk in batch]
+            keys = chunk_keys(cids)
+            # identical chunks share an id, first one wins
+            fresh = np.zeros(len(batch), dtype=bool)
+            fresh[np.unique(keys, return_index=True)[1]] = True
+            fresh &= ~seen.contains(keys)
+            seen.add(keys[fresh])
+            stored = in_sorted(existing, keys)
+            for chunk, cid, take, have in zip(batch, cids, fresh, stored):
+                if not take:
+                    continue
+                chunk.metadata["chunk_id"] = cid
+                # position in the BM25 index, the ANN index uses the same ids
+                doc_id = n_docs
+                n_docs += 1
+                bm25_builder.add_documents([chunk])
+                stats_builder.add_documents([chunk])
+                if not have:
+                    pending.append(chunk)
+                    pending_ids.append(doc_id)
+                else:
+                    sink.keep(doc_id, cid)
+            if len(pending) >= INGEST_BATCH_SIZE:
+                flush()
+        if pending:
+            flush()
+    finally:
+        if pool is not None:
+            pool.close()
+            print(f"Embedding throughput: {pool.throughput:.1f} chunks/sec")
+
+    stale = sink.stale(seen)
+
+    # cheap next to embedding, only swapped in when anything moved
+    bm25 = None
+    if interrupted or checkpoint["done"] or stale or not bm25_index_exists() or not sink.ready():
+        bm25 = bm25_builder.save()
+    else:
+        bm25_builder.discard()
+    if interrupted or checkpoint["done"] or stale or not os.path.exists(FAILURE_STATS_PATH):
+        stats_builder.save()
+    vs = sink.finish(stale, bm25)
+
+    checkpoint["status"] = "complete"
+    _write_checkpoint(checkpoint)
+    print(f"Sync: {n_docs} chunks, {checkpoint['done']} new, {len(stale)} stale, "
+          f"{n_docs - checkpoint['done']} unchanged")
+    print(f"Done. Saved to {STORE_PATH}")
     return vs
 
 
-def load_vectorstore() -> Chroma:
-    """Load existing vectorstore from disk - fast, no re-embedding."""
+def load_vectorstore(bm25=None):
+    """
+    Load existing vectorstore from disk - fast, no re-embedding.
+    The ANN backend reads text and filters from the BM25 index, pass the
+    one already loaded (engine does) or it maps its own.
+    """
     print("Loading vectorstore from disk...")
     embeddings = get_embeddings()
 
+    if VECTOR_BACKEND == "ann":
+        from src.bm25_index import load_bm25_index
+        index = load_ann_index()
+        if index is None:
+            raise FileNotFoundError(f"no ANN index at {ANN_INDEX_PATH}, build it with python src/vectorstore.py")
+        return ANNVectorStore(index, embeddings, bm25 or load_bm25_index())
+
     return Chroma(
         persist_directory=CHROMA_DB_PATH,
         embedding_function=embeddings,
@@ -54,18 +303,22 @@ def load_vectorstore() -> Chroma:
 
 
 def vectorstore_exists() -> bool:
+    if VECTOR_BACKEND == "ann":
+        return ann_index_exists()
     return os.path.exists(CHROMA_DB_PATH)
 
 
 if __name__ == "__main__":
-    from ingestion import load_and_chunk_all
+    import argparse
+    from src.ingestion import iter_chunks
 
-    if vectorstore_exists():
-        print("Vectorstore already exists, loading...")
-        vs = load_vectorstore()
-    else:
-        chunks = load_and_chunk_all()
-        vs = build_vectorstore(chunks)
+    parser = argparse.ArgumentParser(description="build / update the ARIA vectorstore")
+    parser.add_argument("--workers", type=int, default=EMBED_WORKERS, help="embedding processes")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="chunks per forward pass")
+    args = parser.parse_args()
+
+    # safe to rerun after every data export, only the diff gets embedded
+    vs = build_vectorstore(iter_chunks(), workers=args.workers, batch_size=args.batch_size)
 
     # test output / checkmark 
     results = vs.similarity_search("bearing failure high torque", k=3)